@@ -50,15 +50,22 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'mailing.metrics.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'users.roles.RolesMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Повторяющиеся за один запрос отпечатки SQL (N+1) пишутся в лог mailing.querylog
+QUERY_DEBUG = os.getenv('QUERY_DEBUG') == 'True'
+if QUERY_DEBUG:
+    MIDDLEWARE.insert(0, 'mailing.querylog.DuplicateQueryMiddleware')
+
 ROOT_URLCONF = 'axiohm.urls'
 
 TEMPLATES = [
@@ -72,6 +79,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'users.roles.roles',
             ],
         },
     },
@@ -146,11 +154,89 @@ EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD')
 EMAIL_USE_SSL = True
 EMAIL_USE_TLS = False
+EMAIL_TIMEOUT = int(os.getenv('EMAIL_TIMEOUT') or 30)
+
+# Mailing dispatcher
+# Движок доставки: 'sync' - последовательно в потоке планировщика, 'threads' - на пуле потоков,
+# 'asyncio' - асинхронный SMTP-клиент с MAILING_ASYNC_CONCURRENCY одновременными соединениями,
+# 'celery' - пачки получателей уходят в очередь Celery и доставляются воркерами
+MAILING_DELIVERY_ENGINE = os.getenv('MAILING_DELIVERY_ENGINE') or 'sync'
+MAILING_DISPATCH_WORKERS = int(os.getenv('MAILING_DISPATCH_WORKERS') or 8)
+MAILING_ASYNC_CONCURRENCY = int(os.getenv('MAILING_ASYNC_CONCURRENCY') or 100)
+MAILING_SMTP_POOL_SIZE = int(os.getenv('MAILING_SMTP_POOL_SIZE') or 1)
+MAILING_SMTP_HEALTHCHECK_INTERVAL = int(os.getenv('MAILING_SMTP_HEALTHCHECK_INTERVAL') or 30)
+MAILING_SEND_CHUNK_SIZE = int(os.getenv('MAILING_SEND_CHUNK_SIZE') or 100)
+MAILING_OUTBOX_LEASE = int(os.getenv('MAILING_OUTBOX_LEASE') or 300)
+# Сколько дней хранить отправленные и окончательно неудачные строки outbox: их результат
+# уже записан в Log, а сами строки только замедляют захват
+MAILING_OUTBOX_RETENTION_DAYS = int(os.getenv('MAILING_OUTBOX_RETENTION_DAYS') or 7)
+# Часовой пояс расписаний рассылок без собственного time_zone и число ближайших запусков,
+# которые расписание держит посчитанными
+MAILING_TIME_ZONE = os.getenv('MAILING_TIME_ZONE') or TIME_ZONE
+MAILING_RECURRENCE_CACHE_SIZE = int(os.getenv('MAILING_RECURRENCE_CACHE_SIZE') or 16)
+# Повтор после временных ошибок (4xx, таймаут, обрыв): число попыток, экспоненциальная задержка
+# от базовой до максимальной в секундах и период задания повторов
+MAILING_RETRY_MAX_ATTEMPTS = int(os.getenv('MAILING_RETRY_MAX_ATTEMPTS') or 5)
+MAILING_RETRY_BASE_DELAY = int(os.getenv('MAILING_RETRY_BASE_DELAY') or 60)
+MAILING_RETRY_MAX_DELAY = int(os.getenv('MAILING_RETRY_MAX_DELAY') or 3600)
+MAILING_RETRY_INTERVAL = int(os.getenv('MAILING_RETRY_INTERVAL') or 30)
+# Ограничение скорости отправки: писем в секунду и размер всплеска на аккаунт EMAIL_HOST_USER,
+# суточная квота аккаунта и скорость на домен получателя; 0 - без ограничения. Состояние
+# ограничений лежит в кэше: без общего кэша (CACHE_ENABLED) check выдает mailing.W001
+MAILING_ACCOUNT_RATE = float(os.getenv('MAILING_ACCOUNT_RATE') or 0)
+MAILING_ACCOUNT_BURST = int(os.getenv('MAILING_ACCOUNT_BURST') or 0)
+MAILING_ACCOUNT_DAILY_LIMIT = int(os.getenv('MAILING_ACCOUNT_DAILY_LIMIT') or 0)
+MAILING_DOMAIN_RATE = float(os.getenv('MAILING_DOMAIN_RATE') or 0)
+MAILING_DOMAIN_BURST = int(os.getenv('MAILING_DOMAIN_BURST') or 0)
+MAILING_THROTTLE_MAX_WAIT = int(os.getenv('MAILING_THROTTLE_MAX_WAIT') or 30)
+# Выбор лидера среди реплик диспетчера: срок аренды лидерства (без Postgres) и период
+# ее продления и попыток захвата запасными репликами, в секундах
+MAILING_LEADER_TTL = int(os.getenv('MAILING_LEADER_TTL') or 15)
+MAILING_LEADER_POLL_INTERVAL = int(os.getenv('MAILING_LEADER_POLL_INTERVAL') or 5)
+MAILING_LOG_BATCH_SIZE = int(os.getenv('MAILING_LOG_BATCH_SIZE') or 500)
+MAILING_LOG_FLUSH_INTERVAL = int(os.getenv('MAILING_LOG_FLUSH_INTERVAL') or 5)
+# Хранение Log: строки старше срока сворачиваются в LogRollup, выгружаются в архив и удаляются.
+# На Postgres таблица секционирована по месяцам, секции создаются на столько месяцев вперед
+MAILING_LOG_RETENTION_DAYS = int(os.getenv('MAILING_LOG_RETENTION_DAYS') or 180)
+MAILING_LOG_ARCHIVE_DIR = os.getenv('MAILING_LOG_ARCHIVE_DIR') or str(BASE_DIR / 'archive')
+MAILING_LOG_PARTITIONS_AHEAD = int(os.getenv('MAILING_LOG_PARTITIONS_AHEAD') or 3)
+# Импорт клиентов из CSV: строк в одной пачке проверки и upsert
+MAILING_IMPORT_BATCH_SIZE = int(os.getenv('MAILING_IMPORT_BATCH_SIZE') or 1000)
+# Рассылки одного сегмента, стартующие в пределах стольких секунд, делят один снимок состава
+MAILING_SEGMENT_SNAPSHOT_TTL = int(os.getenv('MAILING_SEGMENT_SNAPSHOT_TTL') or 60)
+# Счетчики главной страницы и пул id записей блога живут в кэше столько секунд;
+# диспетчер пересчитывает счетчики по БД с периодом MAILING_STATS_RECONCILE_INTERVAL
+MAILING_STATS_TTL = int(os.getenv('MAILING_STATS_TTL') or 600)
+MAILING_STATS_RECONCILE_INTERVAL = int(os.getenv('MAILING_STATS_RECONCILE_INTERVAL') or 120)
+# Страницы рассылки и отчета о доставке кэшируются на столько секунд; при изменении
+# данных версии ключей сбрасываются сразу (нужен общий кэш, CACHE_ENABLED)
+MAILING_VIEW_CACHE_TTL = int(os.getenv('MAILING_VIEW_CACHE_TTL') or 86400)
+# Запись журнала доставки сбрасывает отчет не чаще раза в столько секунд; пропущенный сброс
+# делает ближайший тик диспетчера
+MAILING_VIEW_CACHE_LOG_INTERVAL = int(os.getenv('MAILING_VIEW_CACHE_LOG_INTERVAL') or 30)
+
+# Метрики Prometheus на /metrics отдаются сотрудникам (is_staff) и запросам с заголовком
+# Authorization: Bearer <токен>, если токен задан. Для нескольких процессов задайте
+# PROMETHEUS_MULTIPROC_DIR
+METRICS_TOKEN = os.getenv('METRICS_TOKEN') or ''
+
+# Celery
+CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL') or 'redis://localhost:6379/0'
+CELERY_TASK_ALWAYS_EAGER = os.getenv('CELERY_TASK_ALWAYS_EAGER') == 'True'
+CELERY_TASK_IGNORE_RESULT = True
+CELERY_TIMEZONE = TIME_ZONE
 
 # Users
 AUTH_USER_MODEL = 'users.User'
 LOGIN_REDIRECT_URL = '/'
 LOGOUT_REDIRECT_URL = '/'
+# Группы и права пользователя кэшируются на столько секунд (сбрасываются и при их изменении);
+# без общего кэша (CACHE_ENABLED) роли читаются из БД на каждый запрос
+ROLES_CACHE_TTL = int(os.getenv('ROLES_CACHE_TTL') or 3600)
+
+# Blog
+# Просмотры записей копятся в кэше и переносятся в БД диспетчером с этим периодом, в секундах
+BLOG_VIEWS_FLUSH_INTERVAL = int(os.getenv('BLOG_VIEWS_FLUSH_INTERVAL') or 60)
 
 # cache
 CACHE_ENABLED = os.getenv('CACHE_ENABLED') == 'True'
@@ -19,11 +19,14 @@ from django.urls import path, include
 from django.conf.urls.static import static
 from django.conf import settings
 
+from mailing.metrics import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('mailing.urls')),
     path('users/', include('users.urls')),
     path('blog/', include('blog.urls')),
+    path('metrics', metrics_view, name='metrics'),
 ]
 
 if settings.DEBUG:
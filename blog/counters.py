@@ -0,0 +1,125 @@
+import logging
+from functools import lru_cache, wraps
+
+import redis
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.backends.redis import RedisCache
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+
+from blog.models import BlogPost
+
+logger = logging.getLogger(__name__)
+
+# Просмотры записей копятся атомарным cache.incr по slug и раз в BLOG_VIEWS_FLUSH_INTERVAL
+# секунд переносятся в views_count одним UPDATE на пачку записей. Slug записей с накопленными
+# просмотрами лежат в множестве Redis, так что сброс не перебирает все записи блога. Копить
+# можно только в общем кэше (Redis): при другом кэше просмотры пишутся в БД сразу, через F().
+# Встроенный RedisCache не отдает клиент Redis, поэтому множество ведется своим клиентом
+# redis-py на сервере кэша.
+VIEWS_KEY = 'blog:views:%s'
+DIRTY_KEY = 'blog:views:dirty'
+FLUSH_CHUNK_SIZE = 500
+
+
+def write_behind():
+    return settings.CACHE_ENABLED and isinstance(cache, RedisCache)
+
+
+@lru_cache(maxsize=None)
+def redis_client():
+    """Клиент redis-py к серверу кэша, куда пишет RedisCache (первому из LOCATION)."""
+    location = settings.CACHES['default']['LOCATION']
+    if isinstance(location, str):
+        location = location.split(',')
+    return redis.Redis.from_url(location[0])
+
+
+def dirty_set():
+    """Клиент Redis и ключ множества slug с накопленными просмотрами."""
+    return redis_client(), cache.make_and_validate_key(DIRTY_KEY)
+
+
+def mark_dirty(slugs):
+    if slugs:
+        client, key = dirty_set()
+        client.sadd(key, *slugs)
+
+
+def record_view(slug):
+    if not write_behind():
+        BlogPost.objects.filter(slug=slug).update(views_count=F('views_count') + 1)
+        return
+    key = VIEWS_KEY % slug
+    try:
+        views = cache.incr(key)
+    except ValueError:
+        # Ключа еще нет; если его успел создать параллельный запрос, add не сработает.
+        views = 1 if cache.add(key, 1, None) else cache.incr(key)
+    # В множество slug попадает первым просмотром после сброса; остаток, пришедший во
+    # время сброса, возвращает в множество сам сброс.
+    if views == 1:
+        mark_dirty([slug])
+
+
+def count_views(view):
+    """
+    Считает просмотр записи снаружи cache_page, так что считаются и ответы из кэша страниц.
+    Представление получает slug записи как именованный аргумент.
+    """
+    @wraps(view)
+    def wrapped(request, *args, **kwargs):
+        response = view(request, *args, **kwargs)
+        if request.method == 'GET' and response.status_code == 200:
+            record_view(kwargs['slug'])
+        return response
+    return wrapped
+
+
+def flush_chunk(slugs):
+    """
+    Переносит просмотры записей slugs в БД. Возвращает число перенесенных просмотров и slug,
+    просмотры которых пришли во время переноса и остались в кэше.
+    """
+    cached = cache.get_many([VIEWS_KEY % slug for slug in slugs])
+    pending = {slug: cached[VIEWS_KEY % slug] for slug in slugs if cached.get(VIEWS_KEY % slug)}
+    if not pending:
+        return 0, []
+    # Сначала вычитаем перенесенное из кэша: просмотры, пришедшие после чтения, останутся там.
+    remaining = [slug for slug, count in pending.items() if cache.decr(VIEWS_KEY % slug, count) > 0]
+    try:
+        with transaction.atomic():
+            BlogPost.objects.filter(slug__in=pending).update(views_count=F('views_count') + Case(
+                *[When(slug=slug, then=Value(count)) for slug, count in pending.items()],
+                default=Value(0), output_field=IntegerField(),
+            ))
+    except Exception:
+        for slug, count in pending.items():
+            cache.incr(VIEWS_KEY % slug, count)
+        mark_dirty(list(pending))
+        raise
+    return sum(pending.values()), remaining
+
+
+def flush_view_counts():
+    """Переносит накопленные в кэше просмотры в views_count. Возвращает число перенесенных просмотров."""
+    if not write_behind():
+        return 0
+    client, key = dirty_set()
+    flushed = 0
+    remaining = []
+    try:
+        while True:
+            slugs = [slug.decode() for slug in client.spop(key, FLUSH_CHUNK_SIZE)]
+            if not slugs:
+                break
+            chunk_flushed, chunk_remaining = flush_chunk(slugs)
+            flushed += chunk_flushed
+            remaining += chunk_remaining
+    finally:
+        # Возвращаем после цикла, чтобы частые просмотры одной записи не зациклили сброс.
+        mark_dirty(remaining)
+    if flushed:
+        logger.info("Flushed %s blog post views", flushed)
+    return flushed
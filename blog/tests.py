@@ -1,3 +1,72 @@
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from blog import counters
+from blog.models import BlogPost
+
+LOCMEM_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'blog-tests'}}
+
+
+class FakeRedis:
+    """Множества Redis в памяти: только команды, которые нужны blog.counters."""
+
+    def __init__(self):
+        self.sets = {}
+
+    def sadd(self, key, *values):
+        self.sets.setdefault(key, set()).update(value.encode() for value in values)
+
+    def spop(self, key, count):
+        members = self.sets.get(key, set())
+        return [members.pop() for _ in range(min(count, len(members)))]
+
+
+class ViewCountersTests(TestCase):
+
+    def setUp(self):
+        self.posts = [
+            BlogPost.objects.create(title='Post %s' % i, slug='post-%s' % i, content='text', preview_image='x.png')
+            for i in range(3)
+        ]
+
+    def views(self):
+        return dict(BlogPost.objects.values_list('slug', 'views_count'))
+
+    def test_without_shared_cache_views_go_to_db(self):
+        counters.record_view('post-0')
+        counters.record_view('post-0')
+        self.assertEqual(self.views(), {'post-0': 2, 'post-1': 0, 'post-2': 0})
+        self.assertEqual(counters.flush_view_counts(), 0)
+
+    @override_settings(CACHES=LOCMEM_CACHE, CACHE_ENABLED=True)
+    def test_write_behind_flush(self):
+        cache.clear()
+        fake = FakeRedis()
+        with mock.patch('blog.counters.write_behind', return_value=True), \
+                mock.patch('blog.counters.redis_client', return_value=fake), \
+                mock.patch('blog.counters.FLUSH_CHUNK_SIZE', 1):
+            for slug in ['post-0', 'post-0', 'post-2', 'post-0']:
+                counters.record_view(slug)
+            self.assertEqual(self.views(), {'post-0': 0, 'post-1': 0, 'post-2': 0})
+
+            self.assertEqual(counters.flush_view_counts(), 4)
+            self.assertEqual(self.views(), {'post-0': 3, 'post-1': 0, 'post-2': 1})
+            self.assertEqual(cache.get(counters.VIEWS_KEY % 'post-0'), 0)
+            self.assertEqual(counters.flush_view_counts(), 0)
+
+            counters.record_view('post-1')
+            self.assertEqual(counters.flush_view_counts(), 1)
+            self.assertEqual(self.views(), {'post-0': 3, 'post-1': 1, 'post-2': 1})
+
+    def test_redis_client_uses_first_cache_server(self):
+        counters.redis_client.cache_clear()
+        self.addCleanup(counters.redis_client.cache_clear)
+        caches = {'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': 'redis://primary:6379/1,redis://replica:6379/1',
+        }}
+        with override_settings(CACHES=caches):
+            kwargs = counters.redis_client().connection_pool.connection_kwargs
+        self.assertEqual((kwargs['host'], kwargs['db']), ('primary', 1))
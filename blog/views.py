@@ -32,26 +32,14 @@ class BlogPostListView(ListView):
     }
 
     def get_queryset(self, *args, **kwargs):
-        queryset = BlogPost.objects.filter(is_published=True)
+        queryset = BlogPost.objects.filter(is_published=True).select_related('owner')
         return queryset
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        user = self.request.user
-        user_group_names = [group.name for group in user.groups.all()]
-        context['user_group_names'] = user_group_names
-        return context
-
 
 class BlogPostDetailView(DetailView):
+    """Просмотры считает blog.counters.count_views в urls.py, снаружи cache_page."""
     model = BlogPost
 
-    def get_object(self, queryset=None):
-        self.object = super().get_object(queryset)
-        self.object.views_count += 1
-        self.object.save()
-        return self.object
-
 
 class BlogPostUpdateView(LoginRequiredMixin, UpdateView):
     model = BlogPost
@@ -70,8 +58,7 @@ class BlogPostUpdateView(LoginRequiredMixin, UpdateView):
     def get_object(self, queryset=None):
         title = super().get_object(queryset)
         blog = get_object_or_404(BlogPost, title=title)
-        user_groups = [group.name for group in self.request.user.groups.all()]
-        if blog.owner != self.request.user and 'Manager' not in user_groups:
+        if blog.owner != self.request.user and not self.request.roles.is_manager:
             raise Http404
         return blog
 
@@ -89,7 +76,6 @@ class BlogPostDeleteView(LoginRequiredMixin, DeleteView):
     def get_object(self, queryset=None):
         title = super().get_object(queryset)
         blog = get_object_or_404(BlogPost, title=title)
-        user_groups = [group.name for group in self.request.user.groups.all()]
-        if blog.owner != self.request.user and 'Managers' not in user_groups:
+        if blog.owner != self.request.user and not self.request.roles.is_manager:
             raise Http404
-        return blog
\ No newline at end of file
+        return blog
@@ -0,0 +1,9 @@
+# Настройки gunicorn для запуска axiohm.wsgi. Мастер убирает метрики Prometheus воркера,
+# который завершился, в том числе аварийно, иначе его живые gauge остаются в
+# PROMETHEUS_MULTIPROC_DIR и попадают в /metrics.
+
+
+def child_exit(server, worker):
+    from mailing.metrics import mark_process_dead
+
+    mark_process_dead(worker.pid)
@@ -1,7 +1,13 @@
 from django.contrib import admin
-from .models import Client, Mailing, Message, Log
+from .models import Client, Mailing, Message, Log, Delivery, SMTPReply, LogRollup, Tag, Segment, SegmentSnapshot
 
 admin.site.register(Client)
 admin.site.register(Mailing)
 admin.site.register(Message)
 admin.site.register(Log)
+admin.site.register(Delivery)
+admin.site.register(SMTPReply)
+admin.site.register(LogRollup)
+admin.site.register(Tag)
+admin.site.register(Segment)
+admin.site.register(SegmentSnapshot)
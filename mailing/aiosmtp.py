@@ -0,0 +1,188 @@
+import asyncio
+import base64
+import smtplib
+import ssl
+
+from django.core.mail.utils import DNS_NAME
+
+CRLF = b'\r\n'
+
+
+class AsyncSMTPClient:
+    """
+    Минимальный асинхронный SMTP-клиент на asyncio-потоках. Ошибки поднимаются теми же
+    исключениями smtplib, что и у синхронного бэкенда Django, чтобы их можно было
+    обрабатывать одинаково. Если сервер объявляет PIPELINING, команды конверта
+    (MAIL, RCPT, DATA) отправляются одним пакетом.
+    """
+
+    def __init__(self, host, port, username=None, password=None, use_ssl=False, use_tls=False, timeout=30):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_ssl = use_ssl
+        self.use_tls = use_tls
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+        self.extensions = {}
+
+    @property
+    def is_connected(self):
+        return self.writer is not None and not self.writer.is_closing()
+
+    @property
+    def pipelining(self):
+        return 'PIPELINING' in self.extensions
+
+    async def connect(self):
+        ssl_context = ssl.create_default_context() if self.use_ssl else None
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, ssl=ssl_context), self.timeout
+        )
+        try:
+            await self.handshake()
+        except BaseException:
+            # Сессия без EHLO, TLS или входа непригодна: закрываем ее, чтобы следующая
+            # отправка подключилась заново, а не слала MAIL FROM в неавторизованную сессию.
+            await self.close()
+            raise
+
+    async def handshake(self):
+        code, reply = await self.read_reply()
+        if code != 220:
+            raise smtplib.SMTPConnectError(code, reply)
+        await self.ehlo()
+        if self.use_tls:
+            await self.command('STARTTLS', expect=220)
+            await asyncio.wait_for(
+                self.writer.start_tls(ssl.create_default_context(), server_hostname=self.host), self.timeout
+            )
+            await self.ehlo()
+        if self.username:
+            await self.login()
+
+    async def ehlo(self):
+        code, reply = await self.command('EHLO %s' % DNS_NAME.get_fqdn())
+        if code != 250:
+            raise smtplib.SMTPHeloError(code, reply)
+        self.extensions = {}
+        for line in reply.decode('latin-1').splitlines()[1:]:
+            keyword, _, params = line.partition(' ')
+            self.extensions[keyword.upper()] = params
+
+    async def login(self):
+        mechanisms = self.extensions.get('AUTH', '').upper().split()
+        if 'PLAIN' in mechanisms or not mechanisms:
+            token = base64.b64encode(('\0%s\0%s' % (self.username, self.password)).encode()).decode()
+            code, reply = await self.command('AUTH PLAIN %s' % token)
+        else:
+            await self.command('AUTH LOGIN', expect=334)
+            await self.command(base64.b64encode(self.username.encode()).decode(), expect=334)
+            code, reply = await self.command(base64.b64encode(self.password.encode()).decode())
+        if code not in (235, 503):
+            raise smtplib.SMTPAuthenticationError(code, reply)
+
+    async def read_reply(self):
+        lines = []
+        while True:
+            try:
+                line = await asyncio.wait_for(self.reader.readline(), self.timeout)
+            except asyncio.TimeoutError:
+                await self.close()
+                raise smtplib.SMTPServerDisconnected('Timed out waiting for reply from %s' % self.host)
+            if not line:
+                await self.close()
+                raise smtplib.SMTPServerDisconnected('Connection unexpectedly closed')
+            lines.append(line[4:].rstrip(CRLF))
+            if line[3:4] != b'-':
+                return int(line[:3]), b'\n'.join(lines)
+
+    async def write(self, data):
+        self.writer.write(data)
+        try:
+            await asyncio.wait_for(self.writer.drain(), self.timeout)
+        except asyncio.TimeoutError:
+            # Неизвестно, сколько данных ушло: поток рассинхронизирован с сервером.
+            await self.close()
+            raise smtplib.SMTPServerDisconnected('Timed out sending to %s' % self.host)
+
+    async def command(self, line, expect=None):
+        await self.write(line.encode() + CRLF)
+        code, reply = await self.read_reply()
+        if expect is not None and code != expect:
+            raise smtplib.SMTPResponseException(code, reply)
+        return code, reply
+
+    async def sendmail(self, from_addr, to_addrs, data):
+        """
+        Отправляет одно письмо. Возвращает словарь отклоненных получателей, как smtplib;
+        если не принят ни один получатель, поднимает SMTPRecipientsRefused.
+        """
+        commands = ['MAIL FROM:<%s>' % from_addr] + ['RCPT TO:<%s>' % addr for addr in to_addrs] + ['DATA']
+        if self.pipelining:
+            await self.write(b''.join(command.encode() + CRLF for command in commands))
+            replies = [await self.read_reply() for _ in commands]
+        else:
+            replies = []
+            for command in commands:
+                replies.append(await self.command(command))
+                if replies[0][0] != 250:
+                    break
+
+        code, reply = replies[0]
+        if code != 250:
+            await self.reset()
+            raise smtplib.SMTPSenderRefused(code, reply, from_addr)
+
+        refused = {
+            addr: rcpt_reply for addr, rcpt_reply in zip(to_addrs, replies[1:-1]) if rcpt_reply[0] not in (250, 251)
+        }
+        code, reply = replies[-1]
+        if code != 354:
+            await self.reset()
+            if len(refused) == len(to_addrs):
+                raise smtplib.SMTPRecipientsRefused(refused)
+            raise smtplib.SMTPDataError(code, reply)
+        if len(refused) == len(to_addrs):
+            await self.write(b'.' + CRLF)
+            await self.read_reply()
+            raise smtplib.SMTPRecipientsRefused(refused)
+
+        await self.write(self.quote_data(data))
+        code, reply = await self.read_reply()
+        if code != 250:
+            raise smtplib.SMTPDataError(code, reply)
+        return refused
+
+    @staticmethod
+    def quote_data(data):
+        data = data.replace(b'\r\n', b'\n')
+        if data.endswith(b'\n'):
+            data = data[:-1]
+        lines = data.split(b'\n')
+        return b''.join((b'.' + line if line.startswith(b'.') else line) + CRLF for line in lines) + b'.' + CRLF
+
+    async def reset(self):
+        try:
+            await self.command('RSET')
+        except smtplib.SMTPServerDisconnected:
+            pass
+
+    async def quit(self):
+        if self.is_connected:
+            try:
+                await self.command('QUIT')
+            except (smtplib.SMTPException, OSError):
+                pass
+        await self.close()
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except (OSError, ssl.SSLError):
+                pass
+        self.reader = self.writer = None
@@ -1,5 +1,3 @@
-from time import sleep
-
 from django.apps import AppConfig
 
 
@@ -7,11 +5,5 @@ class MailingConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'mailing'
 
-    #def ready(self):
-        #from jobs import updater
-        #sleep(2)
-        #updater.start()
-
     def ready(self):
-        from django.core.management import call_command
-        call_command('start_scheduler')
\ No newline at end of file
+        from mailing import checks, signals  # noqa: F401
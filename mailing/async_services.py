@@ -0,0 +1,100 @@
+import asyncio
+import logging
+import smtplib
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections
+from mailing import metrics
+from mailing.aiosmtp import AsyncSMTPClient
+from mailing.logs import LogWriter
+from mailing.outbox import acomplete, arelease, claim_batch
+from mailing.services import build_email, get_throttle
+
+logger = logging.getLogger(__name__)
+
+
+def get_client():
+    return AsyncSMTPClient(
+        host=settings.EMAIL_HOST,
+        port=settings.EMAIL_PORT,
+        username=settings.EMAIL_HOST_USER,
+        password=settings.EMAIL_HOST_PASSWORD,
+        use_ssl=settings.EMAIL_USE_SSL,
+        use_tls=settings.EMAIL_USE_TLS,
+        timeout=settings.EMAIL_TIMEOUT,
+    )
+
+
+async def dispatch_async(result, retry=False):
+    """
+    Асинхронный движок доставки: MAILING_ASYNC_CONCURRENCY сопрограмм держат по одному
+    SMTP-соединению и по очереди захватывают пачки outbox, пока те не кончатся.
+    """
+    log_writer = LogWriter()
+    throttle = get_throttle()
+    workers = [deliver_worker(log_writer, throttle, retry) for _ in range(settings.MAILING_ASYNC_CONCURRENCY)]
+    try:
+        for outcome in await asyncio.gather(*workers, return_exceptions=True):
+            if isinstance(outcome, Exception):
+                logger.error("Delivery worker failed: %s", outcome)
+            else:
+                result.add(*outcome)
+    finally:
+        await log_writer.aflush()
+        await sync_to_async(connections.close_all)()
+
+
+async def deliver_worker(log_writer, throttle, retry=False):
+    client = get_client()
+    sent = failed = deferred = 0
+    try:
+        # Захват идет в транзакции с SELECT ... FOR UPDATE, а транзакций асинхронный ORM Django 4.2
+        # не поддерживает, поэтому claim_batch выполняется в потоке.
+        while deliveries := await sync_to_async(claim_batch)(retry=retry):
+            batch_sent, batch_failed, deferred = await send_deliveries_async(client, deliveries, log_writer, throttle)
+            sent += batch_sent
+            failed += batch_failed
+            if deferred:
+                break
+    finally:
+        await client.quit()
+    return sent, failed, deferred
+
+
+async def send_deliveries_async(client, deliveries, log_writer, throttle=None):
+    """
+    Отправляет захваченную пачку outbox через соединение сопрограммы, переподключаясь
+    при обрыве, и отмечает строки. Перед каждым письмом ждет разрешения ограничителя
+    скорости; не поместившиеся в лимит строки возвращаются в outbox.
+    Возвращает (отправлено, ошибок, отложено).
+    """
+    sent = failed = 0
+    errors = []
+    for delivery in deliveries:
+        if throttle is not None:
+            delay = await sync_to_async(throttle.reserve)(delivery.recipient)
+            if delay is None:
+                break
+            await asyncio.sleep(delay)
+        email_message = build_email(delivery)
+        error = None
+        try:
+            if not client.is_connected:
+                with metrics.Timer(metrics.smtp_connect_duration):
+                    await client.connect()
+            with metrics.Timer(metrics.smtp_send_duration):
+                await client.sendmail(
+                    email_message.from_email, [delivery.recipient], email_message.message().as_bytes(linesep='\r\n')
+                )
+            sent += 1
+        except (smtplib.SMTPException, OSError, asyncio.TimeoutError) as e:
+            error = e
+            failed += 1
+            logger.error("Failed to send email to %s: %s", delivery.recipient, e)
+        errors.append(error)
+        await log_writer.aadd(delivery.message, delivery.client_id, delivery.recipient, error)
+    attempted, deferred = deliveries[:len(errors)], deliveries[len(errors):]
+    await acomplete(attempted, errors)
+    await arelease(deferred)
+    logger.info("Sent %s emails, %s failed", sent, failed)
+    return sent, failed, len(deferred)
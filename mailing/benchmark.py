@@ -0,0 +1,191 @@
+import logging
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+
+from mailing.models import Delivery, Log, Mailing, Message
+from mailing.outbox import claimable
+from mailing.services import get_due_mailings, send_mailings
+from mailing.smtp_sink import SMTPSink
+
+logger = logging.getLogger(__name__)
+
+BENCHMARK_DOMAIN = 'bench.local'
+
+
+def benchmark_mailings(prefix):
+    return Mailing.objects.filter(owner__email__startswith='%s-' % prefix, owner__email__endswith=BENCHMARK_DOMAIN)
+
+
+def reset_benchmark_data(prefix):
+    """Возвращает сгенерированные рассылки в состояние «пора отправлять» и чистит их outbox и Log."""
+    mailings = benchmark_mailings(prefix)
+    Delivery.objects.filter(message__mailing__in=mailings).delete()
+    Log.objects.filter(message__mailing__in=mailings).delete()
+    mailings.update(status='started', next_run_at=timezone.now())
+
+
+def ensure_isolated(prefix):
+    """
+    Тик send_mailings разбирает все наступившие рассылки и весь outbox, а не только данные
+    бенчмарка. Если есть чужая работа, тик разослал бы ее в SMTP-приемник и сдвинул
+    расписания настоящих рассылок, поэтому прогон отказывается с ValueError.
+    """
+    now = timezone.now()
+    mailings = benchmark_mailings(prefix)
+    due = get_due_mailings(now).exclude(pk__in=mailings).count()
+    deliveries = Delivery.objects.filter(claimable(now) | claimable(now, retry=True)) \
+        .exclude(message__mailing__in=mailings).count()
+    if due or deliveries:
+        raise ValueError(
+            'Refusing to run: %s due mailings and %s outbox rows outside the benchmark data '
+            'would be sent by the tick' % (due, deliveries)
+        )
+
+
+def dataset_size(prefix):
+    mailings = benchmark_mailings(prefix)
+    return {
+        'mailings': mailings.count(),
+        'recipients': Mailing.recipients.through.objects.filter(mailing__in=mailings).count(),
+        'messages': Message.objects.filter(mailing__in=mailings).count(),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def sink_email_settings(sink):
+    """Настройки почты, направляющие отправку в локальный SMTP-приемник sink."""
+    return {
+        'EMAIL_BACKEND': 'django.core.mail.backends.smtp.EmailBackend',
+        'EMAIL_HOST': sink.host,
+        'EMAIL_PORT': sink.port,
+        'EMAIL_USE_SSL': False,
+        'EMAIL_USE_TLS': False,
+        'EMAIL_HOST_USER': 'benchmark@%s' % BENCHMARK_DOMAIN,
+        'EMAIL_HOST_PASSWORD': 'benchmark',
+    }
+
+
+def run_tick(engine, sink):
+    """
+    Один тик send_mailings выбранным движком против SMTP-приемника sink. Запросы считаются
+    только на соединении текущего потока: у движка threads часть запросов идет мимо счетчика.
+    """
+    sink.reset_stats()
+    with override_settings(MAILING_DELIVERY_ENGINE=engine), CaptureQueriesContext(connection) as queries:
+        started = time.perf_counter()
+        result = send_mailings()
+        tick_seconds = time.perf_counter() - started
+    stats = sink.stats()
+    return {
+        'engine': engine,
+        'tick_seconds': tick_seconds,
+        'mailings': result.mailings,
+        'queued': result.queued,
+        'sent': result.sent,
+        'failed': result.failed,
+        'delivered': stats['messages'],
+        'messages_per_second': stats['messages'] / tick_seconds if tick_seconds else None,
+        'smtp_connections': stats['connections'],
+        'queries': len(queries),
+    }
+
+
+def measure_peak_memory(engine):
+    # tracemalloc замедляет интерпретатор в разы, поэтому пик памяти меряется отдельным тиком.
+    tracemalloc.start()
+    try:
+        with override_settings(MAILING_DELIVERY_ENGINE=engine):
+            send_mailings()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_benchmark(engines, repeat, prefix, smtp_delay=0):
+    """
+    Прогоняет тик диспетчера по каждому движку repeat раз на сгенерированных данных
+    и возвращает отчет, пригодный для сохранения в JSON и сравнения с базовым прогоном.
+    Celery-движок меряется только в eager-режиме, иначе тик лишь ставит задачи в очередь.
+    Перед каждым тиком проверяет ensure_isolated.
+    """
+    sink = SMTPSink(delay=smtp_delay).start_in_thread()
+    runs = []
+    try:
+        with override_settings(**sink_email_settings(sink)):
+            for engine in engines:
+                engine_runs = []
+                for run in range(repeat):
+                    ensure_isolated(prefix)
+                    reset_benchmark_data(prefix)
+                    outcome = run_tick(engine, sink)
+                    outcome['run'] = run
+                    engine_runs.append(outcome)
+                    logger.info("Benchmark %s run %s: %s", engine, run, outcome)
+                ensure_isolated(prefix)
+                reset_benchmark_data(prefix)
+                peak_memory = measure_peak_memory(engine)
+                for outcome in engine_runs:
+                    outcome['peak_memory_bytes'] = peak_memory
+                runs.extend(engine_runs)
+    finally:
+        sink.stop_thread()
+        reset_benchmark_data(prefix)
+    return {
+        'created_at': timezone.now().isoformat(),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'database': connection.vendor,
+        'dataset': dataset_size(prefix),
+        'settings': {
+            name: getattr(settings, name) for name in (
+                'MAILING_DISPATCH_WORKERS', 'MAILING_ASYNC_CONCURRENCY', 'MAILING_SMTP_POOL_SIZE',
+                'MAILING_SEND_CHUNK_SIZE', 'MAILING_LOG_BATCH_SIZE',
+            )
+        },
+        'smtp_delay': smtp_delay,
+        'runs': runs,
+        'summary': summarize(runs),
+    }
+
+
+def summarize(runs):
+    """Медианы по каждому движку: по ним и сравниваются прогоны."""
+    summary = {}
+    for engine in dict.fromkeys(run['engine'] for run in runs):
+        engine_runs = [run for run in runs if run['engine'] == engine]
+        summary[engine] = {
+            metric: statistics.median(run[metric] for run in engine_runs)
+            for metric in ('tick_seconds', 'messages_per_second', 'queries', 'peak_memory_bytes')
+            if all(run[metric] is not None for run in engine_runs)
+        }
+    return summary
+
+
+def compare(report, baseline):
+    """Относительное изменение медиан текущего прогона к базовому: {движок: {метрика: доля}}."""
+    changes = {}
+    for engine, metrics in report['summary'].items():
+        base = baseline.get('summary', {}).get(engine)
+        if not base:
+            continue
+        changes[engine] = {
+            metric: (value - base[metric]) / base[metric]
+            for metric, value in metrics.items() if base.get(metric)
+        }
+    return changes
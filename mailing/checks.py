@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+# Кэши, состояние которых живет в одном процессе: у каждого воркера и узла свое ведро.
+LOCAL_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register(Tags.caches)
+def check_throttle_cache(app_configs, **kwargs):
+    """Ограничение скорости работает только на общем кэше: иначе лимит умножается на число процессов."""
+    throttled = settings.MAILING_ACCOUNT_RATE or settings.MAILING_ACCOUNT_DAILY_LIMIT or settings.MAILING_DOMAIN_RATE
+    if not throttled:
+        return []
+    if settings.CACHE_ENABLED and settings.CACHES['default']['BACKEND'] not in LOCAL_CACHE_BACKENDS:
+        return []
+    return [Warning(
+        'Send throttling is enabled without a shared cache.',
+        hint='Token buckets and the daily quota live in the cache; with a per-process cache every worker and '
+             'node gets its own limit. Set CACHE_ENABLED=True with a shared backend such as Redis.',
+        id='mailing.W001',
+    )]
@@ -0,0 +1,140 @@
+import logging
+import queue
+import smtplib
+import threading
+import time
+
+from django.conf import settings
+from django.core.mail import get_connection
+
+from mailing import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class SMTPConnectionPool:
+    """
+    Пул открытых и авторизованных соединений почтового бэкенда на время одного тика рассылки.
+    Соединение открывается один раз (TLS-рукопожатие и логин), а дальше переиспользуется
+    для всех писем. Перед выдачей давно простаивавшее соединение проверяется командой NOOP
+    и при необходимости переподключается.
+    """
+
+    def __init__(self, size=None, backend=None, healthcheck_interval=None):
+        self.size = size or settings.MAILING_SMTP_POOL_SIZE
+        self.backend = backend
+        if healthcheck_interval is None:
+            healthcheck_interval = settings.MAILING_SMTP_HEALTHCHECK_INTERVAL
+        self.healthcheck_interval = healthcheck_interval
+        self._idle = queue.LifoQueue()
+        self._connections = []
+        self._last_used = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _open(self):
+        connection = get_connection(self.backend, fail_silently=False)
+        with metrics.Timer(metrics.smtp_connect_duration):
+            connection.open()
+        logger.info("Opened SMTP connection to %s", getattr(connection, 'host', self.backend))
+        return connection
+
+    @staticmethod
+    def is_alive(connection):
+        # Бэкенды без SMTP-сессии (locmem, console, file) проверять нечем.
+        if not hasattr(connection, 'connection'):
+            return True
+        if connection.connection is None:
+            return False
+        try:
+            return connection.connection.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def reconnect(self, connection):
+        logger.warning("Reconnecting SMTP connection to %s", getattr(connection, 'host', self.backend))
+        try:
+            connection.close()
+        except (smtplib.SMTPException, OSError):
+            pass
+        with metrics.Timer(metrics.smtp_connect_duration):
+            connection.open()
+
+    def acquire(self):
+        try:
+            connection = self._idle.get_nowait()
+        except queue.Empty:
+            connection = None
+            with self._lock:
+                if len(self._connections) < self.size:
+                    connection = self._open()
+                    self._connections.append(connection)
+            if connection is None:
+                connection = self._idle.get()
+
+        last_used = self._last_used.get(id(connection))
+        if last_used is not None and time.monotonic() - last_used >= self.healthcheck_interval \
+                or getattr(connection, 'connection', True) is None:
+            if not self.is_alive(connection):
+                self.reconnect(connection)
+        return connection
+
+    def release(self, connection):
+        self._last_used[id(connection)] = time.monotonic()
+        self._idle.put(connection)
+
+    def send_batch(self, emails, throttle=None):
+        """
+        Отправляет пачку писем через одно соединение пула. Каждое письмо уходит отдельным
+        вызовом send_messages, чтобы ошибка одного письма не скрывала результат остальных.
+        Если передан throttle, перед каждым письмом ждет разрешения ограничителя скорости,
+        а когда лимит исчерпан, останавливается. Возвращает список пар (письмо, исключение
+        или None) для отправленной части пачки. После любой ошибки, кроме отказа сервера,
+        соединение переоткрывается; если его не восстановить, остаток пачки возвращается
+        с ошибкой переподключения, а пул переподключит соединение при следующей выдаче.
+        """
+        results = []
+        connection = self.acquire()
+        try:
+            for email in emails:
+                if throttle is not None and not throttle.wait(email.to[0]):
+                    break
+                try:
+                    with metrics.Timer(metrics.smtp_send_duration):
+                        connection.send_messages([email])
+                    results.append((email, None))
+                except (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused) as e:
+                    # Сервер ответил отказом на это письмо - SMTP-сессия цела.
+                    results.append((email, e))
+                except Exception as e:
+                    # Обрыв, таймаут или сбой посреди SMTP-диалога: в каком состоянии сессия,
+                    # неизвестно, поэтому соединение переоткрывается до следующего письма
+                    # и до возврата в пул.
+                    results.append((email, e))
+                    try:
+                        self.reconnect(connection)
+                    except (smtplib.SMTPException, OSError) as error:
+                        # Сервер не принимает соединение: отправленная часть пачки остается
+                        # отправленной, ошибку получают только неотправленные письма.
+                        logger.error("Failed to reconnect SMTP connection: %s", error)
+                        results.extend((pending, error) for pending in emails[len(results):])
+                        break
+        finally:
+            self.release(connection)
+        return results
+
+    def close(self):
+        with self._lock:
+            for connection in self._connections:
+                try:
+                    connection.close()
+                except (smtplib.SMTPException, OSError):
+                    logger.exception("Failed to close SMTP connection")
+            self._connections = []
+            self._last_used = {}
+            self._idle = queue.LifoQueue()
@@ -0,0 +1,81 @@
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from mailing.models import Client, Log
+
+# Колонки выгрузок: (заголовок, поле для values_list).
+LOG_FIELDS = (
+    ('id', 'id'),
+    ('timestamp', 'timestamp'),
+    ('mailing_id', 'message__mailing_id'),
+    ('message_id', 'message_id'),
+    ('subject', 'message__subject'),
+    ('client_id', 'client_id'),
+    ('recipient', 'recipient'),
+    ('status', 'status'),
+    ('reply_code', 'reply__code'),
+    ('reply_text', 'reply__text'),
+)
+CLIENT_FIELDS = (
+    ('id', 'id'),
+    ('email', 'email'),
+    ('full_name', 'full_name'),
+    ('comment', 'comment'),
+    ('is_active', 'is_active'),
+    ('owner', 'owner__email'),
+)
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+EXPORT_CHUNK_SIZE = 2000
+
+
+def log_export_queryset(queryset=None):
+    queryset = Log.objects.all() if queryset is None else queryset
+    return queryset.order_by('timestamp', 'id'), LOG_FIELDS
+
+
+def client_export_queryset(queryset=None):
+    queryset = Client.objects.all() if queryset is None else queryset
+    return queryset.order_by('id'), CLIENT_FIELDS
+
+
+class Echo:
+    """Псевдофайл для csv.writer: writerow возвращает готовую строку вместо записи в буфер."""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows, headers):
+    writer = csv.writer(Echo())
+    yield writer.writerow(headers)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def ndjson_lines(rows, headers):
+    for row in rows:
+        yield json.dumps(dict(zip(headers, row)), ensure_ascii=False, cls=DjangoJSONEncoder) + '\n'
+
+
+def export_rows(queryset, fields, fmt, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Выгрузка queryset в CSV или NDJSON кусками текста. Строки читаются iterator() по
+    chunk_size (на Postgres - серверным курсором) и склеиваются в кусок по chunk_size строк,
+    поэтому память не зависит от размера выгрузки.
+    """
+    headers = [header for header, lookup in fields]
+    rows = queryset.values_list(*[lookup for header, lookup in fields]).iterator(chunk_size=chunk_size)
+    lines = csv_lines(rows, headers) if fmt == 'csv' else ndjson_lines(rows, headers)
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= chunk_size:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
@@ -1,11 +1,12 @@
 from django import forms
-from .models import Mailing, Message, Client
+from django.contrib.auth import get_user_model
+from .models import Mailing, Message, Client, Log, Segment, Tag
 
 
 class MailingForm(forms.ModelForm):
     class Meta:
         model = Mailing
-        fields = ['start_time', 'frequency', 'recipients', 'status']
+        fields = ['start_time', 'frequency', 'schedule', 'time_zone', 'segment', 'recipients', 'status']
         widgets = {
             'recipients': forms.CheckboxSelectMultiple,
         }
@@ -15,6 +16,13 @@ class MailingForm(forms.ModelForm):
         super(MailingForm, self).__init__(*args, **kwargs)
         if user:
             self.fields['recipients'].queryset = user.client_set.all()
+            self.fields['segment'].queryset = user.segment_set.all()
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if not cleaned_data.get('segment') and not cleaned_data.get('recipients'):
+            raise forms.ValidationError('Выберите сегмент или получателей из списка')
+        return cleaned_data
 
 
 class MessageForm(forms.ModelForm):
@@ -24,11 +32,79 @@ class MessageForm(forms.ModelForm):
 
 
 class ClientForm(forms.ModelForm):
+    new_tags = forms.CharField(required=False, label='Новые метки', help_text='Через запятую')
+
     class Meta:
         model = Client
-        fields = ['email', 'full_name', 'comment', 'is_active']
+        fields = ['email', 'full_name', 'comment', 'is_active', 'tags']
 
         widgets = {
             'comment': forms.Textarea(attrs={'rows': 4}),  # Можно настроить виджет для текстового поля 'comment'
+            'tags': forms.CheckboxSelectMultiple,
+        }
+
+    def __init__(self, *args, **kwargs):
+        user = kwargs.pop('user', None)
+        super().__init__(*args, **kwargs)
+        # Метки принадлежат владельцу клиента; у нового клиента владелец - текущий пользователь.
+        self.tag_owner = self.instance.owner if self.instance.owner_id else user
+        self.fields['tags'].queryset = Tag.objects.filter(owner=self.tag_owner)
+
+    def _save_m2m(self):
+        super()._save_m2m()
+        names = {name.strip() for name in self.cleaned_data['new_tags'].split(',') if name.strip()}
+        for name in names:
+            tag, _ = Tag.objects.get_or_create(owner=self.tag_owner, name=name[:50])
+            self.instance.tags.add(tag)
+
+
+class SegmentForm(forms.ModelForm):
+    class Meta:
+        model = Segment
+        fields = ['name', 'tags', 'created_since']
+        widgets = {
+            'tags': forms.CheckboxSelectMultiple,
+            'created_since': forms.DateTimeInput(attrs={'type': 'datetime-local'}),
         }
 
+    def __init__(self, *args, **kwargs):
+        user = kwargs.pop('user')
+        super().__init__(*args, **kwargs)
+        self.fields['tags'].queryset = Tag.objects.filter(owner=user)
+
+
+class ClientImportForm(forms.Form):
+    file = forms.FileField(label='CSV-файл', help_text='Колонки: email, full_name, comment, is_active')
+
+
+class DeliveryReportFilterForm(forms.Form):
+    """
+    Фильтры отчета о доставке. Рассылка задается номером, владелец - email, а не выпадающими
+    списками: список всех рассылок и пользователей рос бы с их числом и устаревал бы
+    в кэше страницы. Значение ищется одним запросом, только когда фильтр задан.
+    """
+    mailing = forms.ModelChoiceField(
+        queryset=Mailing.objects.none(), required=False, label='Рассылка №',
+        widget=forms.NumberInput(attrs={'min': 1}),
+        error_messages={'invalid_choice': 'Нет такой рассылки'},
+    )
+    owner = forms.ModelChoiceField(
+        queryset=get_user_model().objects.none(), required=False, label='Владелец', to_field_name='email',
+        widget=forms.EmailInput, error_messages={'invalid_choice': 'Нет такого пользователя'},
+    )
+    status = forms.TypedChoiceField(
+        choices=[('', 'Все')] + Log.status_choices, coerce=int, empty_value=None, required=False, label='Статус'
+    )
+    date_from = forms.DateField(required=False, label='С', widget=forms.DateInput(attrs={'type': 'date'}))
+    date_to = forms.DateField(required=False, label='По', widget=forms.DateInput(attrs={'type': 'date'}))
+
+    def __init__(self, *args, **kwargs):
+        user = kwargs.pop('user')
+        see_all = kwargs.pop('see_all', False)
+        super().__init__(*args, **kwargs)
+        if see_all:
+            self.fields['mailing'].queryset = Mailing.objects.all()
+            self.fields['owner'].queryset = get_user_model().objects.all()
+        else:
+            self.fields['mailing'].queryset = Mailing.objects.filter(owner=user)
+            del self.fields['owner']
@@ -0,0 +1,112 @@
+import codecs
+import csv
+from dataclasses import dataclass, field
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.auth.base_user import BaseUserManager
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import transaction
+
+from mailing import stats, viewcache
+from mailing.models import Client
+
+TRUE_VALUES = {'', '1', 'true', 'yes', 'y', 'да'}
+FALSE_VALUES = {'0', 'false', 'no', 'n', 'нет'}
+MAX_REPORTED_ERRORS = 100
+
+
+@dataclass
+class ImportResult:
+    """Итог импорта клиентов; errors - первые MAX_REPORTED_ERRORS отклоненных строк (номер строки, причина)."""
+    inserted: int = 0
+    updated: int = 0
+    rejected: int = 0
+    errors: list = field(default_factory=list)
+
+    def reject(self, line, reason):
+        self.rejected += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, reason))
+
+
+def read_csv(lines):
+    """
+    Строки CSV как словари с номером строки файла. lines - любой итератор текстовых строк,
+    файл читается построчно и целиком в память не попадает.
+    """
+    reader = csv.DictReader(lines)
+    if not reader.fieldnames or 'email' not in [name.strip().lower() for name in reader.fieldnames]:
+        raise ValueError('В файле нет колонки email')
+    for row in reader:
+        yield reader.line_num, {(key or '').strip().lower(): (value or '').strip() for key, value in row.items()}
+
+
+def read_uploaded_csv(uploaded_file):
+    """Загруженный файл Django как строки CSV: большие загрузки лежат во временном файле и читаются с диска."""
+    return read_csv(codecs.iterdecode(uploaded_file, 'utf-8-sig'))
+
+
+def clean_row(row):
+    """Client из строки CSV или ValidationError с причиной отказа."""
+    email = BaseUserManager.normalize_email(row.get('email', ''))
+    if len(email) > Client._meta.get_field('email').max_length:
+        raise ValidationError('Слишком длинный адрес')
+    validate_email(email)
+    full_name = row.get('full_name', '')
+    if not full_name:
+        raise ValidationError('Не указано имя')
+    if len(full_name) > Client._meta.get_field('full_name').max_length:
+        raise ValidationError('Слишком длинное имя')
+    is_active = row.get('is_active', '').lower()
+    if is_active not in TRUE_VALUES | FALSE_VALUES:
+        raise ValidationError('Неверное значение is_active')
+    return Client(email=email, full_name=full_name, comment=row.get('comment', ''), is_active=is_active in TRUE_VALUES)
+
+
+def import_batch(rows, owner, result):
+    clients = {}
+    for line, row in rows:
+        try:
+            client = clean_row(row)
+        except ValidationError as error:
+            result.reject(line, '; '.join(error.messages))
+            continue
+        client.owner = owner
+        # Повтор адреса внутри пачки: побеждает последняя строка.
+        clients[client.email] = (line, client)
+
+    existing = dict(Client.objects.filter(email__in=clients).values_list('email', 'owner_id'))
+    if owner is not None:
+        for email, owner_id in existing.items():
+            if owner_id is not None and owner_id != owner.pk:
+                line, client = clients.pop(email)
+                result.reject(line, 'Адрес принадлежит клиенту другого пользователя')
+    if not clients:
+        return
+    with transaction.atomic():
+        Client.objects.bulk_create(
+            [client for line, client in clients.values()],
+            update_conflicts=True, unique_fields=['email'], update_fields=['full_name', 'comment', 'is_active'],
+        )
+    updated = len(existing.keys() & clients.keys())
+    result.updated += updated
+    result.inserted += len(clients) - updated
+
+
+def import_clients(rows, owner=None, batch_size=None):
+    """
+    Загружает клиентов из строк read_csv пачками по batch_size: каждая пачка проверяется
+    и записывается одним INSERT ... ON CONFLICT (email) DO UPDATE. Владелец задается только
+    новым клиентам; адреса, уже принадлежащие другому владельцу, отклоняются.
+    """
+    batch_size = batch_size or settings.MAILING_IMPORT_BATCH_SIZE
+    result = ImportResult()
+    rows = iter(rows)
+    while batch := list(islice(rows, batch_size)):
+        import_batch(batch, owner, result)
+    # bulk_create не шлет post_save, счетчики главной страницы пересчитаются заново.
+    stats.invalidate_counters()
+    viewcache.bump('client')
+    return result
@@ -0,0 +1,94 @@
+import logging
+import uuid
+import zlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, IntegrityError, connections
+from django.db.models import Q
+from django.utils import timezone
+
+from mailing.models import DispatcherLease
+from mailing.outbox import worker_id
+
+logger = logging.getLogger(__name__)
+
+
+class LeaderElection:
+    """
+    Выбор одного лидера среди реплик диспетчера. На Postgres лидер держит сессионный
+    advisory-замок на отдельном соединении: если процесс упал или соединение оборвалось,
+    сервер снимает замок сразу, и запасная реплика захватывает его при следующей попытке.
+    На остальных базах лидерство - это аренда в таблице DispatcherLease, которую лидер
+    продлевает каждые MAILING_LEADER_POLL_INTERVAL секунд, а запасные реплики забирают
+    после истечения MAILING_LEADER_TTL.
+    """
+
+    def __init__(self, name, ttl=None):
+        self.name = name
+        self.ttl = ttl or settings.MAILING_LEADER_TTL
+        self.identity = '%s:%s' % (worker_id(), uuid.uuid4().hex[:8])
+        self.key = zlib.crc32(name.encode())
+        self.is_leader = False
+        self._connection = None
+
+    def acquire(self):
+        """Пытается стать лидером или подтверждает лидерство. Возвращает, лидер ли эта реплика."""
+        was_leader = self.is_leader
+        try:
+            if connections[DEFAULT_DB_ALIAS].vendor == 'postgresql':
+                self.is_leader = self._acquire_advisory_lock()
+            else:
+                self.is_leader = self._acquire_lease()
+        except DatabaseError:
+            logger.exception("Leader election for %s failed", self.name)
+            self._close_connection()
+            self.is_leader = False
+        if self.is_leader != was_leader:
+            logger.info("%s %s leadership of %s", self.identity, 'acquired' if self.is_leader else 'lost', self.name)
+        return self.is_leader
+
+    def release(self):
+        if not self.is_leader:
+            return
+        try:
+            if self._connection is not None:
+                with self._connection.cursor() as cursor:
+                    cursor.execute('SELECT pg_advisory_unlock(%s)', [self.key])
+            else:
+                # Отдаем аренду сразу, чтобы запасная реплика не ждала ее истечения.
+                DispatcherLease.objects.filter(name=self.name, holder=self.identity).update(expires_at=timezone.now())
+        except DatabaseError:
+            logger.exception("Failed to release leadership of %s", self.name)
+        finally:
+            self._close_connection()
+            self.is_leader = False
+
+    def _acquire_advisory_lock(self):
+        # Замок живет, пока живет сессия, поэтому держим для него собственное соединение,
+        # которое не закрывают ни запросы, ни задания планировщика.
+        if self._connection is None:
+            self._connection = connections.create_connection(DEFAULT_DB_ALIAS)
+        with self._connection.cursor() as cursor:
+            if self.is_leader:
+                cursor.execute('SELECT 1')
+                return True
+            cursor.execute('SELECT pg_try_advisory_lock(%s)', [self.key])
+            return cursor.fetchone()[0]
+
+    def _acquire_lease(self):
+        now = timezone.now()
+        try:
+            DispatcherLease.objects.get_or_create(name=self.name, defaults={'expires_at': now})
+        except IntegrityError:
+            pass
+        return bool(DispatcherLease.objects.filter(Q(holder=self.identity) | Q(expires_at__lte=now), name=self.name)
+                    .update(holder=self.identity, expires_at=now + timedelta(seconds=self.ttl)))
+
+    def _close_connection(self):
+        if self._connection is not None:
+            try:
+                self._connection.close()
+            except DatabaseError:
+                pass
+            self._connection = None
@@ -0,0 +1,127 @@
+import logging
+import smtplib
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Q
+
+from mailing import metrics, viewcache
+from mailing.models import Log, SMTPReply
+
+logger = logging.getLogger(__name__)
+
+
+def describe_error(error):
+    """
+    Код и текст ответа SMTP-сервера для исключения отправки. Для ошибок без ответа
+    сервера (обрыв соединения, таймаут) код не известен.
+    """
+    if isinstance(error, smtplib.SMTPRecipientsRefused) and error.recipients:
+        code, reply = next(iter(error.recipients.values()))
+    elif isinstance(error, smtplib.SMTPResponseException):
+        code, reply = error.smtp_code, error.smtp_error
+    else:
+        return None, str(error)
+    if isinstance(reply, bytes):
+        reply = reply.decode('utf-8', 'replace')
+    return code, reply
+
+
+# Кэш id справочника SMTPReply в процессе: типовые ответы («250 OK») резолвятся без запросов.
+_reply_ids = {}
+_reply_ids_lock = threading.Lock()
+REPLY_CACHE_SIZE = 10000
+
+
+def get_reply_ids(keys):
+    """
+    id строк SMTPReply для пар (код, текст): недостающие ответы создаются одним bulk_create
+    и дочитываются одним запросом. Возвращает словарь {(код, текст): id}.
+    """
+    with _reply_ids_lock:
+        known = {key: _reply_ids[key] for key in keys if key in _reply_ids}
+    missing = [key for key in keys if key not in known]
+    if missing:
+        SMTPReply.objects.bulk_create(
+            [SMTPReply(code=code, text=text) for code, text in missing], ignore_conflicts=True
+        )
+        condition = Q()
+        for code, text in missing:
+            condition |= Q(code=code, text=text)
+        fetched = {(code, text): pk for pk, code, text in
+                   SMTPReply.objects.filter(condition).values_list('pk', 'code', 'text')}
+        known.update(fetched)
+        with _reply_ids_lock:
+            if len(_reply_ids) + len(fetched) > REPLY_CACHE_SIZE:
+                _reply_ids.clear()
+            _reply_ids.update(fetched)
+    return known
+
+
+class LogWriter:
+    """
+    Буфер записей Log: по строке на каждого получателя копится в памяти и сбрасывается
+    одним bulk_create, когда набирается MAILING_LOG_BATCH_SIZE строк или проходит
+    MAILING_LOG_FLUSH_INTERVAL секунд с прошлого сброса, а также при закрытии.
+    Один экземпляр можно делить между потоками.
+    """
+
+    def __init__(self, batch_size=None, flush_interval=None):
+        self.batch_size = batch_size or settings.MAILING_LOG_BATCH_SIZE
+        if flush_interval is None:
+            flush_interval = settings.MAILING_LOG_FLUSH_INTERVAL
+        self.flush_interval = flush_interval
+        self._entries = []
+        self._flushed_at = time.monotonic()
+        self._oldest_at = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.flush()
+
+    def _append(self, message, client_pk, email, error):
+        if error is None:
+            code, reply, status = 250, 'Email sent successfully', Log.SUCCESS
+        else:
+            code, reply = describe_error(error)
+            status = Log.ERROR
+        metrics.record_delivery(code, error)
+        entry = Log(message=message, client_id=client_pk, recipient=email, status=status)
+        with self._lock:
+            if not self._entries:
+                self._oldest_at = time.monotonic()
+            self._entries.append((entry, (code or 0, reply[:1000])))
+            return len(self._entries) >= self.batch_size \
+                or time.monotonic() - self._flushed_at >= self.flush_interval
+
+    def add(self, message, client_pk, email, error=None):
+        if self._append(message, client_pk, email, error):
+            self.flush()
+
+    async def aadd(self, message, client_pk, email, error=None):
+        if self._append(message, client_pk, email, error):
+            await self.aflush()
+
+    def flush(self):
+        with self._lock:
+            entries, self._entries = self._entries, []
+            oldest_at, self._oldest_at = self._oldest_at, None
+            self._flushed_at = time.monotonic()
+        if entries:
+            reply_ids = get_reply_ids({key for entry, key in entries})
+            for entry, key in entries:
+                entry.reply_id = reply_ids[key]
+            Log.objects.bulk_create([entry for entry, key in entries])
+            # bulk_create не шлет post_save: отчет о доставке в кэше страниц сбрасывается здесь,
+            # не чаще раза в MAILING_VIEW_CACHE_LOG_INTERVAL; остаток применяет тик диспетчера.
+            viewcache.bump_throttled('log', settings.MAILING_VIEW_CACHE_LOG_INTERVAL)
+            metrics.log_write_lag.observe(time.monotonic() - oldest_at)
+            logger.debug("Flushed %s delivery log entries", len(entries))
+
+    async def aflush(self):
+        await sync_to_async(self.flush)()
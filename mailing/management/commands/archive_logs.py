@@ -0,0 +1,36 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from mailing.outbox import purge_finished
+from mailing.partitions import ensure_partitions
+from mailing.retention import archive_old_logs
+
+
+class Command(BaseCommand):
+    help = (
+        "Сворачивает Log старше срока хранения в дневные итоги LogRollup, выгружает строки "
+        "в gzip CSV и удаляет их. Заодно создает месячные секции Log на будущее и удаляет "
+        "завершенные строки outbox старше срока их хранения."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.MAILING_LOG_RETENTION_DAYS,
+                            help='Сколько дней хранить строки Log')
+        parser.add_argument('--archive-dir', default=settings.MAILING_LOG_ARCHIVE_DIR,
+                            help='Каталог для архивов CSV')
+        parser.add_argument('--no-archive', action='store_true', help='Удалять строки без выгрузки в архив')
+        parser.add_argument('--outbox-days', type=int, default=settings.MAILING_OUTBOX_RETENTION_DAYS,
+                            help='Сколько дней хранить отправленные и неудачные строки outbox')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        created = ensure_partitions(now)
+        archive_dir = None if options['no_archive'] else options['archive_dir']
+        removed = archive_old_logs(now - timedelta(days=options['days']), archive_dir)
+        purged = purge_finished(now - timedelta(days=options['outbox_days']))
+        self.stdout.write(
+            "Partitions created: %s, log rows archived: %s, outbox rows purged: %s" % (len(created), removed, purged)
+        )
@@ -0,0 +1,50 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from mailing.benchmark import benchmark_mailings, compare, run_benchmark
+
+ENGINES = ['sync', 'threads', 'asyncio', 'celery']
+
+
+class Command(BaseCommand):
+    help = (
+        "Замеряет тик send_mailings на данных generate_benchmark_data с локальным SMTP-приемником: "
+        "время тика, писем в секунду, число запросов к БД и пик памяти. Тик разбирает все "
+        "наступившие рассылки, поэтому при чужих наступивших рассылках или строках outbox "
+        "команда отказывается работать; запускать ее стоит на отдельной базе."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--engine', action='append', choices=ENGINES, help='Движок доставки; можно несколько')
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--prefix', default='bench')
+        parser.add_argument('--smtp-delay', type=float, default=0, help='Задержка ответа приемника на DATA, сек')
+        parser.add_argument('--output', help='Файл для отчета в JSON')
+        parser.add_argument('--baseline', help='Отчет прошлого прогона для сравнения')
+
+    def handle(self, *args, **options):
+        if not benchmark_mailings(options['prefix']).exists():
+            raise CommandError('No benchmark data, run generate_benchmark_data first')
+
+        try:
+            report = run_benchmark(
+                options['engine'] or ['sync'], options['repeat'], options['prefix'], options['smtp_delay']
+            )
+        except ValueError as error:
+            raise CommandError(error)
+        for engine, metrics in report['summary'].items():
+            self.stdout.write('%s: %s' % (engine, ', '.join('%s=%.4g' % item for item in metrics.items())))
+
+        if options['baseline']:
+            with open(options['baseline'], encoding='utf-8') as file:
+                report['baseline'] = compare(report, json.load(file))
+            for engine, changes in report['baseline'].items():
+                self.stdout.write('%s vs baseline: %s' % (
+                    engine, ', '.join('%s %+.1f%%' % (metric, change * 100) for metric, change in changes.items())
+                ))
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
+            self.stdout.write(self.style.SUCCESS('Report saved to %s' % options['output']))
@@ -0,0 +1,42 @@
+import sys
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from mailing.exports import FORMATS, client_export_queryset, export_rows, log_export_queryset
+from mailing.models import Client, Log
+
+
+class Command(BaseCommand):
+    help = (
+        "Выгружает Log или Client в CSV или NDJSON в файл или на stdout. Строки читаются "
+        "потоково, поэтому память не зависит от размера выгрузки."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=['logs', 'clients'])
+        parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+        parser.add_argument('--output', help='Путь к файлу; по умолчанию stdout')
+        parser.add_argument('--owner', help='Только данные пользователя с этой почтой')
+
+    def handle(self, *args, **options):
+        owner = None
+        if options['owner']:
+            try:
+                owner = get_user_model().objects.get(email=options['owner'])
+            except get_user_model().DoesNotExist:
+                raise CommandError("User %s does not exist" % options['owner'])
+        if options['dataset'] == 'logs':
+            queryset = Log.objects.all() if owner is None else Log.objects.filter(message__mailing__owner=owner)
+            queryset, fields = log_export_queryset(queryset)
+        else:
+            queryset = Client.objects.all() if owner is None else Client.objects.filter(owner=owner)
+            queryset, fields = client_export_queryset(queryset)
+
+        output = open(options['output'], 'w', newline='', encoding='utf-8') if options['output'] else sys.stdout
+        try:
+            for chunk in export_rows(queryset, fields, options['format']):
+                output.write(chunk)
+        finally:
+            if output is not sys.stdout:
+                output.close()
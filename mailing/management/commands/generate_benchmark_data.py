@@ -0,0 +1,91 @@
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from mailing.benchmark import BENCHMARK_DOMAIN, benchmark_mailings
+from mailing.models import Client, Mailing, Message
+from mailing.outbox import chunked
+
+
+class Command(BaseCommand):
+    help = (
+        "Генерирует синтетические данные для замеров диспетчера: пользователей, их клиентов, "
+        "рассылки и сообщения. Все записи создаются пачками через bulk_create."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10)
+        parser.add_argument('--clients', type=int, default=1000, help='Клиентов на пользователя')
+        parser.add_argument('--mailings', type=int, default=10, help='Рассылок на пользователя')
+        parser.add_argument('--messages', type=int, default=1, help='Сообщений на рассылку')
+        parser.add_argument('--recipients', type=int, default=100, help='Получателей на рассылку')
+        parser.add_argument('--prefix', default='bench', help='Префикс адресов сгенерированных данных')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--clear', action='store_true', help='Сначала удалить данные с этим префиксом')
+
+    def handle(self, *args, **options):
+        prefix, batch_size = options['prefix'], options['batch_size']
+        User = get_user_model()
+        users = User.objects.filter(email__startswith='%s-' % prefix, email__endswith=BENCHMARK_DOMAIN)
+        if options['clear']:
+            benchmark_mailings(prefix).delete()
+            Client.objects.filter(owner__in=users).delete()
+            users.delete()
+
+        with transaction.atomic():
+            offset = users.count()
+            User.objects.bulk_create([
+                User(email='%s-user%s@%s' % (prefix, offset + number, BENCHMARK_DOMAIN), password='!')
+                for number in range(options['users'])
+            ], batch_size=batch_size)
+            new_users = list(users.order_by('-pk')[:options['users']])
+
+            for user in new_users:
+                self.create_user_data(user, options, batch_size)
+
+        self.stdout.write(self.style.SUCCESS(
+            'Created %s users with %s clients and %s mailings each' % (
+                len(new_users), options['clients'], options['mailings'])
+        ))
+
+    def create_user_data(self, user, options, batch_size):
+        name = user.email.partition('@')[0]
+        clients = Client.objects.bulk_create([
+            Client(
+                email='%s-client%s@%s' % (name, number, BENCHMARK_DOMAIN), full_name='Client %s' % number, owner=user
+            )
+            for number in range(options['clients'])
+        ], batch_size=batch_size)
+        client_ids = [client.pk for client in clients] or list(
+            Client.objects.filter(owner=user).values_list('pk', flat=True)
+        )
+
+        now = timezone.now()
+        mailings = Mailing.objects.bulk_create([
+            Mailing(
+                start_time=now, frequency='daily', status='started', owner=user,
+                end_time=now + timedelta(days=1), next_run_at=now,
+            )
+            for _ in range(options['mailings'])
+        ], batch_size=batch_size)
+        mailing_ids = [mailing.pk for mailing in mailings] or list(
+            Mailing.objects.filter(owner=user).order_by('-pk').values_list('pk', flat=True)[:options['mailings']]
+        )
+
+        Message.objects.bulk_create([
+            Message(mailing_id=mailing_id, subject='Benchmark %s' % number, body='Benchmark message body\n' * 20)
+            for mailing_id in mailing_ids
+            for number in range(options['messages'])
+        ], batch_size=batch_size)
+
+        through = Mailing.recipients.through
+        rows = (
+            through(mailing_id=mailing_id, client_id=client_ids[(index + offset) % len(client_ids)])
+            for offset, mailing_id in enumerate(mailing_ids)
+            for index in range(min(options['recipients'], len(client_ids)))
+        )
+        for chunk in chunked(rows, batch_size):
+            through.objects.bulk_create(chunk)
@@ -0,0 +1,34 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from mailing.imports import import_clients, read_csv
+
+
+class Command(BaseCommand):
+    help = (
+        "Импортирует клиентов из CSV (колонки email, full_name, comment, is_active): файл "
+        "читается потоково, строки записываются пачками через upsert по email."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--owner', help='Почта пользователя, которому принадлежат новые клиенты')
+        parser.add_argument('--batch-size', type=int)
+
+    def handle(self, *args, **options):
+        owner = None
+        if options['owner']:
+            try:
+                owner = get_user_model().objects.get(email=options['owner'])
+            except get_user_model().DoesNotExist:
+                raise CommandError("User %s does not exist" % options['owner'])
+        try:
+            with open(options['path'], newline='', encoding='utf-8-sig') as source:
+                result = import_clients(read_csv(source), owner=owner, batch_size=options['batch_size'])
+        except (OSError, ValueError) as error:
+            raise CommandError(error)
+        for line, reason in result.errors:
+            self.stderr.write("Line %s: %s" % (line, reason))
+        self.stdout.write(
+            "Inserted: %s, updated: %s, rejected: %s" % (result.inserted, result.updated, result.rejected)
+        )
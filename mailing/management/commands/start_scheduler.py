@@ -1,48 +1,160 @@
 from django.conf import settings
+from apscheduler.events import EVENT_JOB_ERROR, EVENT_JOB_EXECUTED
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+from django.core.management import call_command
 from django.core.management.base import BaseCommand
+from django.utils import timezone
 from django_apscheduler.jobstores import DjangoJobStore
 from django_apscheduler.models import DjangoJobExecution
 from django_apscheduler import util
-from mailing.services import send_mailings
+from blog.counters import flush_view_counts
+from mailing.leader import LeaderElection
+from mailing.partitions import ensure_partitions
+from mailing.services import next_due_at, retry_deliveries, send_mailings
+from mailing.stats import reconcile_counters
 import logging
+import signal
+import threading
 
 logger = logging.getLogger(__name__)
 
+
 @util.close_old_connections
 def delete_old_job_executions(max_age=604_800):
     DjangoJobExecution.objects.delete_old_job_executions(max_age)
 
+
+@util.close_old_connections
+def archive_logs():
+    call_command("archive_logs")
+
+
+@util.close_old_connections
+def reconcile_stats():
+    reconcile_counters()
+
+
+@util.close_old_connections
+def flush_blog_views():
+    flush_view_counts()
+
+
+def build_scheduler():
+    scheduler = BackgroundScheduler(timezone=settings.TIME_ZONE)
+    scheduler.add_jobstore(DjangoJobStore(), "default")
+
+    scheduler.add_job(
+        send_mailings,
+        trigger=CronTrigger(minute="*/1"),
+        id="send_mailings",
+        max_instances=1,
+        replace_existing=True,
+    )
+    logger.info("Added job 'send_mailings'.")
+
+    scheduler.add_job(
+        retry_deliveries,
+        trigger=IntervalTrigger(seconds=settings.MAILING_RETRY_INTERVAL),
+        id="retry_deliveries",
+        max_instances=1,
+        replace_existing=True,
+    )
+    logger.info("Added job 'retry_deliveries'.")
+
+    scheduler.add_job(
+        reconcile_stats,
+        trigger=IntervalTrigger(seconds=settings.MAILING_STATS_RECONCILE_INTERVAL),
+        id="reconcile_stats",
+        max_instances=1,
+        replace_existing=True,
+    )
+    logger.info("Added job 'reconcile_stats'.")
+
+    scheduler.add_job(
+        flush_blog_views,
+        trigger=IntervalTrigger(seconds=settings.BLOG_VIEWS_FLUSH_INTERVAL),
+        id="flush_blog_views",
+        max_instances=1,
+        replace_existing=True,
+    )
+    logger.info("Added job 'flush_blog_views'.")
+
+    scheduler.add_job(
+        archive_logs,
+        trigger=CronTrigger(hour="03", minute="00"),
+        id="archive_logs",
+        max_instances=1,
+        replace_existing=True,
+    )
+    logger.info("Added job 'archive_logs'.")
+
+    scheduler.add_job(
+        delete_old_job_executions,
+        trigger=CronTrigger(day_of_week="mon", hour="00", minute="00"),
+        id="delete_old_job_executions",
+        max_instances=1,
+        replace_existing=True,
+    )
+    logger.info("Added job 'delete_old_job_executions'.")
+
+    scheduler.add_listener(
+        lambda event: wake_up_at_next_due(scheduler, event), EVENT_JOB_EXECUTED | EVENT_JOB_ERROR
+    )
+    return scheduler
+
+
+@util.close_old_connections
+def wake_up_at_next_due(scheduler, event):
+    """
+    После тика send_mailings переносит следующий тик на ближайший запуск рассылки, если он
+    раньше очередного срабатывания по cron. Поминутный cron остается страховкой для рассылок,
+    созданных между тиками. Слушатель выполняется в потоке задания и сам читает БД, поэтому,
+    как и задания, закрывает устаревшие соединения.
+    """
+    if event.job_id != "send_mailings":
+        return
+    job = scheduler.get_job("send_mailings")
+    due = next_due_at()
+    if job is None or due is None or job.next_run_time is None:
+        return
+    if timezone.now() < due < job.next_run_time:
+        scheduler.modify_job("send_mailings", next_run_time=due)
+        logger.info("Next send_mailings tick moved to %s", due)
+
+
 class Command(BaseCommand):
-    help = "Starts the APScheduler."
+    help = (
+        "Runs the mailing dispatcher: a long-running process that starts the APScheduler "
+        "jobs only while it is the elected leader among its replicas."
+    )
 
     def handle(self, *args, **options):
-        scheduler = BackgroundScheduler(timezone=settings.TIME_ZONE)
-        scheduler.add_jobstore(DjangoJobStore(), "default")
+        stopping = threading.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *args: stopping.set())
 
+        election = LeaderElection("mailing-dispatcher")
+        scheduler = None
         try:
-            scheduler.add_job(
-                send_mailings,
-                trigger=CronTrigger(minute="*/1"),
-                id="send_mailings",
-                max_instances=1,
-                replace_existing=True,
-            )
-            logger.info("Added job 'send_mailings'.")
-
-            scheduler.add_job(
-                delete_old_job_executions,
-                trigger=CronTrigger(day_of_week="mon", hour="00", minute="00"),
-                id="delete_old_job_executions",
-                max_instances=1,
-                replace_existing=True,
-            )
-            logger.info("Added job 'delete_old_job_executions'.")
-
-            scheduler.start()
-            logger.info("Scheduler started successfully.")
-
-        except KeyboardInterrupt:
-            scheduler.shutdown()
-            logger.info("Scheduler shut down successfully.")
+            while not stopping.is_set():
+                if election.acquire():
+                    if scheduler is None:
+                        # Секции Log на текущий месяц должны быть до первой записи в него.
+                        ensure_partitions(timezone.now())
+                        scheduler = build_scheduler()
+                        scheduler.start()
+                        logger.info("Scheduler started successfully.")
+                elif scheduler is not None:
+                    # Лидерство перехватила другая реплика: уже идущие задания доработают,
+                    # outbox не даст им отправить письма повторно.
+                    scheduler.shutdown(wait=False)
+                    scheduler = None
+                    logger.warning("Scheduler stopped: leadership lost.")
+                stopping.wait(settings.MAILING_LEADER_POLL_INTERVAL)
+        finally:
+            if scheduler is not None:
+                scheduler.shutdown()
+                logger.info("Scheduler shut down successfully.")
+            election.release()
@@ -0,0 +1,105 @@
+import atexit
+import os
+import time
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess,
+)
+
+# Метрики диспетчера и веб-запросов. Если задан PROMETHEUS_MULTIPROC_DIR, каждый процесс
+# (воркеры gunicorn, диспетчер, воркеры Celery) пишет значения в свои файлы в этом каталоге,
+# а эндпоинт /metrics складывает их, поэтому любой процесс отдает общую картину по узлу.
+
+LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+
+due_mailings = Gauge(
+    'mailing_due_mailings', 'Рассылок, запуск которых наступил, в последнем тике', multiprocess_mode='livesum'
+)
+tick_duration = Histogram(
+    'mailing_tick_duration_seconds', 'Длительность тика диспетчера', ['job'],
+    buckets=(.1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600),
+)
+smtp_connect_duration = Histogram(
+    'mailing_smtp_connect_seconds', 'Время открытия SMTP-соединения с авторизацией', buckets=LATENCY_BUCKETS
+)
+smtp_send_duration = Histogram(
+    'mailing_smtp_send_seconds', 'Время отправки одного письма по SMTP', buckets=LATENCY_BUCKETS
+)
+deliveries = Counter('mailing_deliveries', 'Результаты отправки писем', ['status', 'code'])
+outbox_depth = Gauge('mailing_outbox_depth', 'Строк outbox, ожидающих отправки', ['queue'], multiprocess_mode='livesum')
+log_write_lag = Histogram(
+    'mailing_log_write_lag_seconds', 'Сколько запись Log ждала в буфере до записи в БД', buckets=LATENCY_BUCKETS
+)
+request_duration = Histogram(
+    'http_request_duration_seconds', 'Время обработки запроса по представлениям', ['view', 'method', 'status'],
+    buckets=LATENCY_BUCKETS,
+)
+
+
+class Timer:
+    """Контекстный менеджер, который записывает время выполнения блока в гистограмму."""
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.histogram.observe(time.perf_counter() - self.started)
+
+
+def record_delivery(code, error):
+    deliveries.labels(status='success' if error is None else 'error', code=code or '').inc()
+
+
+def get_registry():
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def mark_process_dead(pid=None):
+    """
+    Убирает живые gauge завершившегося процесса. Процесс вызывает ее сам при штатном выходе
+    (atexit), воркеры Celery - по сигналу остановки, а для убитых воркеров gunicorn ее
+    вызывает мастер в хуке child_exit (gunicorn.conf.py).
+    """
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        multiprocess.mark_process_dead(pid or os.getpid())
+
+
+atexit.register(mark_process_dead)
+
+
+def metrics_view(request):
+    """
+    Метрики в текстовом формате Prometheus. Доступны с заголовком Authorization: Bearer
+    METRICS_TOKEN (для сборщика) или сотрудникам (is_staff); без токена - только сотрудникам.
+    """
+    token = settings.METRICS_TOKEN
+    authorized = token and request.headers.get('Authorization') == 'Bearer %s' % token
+    if not authorized and not request.user.is_staff:
+        return HttpResponseForbidden()
+    return HttpResponse(generate_latest(get_registry()), content_type=CONTENT_TYPE_LATEST)
+
+
+class RequestMetricsMiddleware:
+    """Время обработки каждого запроса с меткой имени маршрута, метода и кода ответа."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        response = self.get_response(request)
+        match = request.resolver_match
+        request_duration.labels(
+            view=match.view_name if match else 'unresolved', method=request.method, status=response.status_code
+        ).observe(time.perf_counter() - started)
+        return response
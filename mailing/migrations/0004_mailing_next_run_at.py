@@ -0,0 +1,50 @@
+# Generated by Django 4.2.5 on 2026-10-18 16:26
+
+from datetime import timedelta
+
+from django.db import migrations, models
+from django.utils import timezone
+
+FREQUENCY_DELTAS = {
+    'daily': timedelta(days=1),
+    'weekly': timedelta(weeks=1),
+    'monthly': timedelta(days=30),
+}
+
+
+def fill_next_run_at(apps, schema_editor):
+    Mailing = apps.get_model('mailing', 'Mailing')
+    now = timezone.now()
+    mailings = Mailing.objects.exclude(status='completed')
+    for mailing in mailings.iterator():
+        next_run_at = mailing.start_time
+        delta = FREQUENCY_DELTAS.get(mailing.frequency)
+        if delta is not None and next_run_at < now:
+            next_run_at += -((next_run_at - now) // delta) * delta
+        mailing.next_run_at = next_run_at
+        mailing.save(update_fields=['next_run_at'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailing', '0003_alter_mailing_options'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mailing',
+            name='end_time',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='mailing',
+            name='next_run_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Следующий запуск'),
+        ),
+        migrations.AddIndex(
+            model_name='mailing',
+            index=models.Index(fields=['status', 'next_run_at'], name='mailing_due_idx'),
+        ),
+        migrations.RunPython(fill_next_run_at, migrations.RunPython.noop),
+    ]
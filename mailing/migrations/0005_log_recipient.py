@@ -0,0 +1,24 @@
+# Generated by Django 4.2.5 on 2026-10-18 16:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailing', '0004_mailing_next_run_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='log',
+            name='client',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='mailing.client'),
+        ),
+        migrations.AddField(
+            model_name='log',
+            name='recipient',
+            field=models.EmailField(blank=True, max_length=254),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.5 on 2026-10-18 16:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailing', '0005_log_recipient'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='log',
+            name='code',
+            field=models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='Код ответа SMTP'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.5 on 2026-10-18 16:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailing', '0007_delivery_outbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='delivery',
+            name='next_attempt_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='delivery',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('sending', 'Sending'), ('retry', 'Retry'), ('sent', 'Sent'), ('failed', 'Failed')], default='pending', max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='delivery',
+            index=models.Index(fields=['status', 'next_attempt_at'], name='delivery_retry_idx'),
+        ),
+    ]
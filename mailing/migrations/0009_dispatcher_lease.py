@@ -0,0 +1,21 @@
+# Generated by Django 4.2.5 on 2026-10-18 16:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailing', '0008_delivery_retry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DispatcherLease',
+            fields=[
+                ('name', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('holder', models.CharField(blank=True, max_length=100)),
+                ('expires_at', models.DateTimeField()),
+            ],
+        ),
+    ]
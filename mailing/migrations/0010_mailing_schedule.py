@@ -0,0 +1,57 @@
+# Generated by Django 4.2.5 on 2026-10-18 16:42
+
+import calendar
+
+from django.db import migrations, models
+from django.utils import timezone
+import mailing.recurrence
+
+
+def next_month(moment):
+    # Календарный месяц: рассылка, начатая 31-го, в коротких месяцах уходит в последний день.
+    year, month = (moment.year + 1, 1) if moment.month == 12 else (moment.year, moment.month + 1)
+    return moment.replace(year=year, month=month, day=min(moment.day, calendar.monthrange(year, month)[1]))
+
+
+def recompute_monthly_runs(apps, schema_editor):
+    # Месячные рассылки считались по 30 дней; пересчитываем их запуски по календарным месяцам.
+    # Расчет идет в UTC и не зависит от кода приложения; следующие запуски диспетчер уже
+    # считает по расписанию в часовом поясе рассылки.
+    Mailing = apps.get_model('mailing', 'Mailing')
+    now = timezone.now()
+    for row in Mailing.objects.filter(frequency='monthly').exclude(status='completed').iterator():
+        start = row.start_time
+        row.end_time = next_month(start)
+        # Все запуски после первого приходятся не раньше end_time: рассылка либо еще ждет
+        # первого запуска, либо завершена.
+        if start >= now:
+            row.next_run_at = start
+        else:
+            row.status, row.next_run_at = 'completed', None
+        row.save(update_fields=['end_time', 'next_run_at', 'status'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailing', '0009_dispatcher_lease'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mailing',
+            name='schedule',
+            field=models.CharField(blank=True, help_text='Для периодичности Custom: RRULE (FREQ=WEEKLY;BYDAY=MO,WE) или cron (0 9 * * 1-5)', max_length=255, validators=[mailing.recurrence.validate_schedule], verbose_name='Правило расписания'),
+        ),
+        migrations.AddField(
+            model_name='mailing',
+            name='time_zone',
+            field=models.CharField(blank=True, help_text='По умолчанию MAILING_TIME_ZONE', max_length=64, validators=[mailing.recurrence.validate_time_zone], verbose_name='Часовой пояс'),
+        ),
+        migrations.AlterField(
+            model_name='mailing',
+            name='frequency',
+            field=models.CharField(choices=[('daily', 'Daily'), ('weekly', 'Weekly'), ('monthly', 'Monthly'), ('custom', 'Custom')], max_length=10),
+        ),
+        migrations.RunPython(recompute_monthly_runs, migrations.RunPython.noop),
+    ]
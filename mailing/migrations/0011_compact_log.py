@@ -0,0 +1,77 @@
+# Generated by Django 4.2.5 on 2026-10-18 16:50
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+STATUSES = {'success': 1, 'error': 2}
+
+
+def normalize_replies(apps, schema_editor):
+    Log = apps.get_model('mailing', 'Log')
+    SMTPReply = apps.get_model('mailing', 'SMTPReply')
+    for old, new in STATUSES.items():
+        Log.objects.filter(status=old).update(status=str(new))
+    # Ответы, записанные до справочника: 'success' писался с ответом 'Email sent successfully'.
+    replies = Log.objects.filter(reply__isnull=True).values_list('code', 'response').distinct()
+    for code, response in replies.iterator():
+        reply, _ = SMTPReply.objects.get_or_create(code=code or 0, text=response[:1000])
+        Log.objects.filter(reply__isnull=True, code=code, response=response).update(reply=reply)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailing', '0010_mailing_schedule'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SMTPReply',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.PositiveSmallIntegerField(default=0, verbose_name='Код ответа SMTP')),
+                ('text', models.CharField(blank=True, max_length=1000, verbose_name='Ответ сервера')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('code', 'text'), name='smtp_reply_unique')],
+            },
+        ),
+        migrations.AddField(
+            model_name='log',
+            name='reply',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, to='mailing.smtpreply'),
+        ),
+        migrations.RunPython(normalize_replies, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='log',
+            name='code',
+        ),
+        migrations.RemoveField(
+            model_name='log',
+            name='response',
+        ),
+        migrations.AlterField(
+            model_name='log',
+            name='status',
+            field=models.PositiveSmallIntegerField(choices=[(1, 'Success'), (2, 'Error')]),
+        ),
+        migrations.AlterField(
+            model_name='log',
+            name='reply',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='mailing.smtpreply'),
+        ),
+        migrations.CreateModel(
+            name='LogRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('status', models.PositiveSmallIntegerField(choices=[(1, 'Success'), (2, 'Error')])),
+                ('count', models.PositiveIntegerField()),
+                ('message', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='mailing.message')),
+                ('reply', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='mailing.smtpreply')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('day', 'message', 'status', 'reply'), name='log_rollup_unique')],
+            },
+        ),
+    ]
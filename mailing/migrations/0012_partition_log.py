@@ -0,0 +1,76 @@
+# Generated by Django 4.2.5 on 2026-10-18 16:55
+
+import re
+from datetime import datetime, timezone as dt_timezone
+
+from django.db import migrations
+
+
+def partition_log_table(apps, schema_editor):
+    """
+    Превращает mailing_log в таблицу, секционированную по месяцам timestamp. Данные не
+    копируются: прежняя таблица становится первой секцией (от MINVALUE до начала следующего
+    месяца), дальше секции создает mailing.partitions.ensure_partitions. Первичный ключ
+    секционированной таблицы обязан включать ключ секционирования, поэтому он (id, timestamp);
+    id по-прежнему выдает одна последовательность. Индексы и внешние ключи переносятся на
+    родительскую таблицу под прежними именами, чтобы их видели следующие миграции.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    now = datetime.now(dt_timezone.utc)
+    next_month = datetime(now.year + now.month // 12, now.month % 12 + 1, 1, tzinfo=dt_timezone.utc)
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('mailing_log')")
+        if cursor.fetchone()[0] == 'p':
+            return
+
+        cursor.execute("SELECT coalesce(max(id), 0) FROM mailing_log")
+        max_id = cursor.fetchone()[0]
+        cursor.execute(
+            "SELECT indexname, indexdef FROM pg_indexes WHERE tablename = 'mailing_log' AND indexname <> 'mailing_log_pkey'"
+        )
+        indexes = cursor.fetchall()
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = 'mailing_log'::regclass AND contype = 'f'"
+        )
+        foreign_keys = cursor.fetchall()
+
+        cursor.execute("ALTER TABLE mailing_log RENAME TO mailing_log_legacy")
+        cursor.execute("ALTER TABLE mailing_log_legacy DROP CONSTRAINT mailing_log_pkey")
+        for name, definition in indexes:
+            cursor.execute('ALTER INDEX "%s" RENAME TO "%s"' % (name, (name + '_legacy')[-63:]))
+        # Identity-столбец нельзя унаследовать секциям до Postgres 17: id выдает обычная последовательность.
+        cursor.execute("ALTER TABLE mailing_log_legacy ALTER COLUMN id DROP IDENTITY IF EXISTS")
+        cursor.execute("CREATE SEQUENCE IF NOT EXISTS mailing_log_id_seq")
+        cursor.execute("SELECT setval('mailing_log_id_seq', %s, false)", [max_id + 1])
+
+        cursor.execute(
+            'CREATE TABLE mailing_log (LIKE mailing_log_legacy INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+            'PARTITION BY RANGE ("timestamp")'
+        )
+        cursor.execute("ALTER TABLE mailing_log ALTER COLUMN id SET DEFAULT nextval('mailing_log_id_seq')")
+        cursor.execute("ALTER TABLE mailing_log_legacy ALTER COLUMN id SET DEFAULT nextval('mailing_log_id_seq')")
+        cursor.execute("ALTER SEQUENCE mailing_log_id_seq OWNED BY mailing_log.id")
+        cursor.execute('ALTER TABLE mailing_log ADD CONSTRAINT mailing_log_pkey PRIMARY KEY (id, "timestamp")')
+        cursor.execute(
+            "ALTER TABLE mailing_log ATTACH PARTITION mailing_log_legacy FOR VALUES FROM (MINVALUE) TO (%s)",
+            [next_month],
+        )
+        # Индекс на родителе подхватывает совпадающий индекс секции, а не строит его заново.
+        for name, definition in indexes:
+            cursor.execute(re.sub(r' ON (\S+\.)?mailing_log ', ' ON mailing_log ', definition, count=1))
+        for name, definition in foreign_keys:
+            cursor.execute('ALTER TABLE mailing_log DROP CONSTRAINT IF EXISTS "%s"' % name)
+            cursor.execute('ALTER TABLE mailing_log ADD CONSTRAINT "%s" %s' % (name, definition))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailing', '0011_compact_log'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_log_table, migrations.RunPython.noop),
+    ]
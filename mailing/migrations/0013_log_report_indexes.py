@@ -0,0 +1,25 @@
+# Generated by Django 4.2.5 on 2026-10-18 16:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailing', '0012_partition_log'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='log',
+            index=models.Index(fields=['timestamp', 'id'], name='log_timeline_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='log',
+            index=models.Index(fields=['message', 'timestamp', 'id'], name='log_message_timeline_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='log',
+            index=models.Index(fields=['status', 'timestamp', 'id'], name='log_status_timeline_idx'),
+        ),
+    ]
@@ -0,0 +1,75 @@
+# Generated by Django 4.2.5 on 2026-10-18 16:59
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('mailing', '0013_log_report_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Segment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, verbose_name='Название')),
+                ('created_since', models.DateTimeField(blank=True, null=True, verbose_name='Добавлены не раньше')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='client',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now, verbose_name='Добавлен'),
+            preserve_default=False,
+        ),
+        migrations.AlterField(
+            model_name='mailing',
+            name='recipients',
+            field=models.ManyToManyField(blank=True, to='mailing.client'),
+        ),
+        migrations.CreateModel(
+            name='Tag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, verbose_name='Метка')),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SegmentSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('size', models.PositiveIntegerField(verbose_name='Получателей')),
+                ('client_ids', models.BinaryField()),
+                ('segment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='mailing.segment')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='segment',
+            name='tags',
+            field=models.ManyToManyField(blank=True, to='mailing.tag', verbose_name='С любой из меток'),
+        ),
+        migrations.AddField(
+            model_name='client',
+            name='tags',
+            field=models.ManyToManyField(blank=True, to='mailing.tag', verbose_name='Метки'),
+        ),
+        migrations.AddField(
+            model_name='mailing',
+            name='segment',
+            field=models.ForeignKey(blank=True, help_text='Если задан, получатели берутся из сегмента, а не из списка', null=True, on_delete=django.db.models.deletion.PROTECT, to='mailing.segment', verbose_name='Сегмент'),
+        ),
+        migrations.AddConstraint(
+            model_name='tag',
+            constraint=models.UniqueConstraint(fields=('owner', 'name'), name='tag_owner_name_unique'),
+        ),
+    ]
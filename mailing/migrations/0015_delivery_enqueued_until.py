@@ -0,0 +1,18 @@
+# Generated by Django 4.2.5 on 2026-10-18 17:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailing', '0014_segments'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='delivery',
+            name='enqueued_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,21 +1,85 @@
+from django.core.exceptions import ValidationError
 from django.db import models
 from django.utils import timezone
 from datetime import timedelta
+from zoneinfo import ZoneInfo
 from django.conf import settings
 
+from mailing.recurrence import frequency_rule, get_recurrence, validate_schedule, validate_time_zone
+
 NULLABLE = {'blank': True, 'null': True}
 
 
+class Tag(models.Model):
+    name = models.CharField(max_length=50, verbose_name='Метка')
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'name'], name='tag_owner_name_unique'),
+        ]
+
+    def __str__(self):
+        return self.name
+
+
 class Client(models.Model):
     email = models.EmailField(unique=True)
     full_name = models.CharField(max_length=255)
     comment = models.TextField(blank=True)
     owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, **NULLABLE)
     is_active = models.BooleanField(default=True, verbose_name='Активный')
+    tags = models.ManyToManyField(Tag, blank=True, verbose_name='Метки')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Добавлен')
 
     def __str__(self):
         return self.full_name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_is_active = instance.__dict__.get('is_active')
+        return instance
+
+
+class Segment(models.Model):
+    """
+    Получатели рассылки, заданные правилом, а не списком: активные клиенты владельца
+    сегмента, при заданных метках - с любой из них, при created_since - добавленные не
+    раньше этой даты. Отключенные клиенты в сегмент не входят никогда, как и в обычную
+    рассылку. Состав вычисляется при каждом запуске рассылки и фиксируется в SegmentSnapshot.
+    """
+    name = models.CharField(max_length=255, verbose_name='Название')
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    tags = models.ManyToManyField(Tag, blank=True, verbose_name='С любой из меток')
+    created_since = models.DateTimeField(**NULLABLE, verbose_name='Добавлены не раньше')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.name
+
+    def clients(self):
+        clients = Client.objects.filter(owner_id=self.owner_id, is_active=True)
+        tag_ids = list(self.tags.values_list('pk', flat=True))
+        if tag_ids:
+            # Подзапрос вместо join: клиент с несколькими подходящими метками не дублируется.
+            clients = clients.filter(pk__in=Client.tags.through.objects.filter(tag_id__in=tag_ids).values('client_id'))
+        if self.created_since:
+            clients = clients.filter(created_at__gte=self.created_since)
+        return clients
+
+
+class SegmentSnapshot(models.Model):
+    """
+    Состав сегмента на момент запуска рассылки: отсортированные id клиентов, сжатые
+    разностным varint-кодированием и zlib (см. mailing.segments) - около байта на клиента
+    вместо строки M2M на каждую пару рассылка-клиент.
+    """
+    segment = models.ForeignKey(Segment, on_delete=models.CASCADE, related_name='snapshots')
+    created_at = models.DateTimeField(auto_now_add=True)
+    size = models.PositiveIntegerField(verbose_name='Получателей')
+    client_ids = models.BinaryField()
+
 
 class Mailing(models.Model):
     start_time = models.DateTimeField()
@@ -23,33 +87,109 @@ class Mailing(models.Model):
         ('daily', 'Daily'),
         ('weekly', 'Weekly'),
         ('monthly', 'Monthly'),
+        ('custom', 'Custom'),
     ]
     frequency = models.CharField(max_length=10, choices=frequency_choices)
+    schedule = models.CharField(
+        max_length=255, blank=True, validators=[validate_schedule], verbose_name='Правило расписания',
+        help_text='Для периодичности Custom: RRULE (FREQ=WEEKLY;BYDAY=MO,WE) или cron (0 9 * * 1-5)'
+    )
+    time_zone = models.CharField(
+        max_length=64, blank=True, validators=[validate_time_zone], verbose_name='Часовой пояс',
+        help_text='По умолчанию MAILING_TIME_ZONE'
+    )
     status_choices = [
         ('created', 'Created'),
         ('started', 'Started'),
         ('completed', 'Completed'),
     ]
     status = models.CharField(max_length=10, choices=status_choices)
-    recipients = models.ManyToManyField('Client')
+    recipients = models.ManyToManyField('Client', blank=True)
+    segment = models.ForeignKey(
+        Segment, on_delete=models.PROTECT, **NULLABLE, verbose_name='Сегмент',
+        help_text='Если задан, получатели берутся из сегмента, а не из списка'
+    )
     owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, **NULLABLE)
     end_time = models.DateTimeField(**NULLABLE)
+    next_run_at = models.DateTimeField(**NULLABLE, verbose_name='Следующий запуск')
 
     class Meta:
         permissions = [
             ("can_view_mailings", "Can view mailings"),
             ("can_disable_mailings", "Can disable mailings"),
         ]
+        indexes = [
+            models.Index(fields=['status', 'next_run_at'], name='mailing_due_idx'),
+        ]
+
+    def __str__(self):
+        return '#%s %s (%s)' % (self.pk, self.start_time.strftime('%Y-%m-%d %H:%M'), self.get_frequency_display())
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_schedule = instance.schedule_key()
+        instance._loaded_status = instance.__dict__.get('status')
+        return instance
+
+    def schedule_key(self):
+        fields = ('start_time', 'frequency', 'schedule', 'time_zone')
+        return tuple(self.__dict__.get(field) for field in fields)
+
+    def schedule_changed(self):
+        return getattr(self, '_loaded_schedule', None) != self.schedule_key()
+
+    def reactivated(self):
+        """Рассылку снова запустили после остановки: запуски, пропущенные за паузу, не догоняются."""
+        loaded_status = getattr(self, '_loaded_status', None)
+        return self.status == 'started' and loaded_status is not None and loaded_status != 'started'
+
+    def clean(self):
+        if self.frequency == 'custom' and not self.schedule:
+            raise ValidationError({'schedule': 'Для периодичности Custom нужно задать правило расписания'})
+
+    @property
+    def recurrence(self):
+        time_zone = self.time_zone or settings.MAILING_TIME_ZONE
+        if self.frequency == 'custom':
+            rule = self.schedule
+        else:
+            rule = frequency_rule(self.frequency, self.start_time.astimezone(ZoneInfo(time_zone)))
+        return get_recurrence(rule, self.start_time, time_zone)
+
+    def next_slot(self, not_before):
+        """
+        Первый запуск по расписанию рассылки, который приходится не раньше not_before,
+        или None, если правило расписания исчерпано.
+        """
+        return self.recurrence.next_after(not_before)
+
+    def default_end_time(self):
+        """Окончание рассылки по умолчанию - через один период встроенной периодичности."""
+        if self.frequency == 'custom':
+            return None
+        return self.next_slot(self.start_time + timedelta(microseconds=1))
+
+    def advance_schedule(self, now):
+        """
+        Переносит next_run_at на первый запуск после now. Пропущенные за время простоя
+        запуски схлопываются в один, уже выполненный. Если следующего запуска нет или он
+        не успевает до end_time, рассылка завершается.
+        """
+        next_run_at = self.next_slot(now + timedelta(microseconds=1))
+        if next_run_at is None or self.end_time and next_run_at >= self.end_time:
+            self.status = 'completed'
+            self.next_run_at = None
+        else:
+            self.next_run_at = next_run_at
 
     def save(self, *args, **kwargs):
         if not self.end_time:
-            if self.frequency == 'daily':
-                self.end_time = self.start_time + timedelta(days=1)
-            elif self.frequency == 'weekly':
-                self.end_time = self.start_time + timedelta(weeks=1)
-            elif self.frequency == 'monthly':
-                self.end_time = self.start_time + timedelta(days=30)
+            self.end_time = self.default_end_time()
+        if self.status != 'completed' and (self.next_run_at is None or self.schedule_changed() or self.reactivated()):
+            self.next_run_at = self.next_slot(max(self.start_time, timezone.now()))
         super().save(*args, **kwargs)
+        self._loaded_schedule = self.schedule_key()
 
 
 class Message(models.Model):
@@ -59,8 +199,103 @@ class Message(models.Model):
     owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, **NULLABLE)
 
 
+class Delivery(models.Model):
+    """
+    Строка outbox: одно сообщение одному получателю, ожидающее отправки. Узлы-отправители
+    захватывают строки пачками с арендой до lease_until; строки с истекшей арендой
+    снова становятся доступны для захвата. После временной ошибки строка ждет повтора
+    в статусе retry до next_attempt_at. Движок celery отмечает строки, под которые уже
+    поставил задачи, до enqueued_until, чтобы следующий тик не ставил задачи повторно.
+    """
+    status_choices = [
+        ('pending', 'Pending'),
+        ('sending', 'Sending'),
+        ('retry', 'Retry'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    ]
+    message = models.ForeignKey(Message, on_delete=models.CASCADE)
+    client = models.ForeignKey(Client, on_delete=models.SET_NULL, **NULLABLE)
+    recipient = models.EmailField()
+    status = models.CharField(max_length=10, choices=status_choices, default='pending')
+    created_at = models.DateTimeField(auto_now_add=True)
+    lease_until = models.DateTimeField(**NULLABLE)
+    claimed_by = models.CharField(max_length=100, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(**NULLABLE)
+    enqueued_until = models.DateTimeField(**NULLABLE)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'lease_until'], name='delivery_claim_idx'),
+            models.Index(fields=['status', 'next_attempt_at'], name='delivery_retry_idx'),
+        ]
+
+
+class DispatcherLease(models.Model):
+    """
+    Аренда лидерства диспетчера для баз без advisory-замков: лидер продлевает expires_at,
+    а запасной узел забирает аренду, когда она истекла.
+    """
+    name = models.CharField(max_length=100, primary_key=True)
+    holder = models.CharField(max_length=100, blank=True)
+    expires_at = models.DateTimeField()
+
+
+class SMTPReply(models.Model):
+    """
+    Справочник ответов SMTP-сервера: одинаковый ответ хранится один раз, а строки Log
+    ссылаются на него. Код 0 - ответа сервера не было (обрыв соединения, таймаут).
+    """
+    code = models.PositiveSmallIntegerField(default=0, verbose_name='Код ответа SMTP')
+    text = models.CharField(max_length=1000, blank=True, verbose_name='Ответ сервера')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['code', 'text'], name='smtp_reply_unique'),
+        ]
+
+    def __str__(self):
+        return '%s %s' % (self.code or '', self.text)
+
+
 class Log(models.Model):
+    """
+    Результат отправки одного письма одному получателю. Строка компактна: статус - малое
+    целое, ответ сервера - ссылка на SMTPReply. На Postgres таблица секционирована по месяцам
+    timestamp (см. mailing.partitions), старые секции сворачиваются в LogRollup и уходят в архив.
+    """
+    SUCCESS = 1
+    ERROR = 2
+    status_choices = [
+        (SUCCESS, 'Success'),
+        (ERROR, 'Error'),
+    ]
     message = models.ForeignKey(Message, on_delete=models.CASCADE)
+    client = models.ForeignKey(Client, on_delete=models.SET_NULL, **NULLABLE)
+    recipient = models.EmailField(blank=True)
     timestamp = models.DateTimeField(auto_now_add=True)
-    status = models.CharField(max_length=20)
-    response = models.TextField(blank=True)
\ No newline at end of file
+    status = models.PositiveSmallIntegerField(choices=status_choices)
+    reply = models.ForeignKey(SMTPReply, on_delete=models.PROTECT)
+
+    class Meta:
+        # Ключ keyset-пагинации отчета о доставке и его варианты для фильтров по сообщению и статусу.
+        indexes = [
+            models.Index(fields=['timestamp', 'id'], name='log_timeline_idx'),
+            models.Index(fields=['message', 'timestamp', 'id'], name='log_message_timeline_idx'),
+            models.Index(fields=['status', 'timestamp', 'id'], name='log_status_timeline_idx'),
+        ]
+
+
+class LogRollup(models.Model):
+    """Дневные итоги по Log, которые остаются после удаления и архивации старых строк."""
+    day = models.DateField()
+    message = models.ForeignKey(Message, on_delete=models.CASCADE)
+    status = models.PositiveSmallIntegerField(choices=Log.status_choices)
+    reply = models.ForeignKey(SMTPReply, on_delete=models.PROTECT)
+    count = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'message', 'status', 'reply'], name='log_rollup_unique'),
+        ]
@@ -0,0 +1,292 @@
+import logging
+import os
+import socket
+import threading
+import uuid
+from datetime import timedelta
+from itertools import chain, islice
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, DateTimeField, F, Q, Value, When
+from django.utils import timezone
+
+from mailing import stats
+from mailing.models import Delivery, Mailing
+from mailing.retry import backoff, should_retry
+from mailing.segments import iter_snapshot_recipients, snapshot_for
+
+logger = logging.getLogger(__name__)
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def iter_recipients(mailings, chunk_size):
+    """
+    Активные получатели рассылок mailings тройками (id рассылки, id клиента, email). Читаются
+    из промежуточной таблицы M2M пачками по chunk_size в порядке (mailing_id, client_id) без
+    OFFSET и без долгоживущего курсора, в памяти только текущая пачка. Пачка дочитывает
+    текущую рассылку по client_id больше последнего выданного, а недостающее берет из
+    следующих рассылок по mailing_id больше текущего: оба условия - диапазоны уникального
+    индекса, так что пачка не перечитывает уже выданных получателей. Запросов не больше двух
+    на пачку, сколько бы ни было рассылок. Пара (рассылка, клиент) в таблице уникальна, а email
+    клиента уникален, поэтому каждый адрес выдается ровно один раз на рассылку.
+    """
+    if not mailings:
+        return
+    rows = Mailing.recipients.through.objects.filter(mailing__in=mailings, client__is_active=True) \
+        .order_by('mailing_id', 'client_id').values_list('mailing_id', 'client_id', 'client__email')
+    last_mailing_id = last_client_id = None
+    while True:
+        chunk = []
+        if last_mailing_id is not None:
+            chunk = list(rows.filter(mailing_id=last_mailing_id, client_id__gt=last_client_id)[:chunk_size])
+        if len(chunk) < chunk_size:
+            chunk += rows.filter(mailing_id__gt=last_mailing_id or 0)[:chunk_size - len(chunk)]
+        yield from chunk
+        if len(chunk) < chunk_size:
+            return
+        last_mailing_id, last_client_id = chunk[-1][:2]
+
+
+def iter_segment_recipients(mailing, now, chunk_size):
+    snapshot = snapshot_for(mailing.segment, now)
+    for client_pk, email in iter_snapshot_recipients(snapshot, chunk_size):
+        yield mailing.pk, client_pk, email
+
+
+def worker_id():
+    return '%s:%s:%s' % (socket.gethostname(), os.getpid(), threading.get_ident())
+
+
+def claim_runs(mailings, now):
+    """
+    Захватывает наступившие запуски mailings и переносит их расписание. Запуск захватывается
+    условным UPDATE по прежнему next_run_at, поэтому при нескольких диспетчерах его получает
+    ровно один. Обычно все запуски тика захватываются одним UPDATE с CASE по рассылкам; если
+    он изменил не все строки (часть запусков уже взял другой узел), он откатывается, и запуски
+    захватываются по одному. Вызывается внутри транзакции. Возвращает захваченные рассылки.
+    """
+    scheduled = {mailing.pk: mailing.next_run_at for mailing in mailings}
+    for mailing in mailings:
+        mailing.advance_schedule(now)
+    if not mailings:
+        return []
+
+    def run(mailing):
+        return Q(pk=mailing.pk, status='started', next_run_at=scheduled[mailing.pk])
+
+    with transaction.atomic():
+        runs = Q()
+        for mailing in mailings:
+            runs |= run(mailing)
+        claimed = Mailing.objects.filter(runs).update(
+            status=Case(*[When(pk=mailing.pk, then=Value(mailing.status)) for mailing in mailings]),
+            next_run_at=Case(
+                *[When(pk=mailing.pk, then=Value(mailing.next_run_at)) for mailing in mailings],
+                output_field=DateTimeField()
+            ),
+        )
+        if claimed == len(mailings):
+            return list(mailings)
+        transaction.set_rollback(True)
+
+    claimed = []
+    for mailing in mailings:
+        if Mailing.objects.filter(run(mailing)).update(status=mailing.status, next_run_at=mailing.next_run_at):
+            claimed.append(mailing)
+        else:
+            logger.info("Run of mailing %s at %s was already enqueued by another node", mailing, scheduled[mailing.pk])
+    return claimed
+
+
+def enqueue_runs(mailings, now):
+    """
+    Ставит очередные запуски рассылок в outbox: по строке Delivery на каждую пару
+    (сообщение, получатель) - и переносит их расписание. Захват запусков и вставка outbox
+    идут в одной транзакции, пачками по MAILING_SEND_CHUNK_SIZE получателей вперемешку
+    для всех рассылок, так что число запросов не растет с числом рассылок. Получатели
+    рассылки с сегментом берутся из снимка его состава на момент запуска. Id сообщений
+    берутся из message_set, предзагруженного вместе с рассылками. Возвращает
+    {id рассылки: число поставленных писем} для захваченных запусков.
+    """
+    chunk_size = settings.MAILING_SEND_CHUNK_SIZE
+    with transaction.atomic():
+        claimed = claim_runs(mailings, now)
+        message_ids = {mailing.pk: [message.pk for message in mailing.message_set.all()] for mailing in claimed}
+        with_messages = [mailing for mailing in claimed if message_ids[mailing.pk]]
+        streams = [iter_recipients([mailing for mailing in with_messages if not mailing.segment_id], chunk_size)]
+        streams += [
+            iter_segment_recipients(mailing, now, chunk_size) for mailing in with_messages if mailing.segment_id
+        ]
+        queued = dict.fromkeys(message_ids, 0)
+        for recipients in chunked(chain.from_iterable(streams), chunk_size):
+            deliveries = [
+                Delivery(message_id=message_id, client_id=client_pk, recipient=email)
+                for mailing_pk, client_pk, email in recipients
+                for message_id in message_ids[mailing_pk]
+            ]
+            Delivery.objects.bulk_create(deliveries)
+            for mailing_pk, client_pk, email in recipients:
+                queued[mailing_pk] += len(message_ids[mailing_pk])
+    for mailing in claimed:
+        if mailing.status != 'started':
+            stats.adjust_counter('active_mailings_count', -1)
+        logger.info("Enqueued %s deliveries for mailing %s", queued[mailing.pk], mailing)
+    return queued
+
+
+def claimable(now, retry=False):
+    # Повторы разбираются отдельным заданием, чтобы не задерживать первые попытки других рассылок.
+    if retry:
+        return Q(status='retry', next_attempt_at__lte=now)
+    return Q(status='pending') | Q(status='sending', lease_until__lt=now)
+
+
+def claim_batch(size=None, owner=None, retry=False):
+    """
+    Захватывает до size строк outbox в аренду на MAILING_OUTBOX_LEASE секунд; при retry -
+    строки, у которых наступило время повторной попытки.
+    На Postgres строки выбираются через SELECT ... FOR UPDATE SKIP LOCKED, так что
+    параллельные узлы не ждут друг друга. Там, где SKIP LOCKED нет (SQLite в тестах),
+    захват делается условным UPDATE с уникальной меткой: строку получает тот, чей
+    UPDATE ее изменил. Возвращает захваченные строки вместе с сообщениями.
+    """
+    size = size or settings.MAILING_SEND_CHUNK_SIZE
+    now = timezone.now()
+    lease_until = now + timedelta(seconds=settings.MAILING_OUTBOX_LEASE)
+    token = '%s:%s' % (owner or worker_id(), uuid.uuid4().hex[:8])
+    candidates = Delivery.objects.filter(claimable(now, retry)).order_by('pk')
+    lease = {
+        'status': 'sending', 'lease_until': lease_until, 'claimed_by': token, 'attempts': F('attempts') + 1,
+        'enqueued_until': None,
+    }
+
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            ids = list(candidates.select_for_update(skip_locked=True).values_list('pk', flat=True)[:size])
+            if not ids:
+                return []
+            Delivery.objects.filter(pk__in=ids).update(**lease)
+    else:
+        while True:
+            ids = list(candidates.values_list('pk', flat=True)[:size])
+            if not ids:
+                return []
+            # Все кандидаты могли уйти другому узлу между SELECT и UPDATE - тогда берем следующих.
+            if Delivery.objects.filter(claimable(now, retry), pk__in=ids).update(**lease):
+                break
+
+    return list(Delivery.objects.filter(claimed_by=token, status='sending').select_related('message'))
+
+
+def completion_updates(deliveries, results):
+    """UPDATE для complete парами (queryset, значения)."""
+    now = timezone.now()
+    sent, failed, retry = [], [], {}
+    for delivery, error in zip(deliveries, results):
+        if error is None:
+            sent.append(delivery.pk)
+        elif should_retry(delivery, error):
+            retry[delivery.pk] = now + backoff(delivery.attempts)
+        else:
+            failed.append(delivery.pk)
+    claimed_by = deliveries[0].claimed_by if deliveries else None
+    updates = []
+    if sent:
+        updates.append((Delivery.objects.filter(pk__in=sent, claimed_by=claimed_by),
+                        {'status': 'sent', 'lease_until': None}))
+    if failed:
+        updates.append((Delivery.objects.filter(pk__in=failed, claimed_by=claimed_by),
+                        {'status': 'failed', 'lease_until': None}))
+    if retry:
+        next_attempt_at = Case(
+            *[When(pk=pk, then=Value(at)) for pk, at in retry.items()], output_field=DateTimeField()
+        )
+        updates.append((Delivery.objects.filter(pk__in=retry, claimed_by=claimed_by),
+                        {'status': 'retry', 'lease_until': None, 'next_attempt_at': next_attempt_at}))
+        logger.info("%s deliveries scheduled for retry", len(retry))
+    return updates
+
+
+def complete(deliveries, results):
+    """
+    Отмечает результат отправки захваченных строк. Строки с временной ошибкой, у которых
+    не исчерпан MAILING_RETRY_MAX_ATTEMPTS, ставятся на повтор с экспоненциальной задержкой,
+    остальные ошибки окончательные. Строки, аренду которых за это время перехватил другой
+    узел, не трогаются.
+    """
+    for queryset, values in completion_updates(deliveries, results):
+        queryset.update(**values)
+
+
+async def acomplete(deliveries, results):
+    """complete для асинхронного движка, через асинхронный ORM."""
+    for queryset, values in completion_updates(deliveries, results):
+        await queryset.aupdate(**values)
+
+
+def release_updates(deliveries):
+    """UPDATE для release парами (queryset, значения)."""
+    if not deliveries:
+        return []
+    # Строка с прошлыми попытками уходит в очередь повторов; без next_attempt_at задание
+    # повторов ее бы не выбрало, поэтому повтор разрешается сразу.
+    status = Case(When(attempts__gt=1, then=Value('retry')), default=Value('pending'))
+    next_attempt_at = Case(
+        When(attempts__gt=1, then=Value(timezone.now())), default=F('next_attempt_at'), output_field=DateTimeField()
+    )
+    queryset = Delivery.objects.filter(
+        pk__in=[delivery.pk for delivery in deliveries], claimed_by=deliveries[0].claimed_by
+    )
+    return [(queryset, {
+        'status': status, 'next_attempt_at': next_attempt_at, 'lease_until': None, 'attempts': F('attempts') - 1,
+    })]
+
+
+def release(deliveries):
+    """Возвращает захваченные, но не отправленные строки в outbox, не засчитывая попытку."""
+    for queryset, values in release_updates(deliveries):
+        queryset.update(**values)
+
+
+async def arelease(deliveries):
+    """release для асинхронного движка, через асинхронный ORM."""
+    for queryset, values in release_updates(deliveries):
+        await queryset.aupdate(**values)
+
+
+def purge_finished(cutoff, chunk_size=5000):
+    """
+    Удаляет отправленные и окончательно неудачные строки outbox, созданные до cutoff. Удаляет
+    пачками по chunk_size, чтобы не держать длинную транзакцию. Возвращает число удаленных строк.
+    """
+    finished = Delivery.objects.filter(status__in=('sent', 'failed'), created_at__lt=cutoff)
+    removed = 0
+    while ids := list(finished.values_list('pk', flat=True)[:chunk_size]):
+        deleted, _ = Delivery.objects.filter(pk__in=ids).delete()
+        removed += deleted
+    if removed:
+        logger.info("Purged %s finished outbox rows", removed)
+    return removed
+
+
+def mark_enqueued(retry=False):
+    """
+    Отмечает доступные для захвата строки outbox, под которые еще не поставлены задачи,
+    как покрытые задачами на MAILING_OUTBOX_LEASE секунд. Захват строки снимает отметку;
+    если задачи потерялись, строки снова попадут в очередь после истечения отметки.
+    Возвращает число отмеченных строк.
+    """
+    now = timezone.now()
+    uncovered = Q(enqueued_until__isnull=True) | Q(enqueued_until__lt=now)
+    return Delivery.objects.filter(claimable(now, retry), uncovered) \
+        .update(enqueued_until=now + timedelta(seconds=settings.MAILING_OUTBOX_LEASE))
+
+
+def pending_count(retry=False):
+    return Delivery.objects.filter(claimable(timezone.now(), retry)).count()
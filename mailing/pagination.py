@@ -0,0 +1,86 @@
+import base64
+import binascii
+from datetime import datetime
+
+from django.http import Http404
+
+
+def encode_cursor(timestamp, pk):
+    return base64.urlsafe_b64encode(('%s|%s' % (timestamp.isoformat(), pk)).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        timestamp, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(timestamp), int(pk)
+    except (binascii.Error, UnicodeError, ValueError):
+        raise Http404('Неверный курсор страницы')
+
+
+class KeysetPage:
+    """Страница keyset-пагинации с интерфейсом page_obj: has_next/has_previous и курсоры соседних страниц."""
+
+    def __init__(self, object_list, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+    """
+    Пагинация по ключу (timestamp, id) от новых записей к старым. Страница выбирается
+    условием «ключ меньше курсора» и LIMIT по индексу на (timestamp, id), поэтому ее
+    стоимость не зависит от того, насколько далеко она от начала, в отличие от OFFSET.
+    Границы страницы задаются курсором after (следующая) или before (предыдущая).
+    """
+
+    def __init__(self, queryset, per_page, field='timestamp'):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.field = field
+
+    def page(self, after=None, before=None):
+        queryset = self.queryset
+        backwards = before is not None
+        cursor = before if backwards else after
+        if cursor is not None:
+            value, pk = decode_cursor(cursor)
+            # Диапазон по первому полю ключа идет в индекс, равные значения доотсекаются по id.
+            if backwards:
+                queryset = queryset.filter(**{'%s__gte' % self.field: value}).exclude(
+                    **{self.field: value, 'pk__lte': pk}
+                )
+            else:
+                queryset = queryset.filter(**{'%s__lte' % self.field: value}).exclude(
+                    **{self.field: value, 'pk__gte': pk}
+                )
+        order = (self.field, 'pk') if backwards else ('-%s' % self.field, '-pk')
+        rows = list(queryset.order_by(*order)[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if backwards:
+            rows.reverse()
+        if not rows:
+            return KeysetPage(rows, None, None)
+        first, last = self.cursor_for(rows[0]), self.cursor_for(rows[-1])
+        if backwards:
+            return KeysetPage(rows, last, first if has_more else None)
+        return KeysetPage(rows, last if has_more else None, first if cursor is not None else None)
+
+    def cursor_for(self, obj):
+        return encode_cursor(getattr(obj, self.field), obj.pk)
@@ -0,0 +1,106 @@
+import logging
+import re
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connection
+
+from mailing.models import Log
+
+logger = logging.getLogger(__name__)
+
+BOUND_RE = re.compile(r"FROM \((MINVALUE|'[^']+')\) TO \((MAXVALUE|'[^']+')\)")
+
+
+def month_start(moment):
+    return datetime(moment.year, moment.month, 1, tzinfo=dt_timezone.utc)
+
+
+def add_months(moment, months):
+    month = moment.month - 1 + months
+    return moment.replace(year=moment.year + month // 12, month=month % 12 + 1)
+
+
+def partition_name(start):
+    return '%s_y%04dm%02d' % (Log._meta.db_table, start.year, start.month)
+
+
+def is_partitioned():
+    """Секционирована ли таблица Log: секции по месяцам есть только на Postgres."""
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", [Log._meta.db_table])
+        row = cursor.fetchone()
+    return row is not None and row[0] == 'p'
+
+
+def missing_months(now, months_ahead, partitions):
+    """
+    Начала месяцев от текущего на months_ahead вперед, которые не покрыты ни одной из
+    секций partitions (список (имя, начало или None, конец или None)).
+    """
+    missing = []
+    for offset in range(months_ahead + 1):
+        lower = add_months(month_start(now), offset)
+        upper = add_months(lower, 1)
+        # Месяц уже покрыт, например исходной таблицей, ставшей первой секцией.
+        if not any((start is None or start < upper) and (end is None or lower < end) for _, start, end in partitions):
+            missing.append(lower)
+    return missing
+
+
+def ensure_partitions(now, months_ahead=None):
+    """
+    Создает месячные секции Log от текущего месяца на months_ahead месяцев вперед, чтобы
+    вставке всегда было куда писать. Вызывается в начале каждого тика, пишущего Log, в том
+    числе из параллельных заданий, поэтому секция создается с IF NOT EXISTS: на границе
+    месяца ее может одновременно создавать другое задание. Когда секции уже есть, это два
+    запроса к каталогу. Секции по умолчанию нет намеренно: строки в ней не дали бы потом
+    создать секцию их месяца.
+    """
+    if not is_partitioned():
+        return []
+    months_ahead = settings.MAILING_LOG_PARTITIONS_AHEAD if months_ahead is None else months_ahead
+    created = []
+    with connection.cursor() as cursor:
+        for lower in missing_months(now, months_ahead, list_partitions()):
+            name = partition_name(lower)
+            cursor.execute('CREATE TABLE IF NOT EXISTS %s PARTITION OF %s FOR VALUES FROM (%%s) TO (%%s)' % (
+                connection.ops.quote_name(name), connection.ops.quote_name(Log._meta.db_table)
+            ), [lower, add_months(lower, 1)])
+            created.append(name)
+            logger.info("Created log partition %s", name)
+    return created
+
+
+def parse_bound(value):
+    if value in ('MINVALUE', 'MAXVALUE'):
+        return None
+    return datetime.fromisoformat(value.strip("'")).astimezone(dt_timezone.utc)
+
+
+def list_partitions():
+    """Секции Log в порядке начала: список (имя, начало или None, конец или None)."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = to_regclass(%s)",
+            [Log._meta.db_table],
+        )
+        rows = cursor.fetchall()
+    partitions = []
+    for name, bound in rows:
+        match = BOUND_RE.search(bound)
+        if match:
+            partitions.append((name, parse_bound(match.group(1)), parse_bound(match.group(2))))
+    return sorted(partitions, key=lambda partition: partition[1] or datetime.min.replace(tzinfo=dt_timezone.utc))
+
+
+def drop_partition(name):
+    """Отсоединяет и удаляет секцию целиком - без построчного DELETE и последующего VACUUM."""
+    quoted = connection.ops.quote_name(name)
+    with connection.cursor() as cursor:
+        cursor.execute('ALTER TABLE %s DETACH PARTITION %s' % (connection.ops.quote_name(Log._meta.db_table), quoted))
+        cursor.execute('DROP TABLE %s' % quoted)
+    logger.info("Dropped log partition %s", name)
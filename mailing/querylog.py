@@ -0,0 +1,60 @@
+import logging
+import re
+from collections import Counter
+
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+# Отпечаток запроса - его SQL без параметров: драйвер получает значения отдельно, так что
+# запросы, различающиеся только значениями, уже совпадают. Списки IN разной длины
+# сворачиваются в один отпечаток.
+IN_LIST = re.compile(r'\((?:%s, )*%s\)')
+
+
+def fingerprint(sql):
+    return IN_LIST.sub('(...)', sql)
+
+
+class QueryRecorder:
+    """Обертка выполнения запросов (connection.execute_wrapper), считающая отпечатки SQL."""
+
+    def __init__(self):
+        self.fingerprints = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        self.fingerprints[fingerprint(sql)] += 1
+        return execute(sql, params, many, context)
+
+    @property
+    def count(self):
+        return sum(self.fingerprints.values())
+
+    def duplicates(self):
+        """Повторявшиеся отпечатки с числом повторов, самые частые первыми."""
+        return [(sql, count) for sql, count in self.fingerprints.most_common() if count > 1]
+
+
+class DuplicateQueryMiddleware:
+    """
+    Пишет в лог отпечатки SQL, выполненные за запрос больше одного раза: обычно это
+    N+1 - ленивая загрузка связи в цикле шаблона. Включается настройкой QUERY_DEBUG;
+    запросы потоковых ответов, выполняемые после выхода из представления, не учитываются.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            response = self.get_response(request)
+        duplicates = recorder.duplicates()
+        if duplicates:
+            logger.warning(
+                "%s %s: %s queries, %s repeated fingerprints", request.method, request.path,
+                recorder.count, len(duplicates)
+            )
+            for sql, count in duplicates:
+                logger.warning("  %s x %s", count, sql)
+        return response
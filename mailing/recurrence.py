@@ -0,0 +1,173 @@
+import bisect
+import re
+from datetime import datetime, timedelta, timezone as dt_timezone
+from functools import lru_cache
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from dateutil import rrule
+from django.conf import settings
+from django.core.exceptions import ValidationError
+
+CRON_ALIASES = {
+    '@hourly': '0 * * * *',
+    '@daily': '0 0 * * *',
+    '@weekly': '0 0 * * 0',
+    '@monthly': '0 0 1 * *',
+    '@yearly': '0 0 1 1 *',
+}
+
+MONTH_NAMES = ['jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec']
+DAY_NAMES = ['sun', 'mon', 'tue', 'wed', 'thu', 'fri', 'sat']
+CRON_WEEKDAYS = [rrule.SU, rrule.MO, rrule.TU, rrule.WE, rrule.TH, rrule.FR, rrule.SA]
+
+
+def frequency_rule(frequency, start_local):
+    """
+    RRULE для встроенной периодичности рассылки. Месяц календарный: рассылка, начатая 31-го,
+    в коротких месяцах уходит в последний день месяца, а не пропускает его.
+    """
+    if frequency == 'monthly' and start_local.day > 28:
+        return 'FREQ=MONTHLY;BYMONTHDAY=%s,-1;BYSETPOS=1' % start_local.day
+    return 'FREQ=%s' % {'daily': 'DAILY', 'weekly': 'WEEKLY', 'monthly': 'MONTHLY'}[frequency]
+
+
+def is_rrule(schedule):
+    return 'FREQ=' in schedule.upper()
+
+
+def parse_cron_field(field, low, high, names=None):
+    """
+    Значения одного поля cron-выражения: *, списки, диапазоны, шаг и имена (jan, mon).
+    Возвращает None для поля без ограничения.
+    """
+    if field == '*':
+        return None
+    values = set()
+    for part in field.lower().split(','):
+        value_range, _, step = part.partition('/')
+        if names:
+            for index, name in enumerate(names):
+                value_range = value_range.replace(name, str(index + low))
+        if value_range == '*':
+            start, end = low, high
+        elif '-' in value_range:
+            start, end = (int(value) for value in value_range.split('-', 1))
+        else:
+            start = end = int(value_range)
+            if step:
+                end = high
+        if not low <= start <= end <= high:
+            raise ValueError('value out of range: %s' % part)
+        values.update(range(start, end + 1, int(step) if step else 1))
+    return sorted(values)
+
+
+def cron_to_rule(expression, dtstart):
+    """
+    Переводит cron-выражение из пяти полей (минута, час, день месяца, месяц, день недели)
+    в правило dateutil. Как и в cron, ограничения дня месяца и дня недели объединяются по ИЛИ.
+    """
+    fields = CRON_ALIASES.get(expression, expression).split()
+    if len(fields) != 5:
+        raise ValueError('cron expression must have 5 fields')
+    minutes = parse_cron_field(fields[0], 0, 59)
+    hours = parse_cron_field(fields[1], 0, 23)
+    monthdays = parse_cron_field(fields[2], 1, 31)
+    months = parse_cron_field(fields[3], 1, 12, MONTH_NAMES)
+    weekdays = parse_cron_field(fields[4], 0, 7, DAY_NAMES)
+    if weekdays is not None:
+        weekdays = sorted({CRON_WEEKDAYS[day % 7] for day in weekdays}, key=lambda day: day.weekday)
+
+    options = {
+        'dtstart': dtstart,
+        'byminute': minutes if minutes is not None else range(60),
+        'byhour': hours if hours is not None else range(24),
+        'bymonth': months,
+        'bysecond': 0,
+    }
+    if monthdays is not None and weekdays is not None:
+        rules = rrule.rruleset()
+        rules.rrule(rrule.rrule(rrule.DAILY, bymonthday=monthdays, **options))
+        rules.rrule(rrule.rrule(rrule.DAILY, byweekday=weekdays, **options))
+        return rules
+    return rrule.rrule(rrule.DAILY, bymonthday=monthdays, byweekday=weekdays, **options)
+
+
+def build_rule(schedule, dtstart):
+    """Правило dateutil для RRULE (FREQ=...) или cron-выражения, считающее от dtstart."""
+    schedule = schedule.strip()
+    if is_rrule(schedule):
+        return rrule.rrulestr(re.sub(r'^RRULE:', '', schedule, flags=re.IGNORECASE), dtstart=dtstart)
+    return cron_to_rule(schedule, dtstart)
+
+
+def validate_schedule(schedule):
+    try:
+        build_rule(schedule, datetime(2000, 1, 1))
+    except (ValueError, TypeError) as e:
+        raise ValidationError('Неверное правило расписания: %s' % e)
+
+
+def validate_time_zone(name):
+    try:
+        ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValidationError('Неизвестный часовой пояс: %s' % name)
+
+
+class Recurrence:
+    """
+    Расписание запусков в часовом поясе рассылки. Правило считается по местному времени,
+    поэтому «каждый день в 9:00» не сдвигается при переходе на летнее время, а месяц - это
+    календарный месяц. Держит окно из ближайших MAILING_RECURRENCE_CACHE_SIZE запусков,
+    так что запросы внутри окна не пересчитывают правило.
+    """
+
+    def __init__(self, schedule, start_time, time_zone):
+        self.schedule = schedule
+        self.tz = ZoneInfo(time_zone)
+        self.start_time = start_time
+        self.cache_size = settings.MAILING_RECURRENCE_CACHE_SIZE
+        # Запуски RRULE зависят от dtstart (шаг INTERVAL, COUNT), поэтому правило строится
+        # от начала рассылки. Cron от dtstart не зависит и строится от начала окна, чтобы не
+        # перебирать все запуски с начала рассылки.
+        self.rule = build_rule(schedule, self.local(start_time)) if is_rrule(schedule) else None
+        self._window_start = None
+        self._window = []
+        self._exhausted = False
+
+    def local(self, moment):
+        return moment.astimezone(self.tz).replace(tzinfo=None)
+
+    def to_utc(self, local):
+        return local.replace(tzinfo=self.tz).astimezone(dt_timezone.utc)
+
+    def upcoming(self, not_before, count=None):
+        """Ближайшие count запусков, которые приходятся не раньше not_before."""
+        not_before = max(not_before, self.start_time)
+        rule = self.rule
+        if rule is None:
+            dtstart = self.local(not_before)
+            if dtstart.second or dtstart.microsecond:
+                dtstart = dtstart.replace(second=0, microsecond=0) + timedelta(minutes=1)
+            rule = cron_to_rule(self.schedule, dtstart)
+        runs = rule.xafter(self.local(not_before), count=count or self.cache_size, inc=True)
+        return [self.to_utc(run) for run in runs]
+
+    def next_after(self, not_before):
+        """Первый запуск не раньше not_before или None, если правило исчерпано."""
+        window = self._window
+        if self._window_start is not None and self._window_start <= not_before \
+                and (self._exhausted or window and not_before <= window[-1]):
+            index = bisect.bisect_left(window, not_before)
+            return window[index] if index < len(window) else None
+        window = self.upcoming(not_before)
+        self._window_start, self._window = not_before, window
+        self._exhausted = len(window) < self.cache_size
+        return window[0] if window else None
+
+
+@lru_cache(maxsize=1024)
+def get_recurrence(schedule, start_time, time_zone):
+    # Рассылки с одинаковым расписанием и началом делят один объект и его окно запусков.
+    return Recurrence(schedule, start_time, time_zone)
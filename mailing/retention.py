@@ -0,0 +1,97 @@
+import csv
+import gzip
+import logging
+import os
+from datetime import datetime, time as dt_time, timedelta, timezone as dt_timezone
+from pathlib import Path
+
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+
+from mailing import partitions, viewcache
+from mailing.models import Log, LogRollup
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_FIELDS = ('id', 'timestamp', 'message_id', 'client_id', 'recipient', 'status', 'reply__code', 'reply__text')
+
+
+def rollup(queryset):
+    """
+    Сворачивает строки Log в дневные итоги LogRollup. Повторный запуск по тем же строкам
+    перезаписывает итог, а не удваивает его, поэтому прерванную архивацию можно повторить.
+    """
+    rows = queryset.annotate(day=TruncDate('timestamp', tzinfo=dt_timezone.utc)).order_by().values(
+        'day', 'message_id', 'status', 'reply_id'
+    ).annotate(count=Count('id'))
+    rollups = [
+        LogRollup(day=row['day'], message_id=row['message_id'], status=row['status'],
+                  reply_id=row['reply_id'], count=row['count'])
+        for row in rows
+    ]
+    LogRollup.objects.bulk_create(
+        rollups, update_conflicts=True, unique_fields=['day', 'message', 'status', 'reply'], update_fields=['count']
+    )
+    return len(rollups)
+
+
+def write_archive(queryset, path):
+    """Пишет строки Log в gzip CSV потоково; файл появляется под своим именем только целиком."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    partial = path.with_name(path.name + '.part')
+    count = 0
+    with gzip.open(partial, 'wt', newline='', encoding='utf-8') as archive:
+        writer = csv.writer(archive)
+        writer.writerow(field.replace('__', '_') for field in ARCHIVE_FIELDS)
+        for row in queryset.order_by('id').values_list(*ARCHIVE_FIELDS).iterator(chunk_size=5000):
+            writer.writerow(row)
+            count += 1
+    os.replace(partial, path)
+    return count
+
+
+def archive_old_logs(cutoff, archive_dir=None):
+    """
+    Сворачивает в LogRollup, архивирует в archive_dir (если задан) и удаляет строки Log
+    старше cutoff. На Postgres месячные секции, целиком лежащие до cutoff, отсоединяются
+    и удаляются без построчного DELETE; остаток удаляется по суткам, каждые сутки в своей
+    транзакции. Возвращает число удаленных строк.
+    """
+    removed = 0
+    if partitions.is_partitioned():
+        for name, lower, upper in partitions.list_partitions():
+            if upper is None or upper > cutoff:
+                break
+            queryset = Log.objects.filter(timestamp__lt=upper)
+            if lower is not None:
+                queryset = queryset.filter(timestamp__gte=lower)
+            with transaction.atomic():
+                rollup(queryset)
+                if archive_dir:
+                    write_archive(queryset, Path(archive_dir) / ('%s.csv.gz' % name))
+                removed += queryset.count()
+                partitions.drop_partition(name)
+
+    # Остаток удаляется по суткам, только целиком прошедшим до cutoff: итог за неполные
+    # сутки перезаписался бы итогом по оставшимся строкам при следующем запуске.
+    cutoff = datetime.combine(cutoff.astimezone(dt_timezone.utc).date(), dt_time.min, tzinfo=dt_timezone.utc)
+    oldest = Log.objects.filter(timestamp__lt=cutoff).order_by('timestamp').values_list('timestamp', flat=True).first()
+    if oldest is None:
+        viewcache.bump('log')
+        return removed
+    day = datetime.combine(oldest.astimezone(dt_timezone.utc).date(), dt_time.min, tzinfo=dt_timezone.utc)
+    while day < cutoff:
+        queryset = Log.objects.filter(timestamp__gte=day, timestamp__lt=day + timedelta(days=1))
+        with transaction.atomic():
+            if queryset.exists():
+                rollup(queryset)
+                if archive_dir:
+                    write_archive(queryset, Path(archive_dir) / ('mailing_log_%s.csv.gz' % day.date().isoformat()))
+                deleted, _ = queryset.delete()
+                removed += deleted
+                logger.info("Archived delivery log for %s: %s rows", day.date(), deleted)
+        day += timedelta(days=1)
+    viewcache.bump('log')
+    return removed
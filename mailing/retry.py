@@ -0,0 +1,35 @@
+import random
+import smtplib
+from datetime import timedelta
+
+from django.conf import settings
+
+from mailing.logs import describe_error
+
+
+def is_transient(error):
+    """
+    Временная ли ошибка отправки: ответы 4xx, обрыв соединения, таймаут и сброс соединения
+    стоит повторить, а ответы 5xx и прочие ошибки считаются окончательными.
+    """
+    code, reply = describe_error(error)
+    if code is not None:
+        return 400 <= code < 500
+    if isinstance(error, smtplib.SMTPServerDisconnected):
+        return True
+    # Таймауты и сбросы соединения - это OSError; прочие SMTPException тоже OSError, но не временные.
+    return isinstance(error, OSError) and not isinstance(error, smtplib.SMTPException)
+
+
+def backoff(attempts):
+    """
+    Задержка перед следующей попыткой после attempts неудачных: экспоненциальный рост
+    от MAILING_RETRY_BASE_DELAY до MAILING_RETRY_MAX_DELAY со случайным разбросом
+    в пределах половины задержки, чтобы повторы не приходили к серверу одной волной.
+    """
+    delay = min(settings.MAILING_RETRY_MAX_DELAY, settings.MAILING_RETRY_BASE_DELAY * 2 ** (attempts - 1))
+    return timedelta(seconds=random.uniform(delay / 2, delay))
+
+
+def should_retry(delivery, error):
+    return delivery.attempts < settings.MAILING_RETRY_MAX_ATTEMPTS and is_transient(error)
@@ -0,0 +1,118 @@
+import logging
+import zlib
+from datetime import timedelta
+
+from django.conf import settings
+
+from mailing.models import Client, SegmentSnapshot
+
+logger = logging.getLogger(__name__)
+
+DECODE_BLOCK_SIZE = 64 * 1024
+
+
+def encode_varint(value):
+    out = bytearray()
+    while value >= 0x80:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+    return out
+
+
+def encode_ids(chunks):
+    """
+    Сжимает возрастающие id, приходящие пачками: разности соседних id в varint, затем zlib.
+    Плотные id дают разность 1 - один байт до сжатия и почти ничего после. Повторы
+    допустимы (разность 0), убывающий id - ошибка: отрицательную разность varint не хранит.
+    """
+    compressor = zlib.compressobj(9)
+    parts, previous = [], 0
+    for chunk in chunks:
+        buffer = bytearray()
+        for value in chunk:
+            if value < previous:
+                raise ValueError('ids must be ascending: %s after %s' % (value, previous))
+            buffer += encode_varint(value - previous)
+            previous = value
+        parts.append(compressor.compress(bytes(buffer)))
+    parts.append(compressor.flush())
+    return b''.join(parts)
+
+
+def decompressed_blocks(data):
+    decompressor = zlib.decompressobj()
+    for offset in range(0, len(data), DECODE_BLOCK_SIZE):
+        yield decompressor.decompress(data[offset:offset + DECODE_BLOCK_SIZE])
+    yield decompressor.flush()
+
+
+def decode_ids(data):
+    """Лениво разворачивает encode_ids: распаковывает блоками, в памяти не держит весь список."""
+    value = shift = current = 0
+    for block in decompressed_blocks(data):
+        for byte in block:
+            value |= (byte & 0x7f) << shift
+            if byte & 0x80:
+                shift += 7
+                continue
+            current += value
+            yield current
+            value = shift = 0
+
+
+def iter_client_ids(queryset, chunk_size):
+    """id клиентов queryset по возрастанию, пачками по ключу pk без OFFSET."""
+    queryset = queryset.order_by('pk').values_list('pk', flat=True)
+    last_pk = 0
+    while True:
+        chunk = list(queryset.filter(pk__gt=last_pk)[:chunk_size])
+        if chunk:
+            yield chunk
+        if len(chunk) < chunk_size:
+            return
+        last_pk = chunk[-1]
+
+
+def materialize(segment, chunk_size=None):
+    """Вычисляет состав сегмента и сохраняет его новым снимком; прежние снимки сегмента удаляются."""
+    chunk_size = chunk_size or settings.MAILING_SEND_CHUNK_SIZE
+    size = 0
+
+    def counted(chunks):
+        nonlocal size
+        for chunk in chunks:
+            size += len(chunk)
+            yield chunk
+
+    data = encode_ids(counted(iter_client_ids(segment.clients(), chunk_size)))
+    snapshot = SegmentSnapshot.objects.create(segment=segment, size=size, client_ids=data)
+    segment.snapshots.exclude(pk=snapshot.pk).delete()
+    logger.info("Materialized segment %s: %s clients in %s bytes", segment.pk, size, len(data))
+    return snapshot
+
+
+def snapshot_for(segment, now):
+    """
+    Снимок сегмента для запуска рассылки в момент now. Рассылки одного сегмента, стартующие
+    в пределах MAILING_SEGMENT_SNAPSHOT_TTL секунд, делят один снимок, если правило сегмента
+    с тех пор не менялось.
+    """
+    ttl = timedelta(seconds=settings.MAILING_SEGMENT_SNAPSHOT_TTL)
+    snapshot = segment.snapshots.filter(
+        created_at__gte=max(now - ttl, segment.updated_at)
+    ).order_by('-created_at').first()
+    return snapshot or materialize(segment)
+
+
+def iter_snapshot_recipients(snapshot, chunk_size):
+    """
+    Получатели снимка парами (id клиента, email). Адреса дочитываются пачками по первичному
+    ключу, клиенты, удаленные или отключенные после снимка, пропускаются.
+    """
+    ids = decode_ids(bytes(snapshot.client_ids))
+    while True:
+        chunk = [client_id for _, client_id in zip(range(chunk_size), ids)]
+        if not chunk:
+            return
+        yield from Client.objects.filter(pk__in=chunk, is_active=True).order_by('pk').values_list('pk', 'email')
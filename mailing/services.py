@@ -1,69 +1,223 @@
+import asyncio
 import logging
-from datetime import datetime, timedelta
-import pytz
+import math
+import smtplib
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import timedelta
 from django.conf import settings
-from django.core.mail import send_mail
-from mailing.models import Mailing, Log
+from django.core.mail import EmailMessage
+from django.db import connections
+from django.db.models import Min, Prefetch
+from django.utils import timezone
+from mailing import metrics, viewcache
+from mailing.connections import SMTPConnectionPool
+from mailing.logs import LogWriter
+from mailing.models import Mailing, Message
+from mailing.outbox import claim_batch, complete, enqueue_runs, mark_enqueued, pending_count, release
+from mailing.partitions import ensure_partitions
+from mailing.throttle import Throttle
 
 logger = logging.getLogger(__name__)
 
 
+@dataclass
+class TickResult:
+    """Сводный результат одного запуска send_mailings."""
+    mailings: int = 0
+    sent: int = 0
+    failed: int = 0
+    queued: int = 0
+    deferred: int = 0
+    duration: float = 0.0
+
+    def add(self, sent, failed, deferred=0):
+        self.sent += sent
+        self.failed += failed
+        self.deferred += deferred
+
+
+def get_due_mailings(now):
+    """
+    Рассылки, у которых наступило время очередного запуска, включая запуски,
+    пропущенные, пока планировщик не работал. Выборка идет по индексу (status, next_run_at).
+    Сегменты и id сообщений всех рассылок читаются сразу, а не по запросу на рассылку.
+    """
+    return Mailing.objects.filter(status='started', next_run_at__lte=now).order_by('next_run_at') \
+        .select_related('segment') \
+        .prefetch_related(Prefetch('message_set', queryset=Message.objects.only('pk', 'mailing')))
+
+
+def next_due_at():
+    """Ближайшее время запуска среди всех активных рассылок, чтобы диспетчер знал, когда проснуться."""
+    return Mailing.objects.filter(status='started').aggregate(next_run_at=Min('next_run_at'))['next_run_at']
+
+
 def send_mailings():
-    tz = pytz.timezone('Europe/Moscow')
-    current_datetime = datetime.now(tz)
+    """
+    Тик диспетчера: ставит наступившие запуски рассылок в outbox, а затем разбирает outbox
+    выбранным движком доставки. Тик можно запускать на нескольких узлах одновременно:
+    запуск рассылки и каждая строка outbox достаются ровно одному из них.
+    """
+    started = time.monotonic()
+    current_datetime = timezone.now()
     logger.info("Running send_mailings at %s", current_datetime)
+    # Секция Log на новый месяц должна появиться до первой записи в него, даже если
+    # диспетчер работает без перезапуска дольше MAILING_LOG_PARTITIONS_AHEAD месяцев.
+    ensure_partitions(current_datetime)
 
-    for mailing in Mailing.objects.filter(status='started'):
+    result = TickResult()
+    due = list(get_due_mailings(current_datetime))
+    for mailing in due:
         logger.info("Processing mailing: %s", mailing)
+        log_catch_up(mailing, current_datetime)
+    queued = enqueue_runs(due, current_datetime)
+    result.mailings = len(queued)
+    result.queued = sum(queued.values())
+    metrics.due_mailings.set(len(due))
+
+    dispatch(result)
+    result.duration = time.monotonic() - started
+    record_tick('send_mailings', result)
+    logger.info("send_mailings finished: %s", result)
+    return result
+
+
+def retry_deliveries():
+    """
+    Тик повторных отправок: разбирает строки outbox, у которых наступило время повтора
+    после временной ошибки. Запускается своим заданием, независимо от send_mailings.
+    """
+    started = time.monotonic()
+    ensure_partitions(timezone.now())
+    result = TickResult()
+    dispatch(result, retry=True)
+    result.duration = time.monotonic() - started
+    record_tick('retry_deliveries', result)
+    if result.sent or result.failed:
+        logger.info("retry_deliveries finished: %s", result)
+    return result
+
+
+def record_tick(job, result):
+    viewcache.bump_pending('log')
+    metrics.tick_duration.labels(job=job).observe(result.duration)
+    metrics.outbox_depth.labels(queue='retry' if job == 'retry_deliveries' else 'pending') \
+        .set(pending_count(retry=job == 'retry_deliveries'))
+
+
+def dispatch(result, retry=False):
+    """Разбирает outbox движком доставки MAILING_DELIVERY_ENGINE; retry - только строки на повтор."""
+    if settings.MAILING_DELIVERY_ENGINE == 'asyncio':
+        from mailing.async_services import dispatch_async
+        asyncio.run(dispatch_async(result, retry))
+    elif settings.MAILING_DELIVERY_ENGINE == 'celery':
+        dispatch_celery(retry)
+    elif settings.MAILING_DELIVERY_ENGINE == 'threads':
+        workers = settings.MAILING_DISPATCH_WORKERS
+        with SMTPConnectionPool(size=workers) as pool, LogWriter() as log_writer:
+            dispatch_threaded(pool, log_writer, get_throttle(), result, workers, retry)
+    else:
+        with SMTPConnectionPool() as pool, LogWriter() as log_writer:
+            result.add(*drain_outbox(pool, log_writer, get_throttle(), retry))
+
+
+def log_catch_up(mailing, current_datetime):
+    if current_datetime - mailing.next_run_at >= timedelta(minutes=1):
+        logger.info("Catching up missed run of mailing %s scheduled at %s", mailing, mailing.next_run_at)
+
+
+def get_throttle():
+    throttle = Throttle()
+    return throttle if throttle.enabled else None
+
+
+def dispatch_threaded(pool, log_writer, throttle, result, workers, retry=False):
+    """
+    Разбирает outbox на пуле из workers потоков: каждый поток сам захватывает пачки,
+    поэтому медленный SMTP-обмен одной пачки не задерживает остальные.
+    """
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='send_mailings') as executor:
+        futures = [
+            executor.submit(run_in_worker, drain_outbox, pool, log_writer, throttle, retry) for _ in range(workers)
+        ]
+        for future in futures:
+            try:
+                result.add(*future.result())
+            except Exception:
+                logger.exception("Delivery worker failed")
+
+
+def dispatch_celery(retry=False):
+    """
+    Ставит в очередь Celery по задаче на каждую пачку строк outbox, под которые задач еще
+    нет: при отставании воркеров следующий тик не дублирует задачи прежних тиков.
+    SMTP-обмен и запись Log выполняют воркеры, которые масштабируются отдельно.
+    """
+    from mailing.tasks import deliver_outbox_batch
+
+    for _ in range(math.ceil(mark_enqueued(retry) / settings.MAILING_SEND_CHUNK_SIZE)):
+        deliver_outbox_batch.delay(retry)
+
+
+def run_in_worker(func, *args):
+    # У каждого потока свое соединение с БД; закрываем его, чтобы не копить открытые соединения.
+    try:
+        return func(*args)
+    finally:
+        connections.close_all()
+
+
+def drain_outbox(pool, log_writer, throttle=None, retry=False):
+    """
+    Захватывает и отправляет пачки outbox, пока они не кончатся или не исчерпается лимит
+    скорости отправки. Возвращает (отправлено, ошибок, отложено).
+    """
+    sent = failed = deferred = 0
+    while deliveries := claim_batch(retry=retry):
+        batch_sent, batch_failed, deferred = send_deliveries(pool, deliveries, log_writer, throttle)
+        sent += batch_sent
+        failed += batch_failed
+        if deferred:
+            logger.info("Send rate limit reached, %s deliveries deferred", deferred)
+            break
+    return sent, failed, deferred
+
+
+def build_email(delivery):
+    return EmailMessage(
+        subject=delivery.message.subject,
+        body=delivery.message.body,
+        from_email=settings.EMAIL_HOST_USER,
+        to=[delivery.recipient]
+    )
+
 
-        is_mailing = False
-        emails = [client.email for client in mailing.recipients.all()]
-        hour_start = mailing.start_time.hour
-        minute_start = mailing.start_time.minute
-        attempt_status = 'success'
-        server_response = 'Email sent successfully'
-        messages = mailing.message_set.all()
-
-        if mailing.frequency == 'daily' and current_datetime >= mailing.start_time \
-                and current_datetime.hour == hour_start and current_datetime.minute == minute_start:
-            mailing.start_time = mailing.start_time + timedelta(days=1)
-            is_mailing = True
-
-        elif mailing.frequency == 'weekly' and current_datetime >= mailing.start_time \
-                and current_datetime.weekday() == mailing.start_time.weekday() \
-                and current_datetime.hour == hour_start and current_datetime.minute == minute_start:
-            mailing.start_time = mailing.start_time + timedelta(weeks=1)
-            is_mailing = True
-
-        elif mailing.frequency == 'monthly' and current_datetime >= mailing.start_time \
-                and current_datetime.day == mailing.start_time.day \
-                and current_datetime.hour == hour_start and current_datetime.minute == minute_start:
-            mailing.start_time = mailing.start_time + timedelta(days=30)
-            is_mailing = True
-
-        if is_mailing:
-            mailing.status = 'started'
-            mailing.save()
-            logger.info("Sending emails for mailing: %s", mailing)
-            for message in messages:
-                try:
-                    send_mail(
-                        subject=message.subject,
-                        message=message.body,
-                        from_email=settings.EMAIL_HOST_USER,
-                        recipient_list=emails
-                    )
-                    logger.info("Email sent successfully to: %s", emails)
-                except Exception as e:
-                    attempt_status = 'error'
-                    server_response = str(e)
-                    logger.error("Failed to send email: %s", server_response)
-                finally:
-                    Log.objects.create(
-                        message=message,
-                        status=attempt_status,
-                        response=server_response
-                    )
-
-            mailing.status = 'completed'
-            mailing.save()
+def send_deliveries(pool, deliveries, log_writer, throttle=None):
+    """
+    Отправляет захваченную пачку outbox, по отдельному письму на строку, передает результат
+    по каждому адресу в log_writer и отмечает строки. Строки, на которые не хватило лимита
+    скорости, возвращаются в outbox. Возвращает (отправлено, ошибок, отложено).
+    """
+    emails = [build_email(delivery) for delivery in deliveries]
+    try:
+        results = pool.send_batch(emails, throttle)
+    except (smtplib.SMTPException, OSError) as e:
+        # Сервер недоступен или отверг вход - вся пачка получает эту ошибку и уходит на повтор.
+        logger.error("Failed to open SMTP connection: %s", e)
+        results = [(email, e) for email in emails]
+    errors = [error for email, error in results]
+    attempted, deferred = deliveries[:len(errors)], deliveries[len(errors):]
+    sent = failed = 0
+    for delivery, error in zip(attempted, errors):
+        if error is None:
+            sent += 1
+        else:
+            failed += 1
+            logger.error("Failed to send email to %s: %s", delivery.recipient, error)
+        log_writer.add(delivery.message, delivery.client_id, delivery.recipient, error)
+    complete(attempted, errors)
+    release(deferred)
+    logger.info("Sent %s emails, %s failed", sent, failed)
+    return sent, failed, len(deferred)
@@ -0,0 +1,67 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from blog.models import BlogPost
+from mailing import stats, viewcache
+from mailing.models import Client, Mailing, Message
+
+
+@receiver(post_save, sender=Mailing)
+def mailing_saved(sender, instance, created, **kwargs):
+    is_active = instance.status in stats.ACTIVE_MAILING_STATUSES
+    if created:
+        stats.adjust_counter('count_mailing', 1)
+        stats.adjust_counter('active_mailings_count', int(is_active))
+    elif hasattr(instance, '_loaded_status'):
+        was_active = instance._loaded_status in stats.ACTIVE_MAILING_STATUSES
+        stats.adjust_counter('active_mailings_count', is_active - was_active)
+    else:
+        stats.invalidate_counters()
+    instance._loaded_status = instance.status
+
+
+@receiver(post_delete, sender=Mailing)
+def mailing_deleted(sender, instance, **kwargs):
+    stats.adjust_counter('count_mailing', -1)
+    stats.adjust_counter('active_mailings_count', -int(instance.status in stats.ACTIVE_MAILING_STATUSES))
+
+
+@receiver(post_save, sender=Mailing)
+@receiver(post_delete, sender=Mailing)
+def mailing_changed(sender, instance, **kwargs):
+    viewcache.bump('mailing', 'mailing:%s' % instance.pk)
+
+
+@receiver(post_save, sender=Message)
+@receiver(post_delete, sender=Message)
+def message_changed(sender, instance, **kwargs):
+    viewcache.bump('mailing', 'mailing:%s' % instance.mailing_id)
+
+
+@receiver(post_save, sender=Client)
+def client_saved(sender, instance, created, **kwargs):
+    if created:
+        stats.adjust_counter('unique_clients_count', int(instance.is_active))
+    elif hasattr(instance, '_loaded_is_active'):
+        stats.adjust_counter('unique_clients_count', instance.is_active - instance._loaded_is_active)
+    else:
+        stats.invalidate_counters()
+    instance._loaded_is_active = instance.is_active
+
+
+@receiver(post_delete, sender=Client)
+def client_deleted(sender, instance, **kwargs):
+    stats.adjust_counter('unique_clients_count', -int(instance.is_active))
+
+
+@receiver(post_save, sender=Client)
+@receiver(post_delete, sender=Client)
+def client_changed(sender, instance, **kwargs):
+    viewcache.bump('client')
+
+
+@receiver(post_save, sender=BlogPost)
+@receiver(post_delete, sender=BlogPost)
+def blog_post_changed(sender, instance, **kwargs):
+    if kwargs.get('created', True):
+        stats.invalidate_blog_post_pool()
@@ -0,0 +1,150 @@
+import asyncio
+import threading
+import time
+
+
+class SMTPSink:
+    """
+    Локальный SMTP-сервер на asyncio, который принимает письма и только считает их.
+    Нужен для проверки движков доставки и нагрузочных замеров без реального почтового сервера.
+    reject - словарь {адрес: код ответа} для получателей, которых сервер отклоняет на RCPT,
+    delay - искусственная задержка ответа на DATA в секундах, auth_failures - сколько первых
+    попыток входа отклонить временной ошибкой 454.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, reject=None, delay=0, auth_failures=0):
+        self.host = host
+        self.port = port
+        self.reject = dict(reject or {})
+        self.delay = delay
+        self.auth_failures = auth_failures
+        self.server = None
+        self.loop = None
+        self.thread = None
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.connections = 0
+        self.messages = 0
+        self.recipients = 0
+        self.rejected = 0
+        self.first_at = None
+        self.last_at = None
+
+    def stats(self):
+        elapsed = (self.last_at - self.first_at) if self.first_at is not None else 0.0
+        return {
+            'connections': self.connections,
+            'messages': self.messages,
+            'recipients': self.recipients,
+            'rejected': self.rejected,
+            'elapsed': elapsed,
+            'messages_per_second': self.messages / elapsed if elapsed else None,
+        }
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    def start_in_thread(self):
+        """Запускает сервер в отдельном потоке со своим циклом событий, для синхронного кода."""
+        started = threading.Event()
+
+        def run():
+            self.loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.loop)
+            self.loop.run_until_complete(self.start())
+            started.set()
+            self.loop.run_forever()
+            self.loop.run_until_complete(self.stop())
+            pending = asyncio.all_tasks(self.loop)
+            for task in pending:
+                task.cancel()
+            self.loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+            self.loop.close()
+
+        self.thread = threading.Thread(target=run, name='smtp_sink', daemon=True)
+        self.thread.start()
+        started.wait()
+        return self
+
+    def stop_thread(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+
+        async def reply(line):
+            writer.write(line.encode() + b'\r\n')
+            await writer.drain()
+
+        await reply('220 smtp_sink ESMTP')
+        mail_from, rcpt_to = None, []
+        try:
+            while line := await reader.readline():
+                command, _, argument = line.decode('latin-1').rstrip('\r\n').partition(' ')
+                command = command.upper()
+                if command == 'EHLO':
+                    await reply('250-smtp_sink\r\n250-PIPELINING\r\n250-8BITMIME\r\n250 AUTH PLAIN LOGIN')
+                elif command == 'HELO':
+                    await reply('250 smtp_sink')
+                elif command == 'AUTH':
+                    if self.auth_failures:
+                        self.auth_failures -= 1
+                        await reply('454 Temporary authentication failure')
+                        continue
+                    if argument.upper().startswith('LOGIN'):
+                        await reply('334 VXNlcm5hbWU6')
+                        await reader.readline()
+                        await reply('334 UGFzc3dvcmQ6')
+                        await reader.readline()
+                    await reply('235 Authentication succeeded')
+                elif command == 'MAIL':
+                    mail_from, rcpt_to = argument, []
+                    await reply('250 OK')
+                elif command == 'RCPT':
+                    address = argument.partition(':')[2].strip().strip('<>')
+                    if address in self.reject:
+                        self.rejected += 1
+                        await reply('%s Mailbox unavailable' % self.reject[address])
+                    else:
+                        rcpt_to.append(address)
+                        await reply('250 OK')
+                elif command == 'DATA':
+                    if mail_from is None or not rcpt_to:
+                        await reply('554 No valid recipients')
+                        continue
+                    await reply('354 End data with <CR><LF>.<CR><LF>')
+                    while await reader.readline() not in (b'.\r\n', b'.\n', b''):
+                        pass
+                    if self.delay:
+                        await asyncio.sleep(self.delay)
+                    now = time.monotonic()
+                    if self.first_at is None:
+                        self.first_at = now
+                    self.last_at = now
+                    self.messages += 1
+                    self.recipients += len(rcpt_to)
+                    mail_from, rcpt_to = None, []
+                    await reply('250 OK queued')
+                elif command == 'RSET':
+                    mail_from, rcpt_to = None, []
+                    await reply('250 OK')
+                elif command == 'NOOP':
+                    await reply('250 OK')
+                elif command == 'QUIT':
+                    await reply('221 Bye')
+                    break
+                else:
+                    await reply('502 Command not implemented')
+        except (ConnectionError, asyncio.CancelledError):
+            # Сервер останавливается или клиент оборвал соединение - сессию просто закрываем.
+            pass
+        finally:
+            writer.close()
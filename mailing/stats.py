@@ -0,0 +1,78 @@
+import logging
+import random
+
+from django.conf import settings
+from django.core.cache import cache
+
+from blog.models import BlogPost
+from mailing.models import Client, Mailing
+
+logger = logging.getLogger(__name__)
+
+# Счетчики главной страницы в кэше. Сигналы моделей сдвигают их через cache.incr, а
+# reconcile_counters периодически пересчитывает по БД: массовые UPDATE и bulk_create
+# сигналов не шлют, а без Redis у каждого процесса свой кэш. TTL ограничивает расхождение,
+# если пересчет не запущен.
+COUNTER_KEY = 'stats:%s'
+ACTIVE_MAILING_STATUSES = ('created', 'started')
+BLOG_POST_POOL_KEY = 'stats:blog_post_ids'
+COUNTERS = ('count_mailing', 'active_mailings_count', 'unique_clients_count')
+
+
+def count_counters():
+    return {
+        'count_mailing': Mailing.objects.count(),
+        'active_mailings_count': Mailing.objects.filter(status__in=ACTIVE_MAILING_STATUSES).count(),
+        'unique_clients_count': Client.objects.filter(is_active=True).count(),
+    }
+
+
+def reconcile_counters():
+    """Пересчитывает счетчики по БД и кладет в кэш; вызывается заданием диспетчера и при промахе кэша."""
+    counters = count_counters()
+    cache.set_many({COUNTER_KEY % name: value for name, value in counters.items()}, settings.MAILING_STATS_TTL)
+    return counters
+
+
+def get_counters():
+    """Счетчики главной страницы: из кэша без запросов к БД, при промахе - пересчетом."""
+    cached = cache.get_many([COUNTER_KEY % name for name in COUNTERS])
+    if len(cached) < len(COUNTERS):
+        return reconcile_counters()
+    return {name: cached[COUNTER_KEY % name] for name in COUNTERS}
+
+
+def adjust_counter(name, delta):
+    if not delta:
+        return
+    try:
+        cache.incr(COUNTER_KEY % name, delta)
+    except ValueError:
+        # Счетчика нет в кэше - его посчитает по БД следующий get_counters.
+        pass
+
+
+def invalidate_counters():
+    """Сбрасывает счетчики после массовых изменений, которые идут мимо сигналов."""
+    cache.delete_many([COUNTER_KEY % name for name in COUNTERS])
+
+
+def blog_post_pool():
+    pool = cache.get(BLOG_POST_POOL_KEY)
+    if pool is None:
+        pool = list(BlogPost.objects.values_list('pk', flat=True))
+        cache.set(BLOG_POST_POOL_KEY, pool, settings.MAILING_STATS_TTL)
+    return pool
+
+
+def invalidate_blog_post_pool():
+    cache.delete(BLOG_POST_POOL_KEY)
+
+
+def random_blog_posts(count=3):
+    """count случайных записей блога одним запросом по id из закэшированного пула."""
+    pool = blog_post_pool()
+    ids = random.sample(pool, min(count, len(pool)))
+    posts = list(BlogPost.objects.filter(pk__in=ids).select_related('owner'))
+    random.shuffle(posts)
+    return posts
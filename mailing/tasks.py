@@ -0,0 +1,44 @@
+import logging
+
+from celery import shared_task
+from celery.signals import worker_process_shutdown
+
+from mailing import metrics
+from mailing.connections import SMTPConnectionPool
+from mailing.logs import LogWriter
+from mailing.outbox import claim_batch
+from mailing.services import get_throttle, send_deliveries
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+
+
+def get_pool():
+    """SMTP-соединение живет весь срок жизни процесса воркера и переиспользуется между задачами."""
+    global _pool
+    if _pool is None:
+        _pool = SMTPConnectionPool(size=1)
+    return _pool
+
+
+@worker_process_shutdown.connect
+def close_pool(**kwargs):
+    if _pool is not None:
+        _pool.close()
+    metrics.mark_process_dead()
+
+
+@shared_task(ignore_result=True)
+def deliver_outbox_batch(retry=False):
+    """
+    Захватывает одну пачку outbox (при retry - из строк на повтор) и доставляет ее. Задачи не
+    несут данных о получателях: какую пачку обработать, решает аренда в БД, поэтому повтор
+    задачи не дублирует письма.
+    """
+    deliveries = claim_batch(retry=retry)
+    if not deliveries:
+        return
+    with LogWriter() as log_writer:
+        sent, failed, deferred = send_deliveries(get_pool(), deliveries, log_writer, get_throttle())
+    logger.info("Delivered outbox batch: %s sent, %s failed, %s deferred", sent, failed, deferred)
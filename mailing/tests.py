@@ -1,3 +1,846 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import json
+import smtplib
+import tempfile
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import Permission
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.mail import EmailMessage
+from django.core.mail.backends.base import BaseEmailBackend
+from django.http import Http404
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from blog.models import BlogPost
+
+from mailing import logs, metrics, partitions, tasks, viewcache
+from mailing.aiosmtp import AsyncSMTPClient
+from mailing.benchmark import ensure_isolated, run_benchmark, sink_email_settings
+from mailing.checks import check_throttle_cache
+from mailing.connections import SMTPConnectionPool
+from mailing.exports import CLIENT_FIELDS, client_export_queryset, export_rows
+from mailing.imports import import_clients, read_csv, read_uploaded_csv
+from mailing.logs import LogWriter
+from mailing.models import Client, Delivery, Log, LogRollup, Mailing, Message, Segment, SMTPReply, Tag
+from mailing.pagination import KeysetPaginator
+from mailing.outbox import claim_batch, enqueue_runs, iter_recipients, purge_finished, release
+from mailing.retention import archive_old_logs, rollup
+from mailing.segments import decode_ids, encode_ids, iter_snapshot_recipients, snapshot_for
+from mailing.services import dispatch_celery, get_due_mailings, send_mailings
+from mailing.smtp_sink import SMTPSink
+from mailing.throttle import TokenBucket
+from mailing.views import ExportView
+from users.models import User
+
+LOCMEM_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests'}}
+
+
+def create_mailing(owner, **kwargs):
+    kwargs.setdefault('start_time', timezone.now() - timedelta(days=1))
+    kwargs.setdefault('frequency', 'daily')
+    kwargs.setdefault('status', 'started')
+    return Mailing.objects.create(owner=owner, **kwargs)
+
+
+def create_due_mailing(owner, emails):
+    """Наступившая рассылка с одним сообщением для клиентов с адресами emails."""
+    mailing = create_mailing(owner)
+    Mailing.objects.filter(pk=mailing.pk).update(next_run_at=timezone.now())
+    mailing.recipients.set([Client.objects.create(email=email, full_name=email, owner=owner) for email in emails])
+    mailing.message_set.create(subject='Subject', body='Body', owner=owner)
+    return mailing
+
+
+@override_settings(CACHES=LOCMEM_CACHE, CACHE_ENABLED=True)
+class CachedContentTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(email='manager@test.local', is_superuser=True)
+        self.client.force_login(self.user)
+
+    def test_objects_with_equal_versions_do_not_share_cache(self):
+        first = create_mailing(self.user)
+        second = create_mailing(self.user)
+        for mailing in (first, second):
+            cache.set(viewcache.VERSION_KEY % ('mailing:%s' % mailing.pk), 1000, None)
+
+        self.client.get(reverse('mailing:mailing_detail', args=[first.pk]))
+        response = self.client.get(reverse('mailing:mailing_detail', args=[second.pk]))
+
+        self.assertContains(response, 'Mailing ID: %s' % second.pk)
+        self.assertNotContains(response, 'Mailing ID: %s' % first.pk)
+
+    def test_cached_page_is_reset_by_message_change(self):
+        mailing = create_mailing(self.user)
+        url = reverse('mailing:mailing_detail', args=[mailing.pk])
+        self.client.get(url)
+        message = mailing.message_set.create(subject='Subject', body='Body', owner=self.user)
+
+        self.assertContains(self.client.get(url), 'Message ID: %s' % message.pk)
+
+    def test_client_change_bumps_its_version(self):
+        before = viewcache.get_versions(['client'])
+        client = Client.objects.create(email='client@test.local', full_name='Client', owner=self.user)
+        after_create = viewcache.get_versions(['client'])
+        client.delete()
+
+        self.assertNotEqual(before, after_create)
+        self.assertNotEqual(after_create, viewcache.get_versions(['client']))
+
+    def test_log_flushes_bump_report_once_per_interval(self):
+        # Id ответов SMTP кэшируются в процессе, а строки откатываются после теста.
+        self.addCleanup(logs._reply_ids.clear)
+        message = create_mailing(self.user).message_set.create(subject='Subject', body='Body')
+        versions = [viewcache.get_versions(['log'])]
+        with override_settings(MAILING_VIEW_CACHE_LOG_INTERVAL=60):
+            for i in range(2):
+                with LogWriter() as log_writer:
+                    log_writer.add(message, None, 'client-%s@test.local' % i)
+                versions.append(viewcache.get_versions(['log']))
+        # Вторая запись попала в интервал: ее применяет тик диспетчера.
+        viewcache.bump_pending('log')
+        versions.append(viewcache.get_versions(['log']))
+        viewcache.bump_pending('log')
+        versions.append(viewcache.get_versions(['log']))
+
+        self.assertNotEqual(versions[0], versions[1])
+        self.assertEqual(versions[1], versions[2])
+        self.assertNotEqual(versions[2], versions[3])
+        self.assertEqual(versions[3], versions[4])
+
+    def test_report_owner_filter_finds_user_created_later(self):
+        url = reverse('mailing:delivery_report') + '?owner=late@test.local'
+        self.assertContains(self.client.get(url), 'Нет такого пользователя')
+        User.objects.create(email='late@test.local')
+
+        self.assertNotContains(self.client.get(url), 'Нет такого пользователя')
+
+
+class KeysetPaginatorTests(TestCase):
+
+    def setUp(self):
+        message = create_mailing(User.objects.create(email='owner@test.local')).message_set.create(
+            subject='Subject', body='Body'
+        )
+        reply = SMTPReply.objects.create(code=250, text='OK')
+        # Пять записей с одним временем и две с другими: страницы режут группу равных ключей.
+        stamps = [utc(2026, 1, 2)] + [utc(2026, 1, 1)] * 5 + [utc(2025, 12, 31)]
+        for stamp in stamps:
+            log = Log.objects.create(message=message, recipient='client@test.local', status=Log.SUCCESS, reply=reply)
+            Log.objects.filter(pk=log.pk).update(timestamp=stamp)
+        self.expected = list(Log.objects.order_by('-timestamp', '-pk').values_list('pk', flat=True))
+        self.paginator = KeysetPaginator(Log.objects.all(), 2)
+
+    def pks(self, page):
+        return [log.pk for log in page]
+
+    def test_forward_and_backward_walks_cover_every_row_once(self):
+        pages = [self.paginator.page()]
+        self.assertFalse(pages[0].has_previous())
+        while pages[-1].has_next():
+            pages.append(self.paginator.page(after=pages[-1].next_cursor))
+        self.assertEqual([pk for page in pages for pk in self.pks(page)], self.expected)
+        self.assertEqual([len(page) for page in pages], [2, 2, 2, 1])
+
+        backwards = [pages[-1]]
+        while backwards[-1].has_previous():
+            backwards.append(self.paginator.page(before=backwards[-1].previous_cursor))
+        self.assertEqual([self.pks(page) for page in reversed(backwards)], [self.pks(page) for page in pages])
+
+    def test_page_after_last_row_is_empty(self):
+        last = Log.objects.get(pk=self.expected[-1])
+        page = self.paginator.page(after=self.paginator.cursor_for(last))
+        self.assertEqual((list(page), page.has_next(), page.has_previous()), ([], False, False))
+
+    def test_broken_cursor_is_not_found(self):
+        with self.assertRaises(Http404):
+            self.paginator.page(after='not-a-cursor')
+
+
+class MailingReactivationTests(TestCase):
+
+    def test_next_run_recomputed_from_now(self):
+        now = timezone.now()
+        mailing = create_mailing(None, start_time=now - timedelta(days=30), end_time=now + timedelta(days=30))
+        mailing.status = 'stopped'
+        mailing.save()
+        # Пауза длилась дольше периода: сохраненный запуск давно прошел.
+        Mailing.objects.filter(pk=mailing.pk).update(next_run_at=now - timedelta(days=10))
+
+        mailing = Mailing.objects.get(pk=mailing.pk)
+        mailing.save()
+        self.assertLess(mailing.next_run_at, now)
+        mailing.status = 'started'
+        mailing.save()
+        mailing.refresh_from_db()
+        self.assertGreaterEqual(mailing.next_run_at, now)
+        self.assertLessEqual(mailing.next_run_at, now + timedelta(days=1))
+
+
+class ExportTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(email='owner@test.local')
+        self.other = User.objects.create(email='other@test.local')
+        for number in range(5):
+            Client.objects.create(email='c%d@test.local' % number, full_name='Клиент, %d' % number, owner=self.user)
+        Client.objects.create(email='foreign@test.local', full_name='Чужой', owner=self.other)
+
+    def test_csv_is_streamed_in_chunks(self):
+        chunks = list(export_rows(*client_export_queryset(), 'csv', chunk_size=2))
+        # Заголовок и 6 строк - по 2 строки в куске.
+        self.assertEqual(len(chunks), 4)
+        rows = list(csv.reader(''.join(chunks).splitlines()))
+        self.assertEqual(rows[0], [header for header, lookup in CLIENT_FIELDS])
+        self.assertEqual(len(rows), 7)
+        self.assertEqual(rows[1][1:4], ['c0@test.local', 'Клиент, 0', ''])
+        self.assertEqual(rows[1][5], 'owner@test.local')
+
+    def test_ndjson_has_one_object_per_row(self):
+        content = ''.join(export_rows(*client_export_queryset(), 'ndjson', chunk_size=4))
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(rows[-1]['email'], 'foreign@test.local')
+        self.assertIs(rows[-1]['is_active'], True)
+
+    def test_view_streams_only_own_clients(self):
+        user = User.objects.create(email='manager@test.local')
+        user.user_permissions.add(*Permission.objects.filter(codename='view_client'))
+        Client.objects.filter(owner=self.user).update(owner=user)
+        self.client.force_login(user)
+        response = self.client.get(reverse('mailing:export_clients'))
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="clients.csv"')
+        rows = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(len(rows), 6)
+        self.assertNotIn('foreign@test.local', [row[1] for row in rows])
+        self.assertEqual(self.client.get(reverse('mailing:export_clients'), {'format': 'xml'}).status_code, 400)
+
+    def test_export_view_requires_get_export(self):
+        with self.assertRaisesMessage(ImproperlyConfigured, 'ExportView must define get_export()'):
+            ExportView().get_export()
+
+
+class ImportClientsTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(email='owner@test.local')
+        self.other = User.objects.create(email='other@test.local')
+        Client.objects.create(email='known@test.local', full_name='Старое имя', owner=self.user)
+        Client.objects.create(email='foreign@test.local', full_name='Чужой', owner=self.other)
+
+    def import_lines(self, *lines, **kwargs):
+        return import_clients(read_csv(['email,full_name,is_active'] + list(lines)), owner=self.user, **kwargs)
+
+    def test_counts_and_rejected_rows(self):
+        result = self.import_lines(
+            'new@test.local,Новый,1',
+            'known@Test.Local,Новое имя,нет',
+            'not-an-email,Без адреса,1',
+            'noname@test.local,,1',
+            'flag@test.local,Флаг,maybe',
+            'foreign@test.local,Захват,1',
+        )
+        self.assertEqual((result.inserted, result.updated, result.rejected), (1, 1, 4))
+        self.assertEqual([line for line, reason in result.errors], [4, 5, 6, 7])
+        self.assertEqual(result.errors[1], (5, 'Не указано имя'))
+        known = Client.objects.get(email='known@test.local')
+        self.assertEqual((known.full_name, known.is_active, known.owner), ('Новое имя', False, self.user))
+        foreign = Client.objects.get(email='foreign@test.local')
+        self.assertEqual((foreign.full_name, foreign.owner), ('Чужой', self.other))
+        self.assertEqual(Client.objects.get(email='new@test.local').owner, self.user)
+
+    def test_duplicate_emails_in_one_file(self):
+        lines = ['dup@test.local,Первый,1', 'other@test.local,Другой,1', 'dup@test.local,Последний,0']
+        # В одной пачке повтор схлопывается, побеждает последняя строка.
+        result = self.import_lines(*lines)
+        self.assertEqual((result.inserted, result.updated, result.rejected), (2, 0, 0))
+        self.assertEqual(Client.objects.get(email='dup@test.local').full_name, 'Последний')
+        # В разных пачках повтор обновляет клиента, вставленного предыдущей пачкой.
+        Client.objects.filter(email__in=['dup@test.local', 'other@test.local']).delete()
+        result = self.import_lines(*lines, batch_size=2)
+        self.assertEqual((result.inserted, result.updated, result.rejected), (2, 1, 0))
+        self.assertEqual(Client.objects.get(email='dup@test.local').full_name, 'Последний')
+
+    def test_uploaded_file_with_bom(self):
+        uploaded = SimpleUploadedFile('clients.csv', '\ufeffEmail,Full_Name\nbom@test.local,С BOM\n'.encode())
+        result = import_clients(read_uploaded_csv(uploaded), owner=self.user)
+        self.assertEqual(result.inserted, 1)
+        with self.assertRaisesMessage(ValueError, 'В файле нет колонки email'):
+            list(read_csv(['name,full_name', 'x,y']))
+
+
+class SegmentTests(TestCase):
+
+    def test_ids_round_trip(self):
+        self.assertEqual(encode_ids([]), encode_ids([[]]))
+        self.assertEqual(list(decode_ids(encode_ids([]))), [])
+        chunks = [[1, 2, 2, 3], [300, 300], [2 ** 40]]
+        # Маленький блок распаковки режет varint на границах блоков.
+        with mock.patch('mailing.segments.DECODE_BLOCK_SIZE', 3):
+            self.assertEqual(list(decode_ids(encode_ids(chunks))), [1, 2, 2, 3, 300, 300, 2 ** 40])
+
+    def test_unsorted_ids_rejected(self):
+        with self.assertRaisesMessage(ValueError, 'ids must be ascending: 2 after 5'):
+            encode_ids([[1, 5], [2]])
+        self.assertEqual(list(decode_ids(encode_ids([sorted([5, 1, 3])]))), [1, 3, 5])
+
+    def test_snapshot_resolves_segment_clients(self):
+        owner = User.objects.create(email='owner@test.local')
+        tag, other_tag = Tag.objects.create(name='vip', owner=owner), Tag.objects.create(name='other', owner=owner)
+        clients = [
+            Client.objects.create(email='c%d@test.local' % i, full_name='c%d' % i, owner=owner) for i in range(5)
+        ]
+        for client in clients[:3]:
+            client.tags.add(tag, other_tag)
+        clients[3].tags.add(other_tag)
+        Client.objects.filter(pk=clients[2].pk).update(is_active=False)
+        stranger = User.objects.create(email='stranger@test.local')
+        foreign = Client.objects.create(email='foreign@test.local', full_name='f', owner=stranger)
+        foreign.tags.add(tag)
+        segment = Segment.objects.create(name='VIP', owner=owner)
+        segment.tags.add(tag)
+
+        now = timezone.now()
+        snapshot = snapshot_for(segment, now)
+        self.assertEqual(snapshot.size, 2)
+        self.assertEqual(list(decode_ids(bytes(snapshot.client_ids))), [clients[0].pk, clients[1].pk])
+        self.assertEqual(snapshot_for(segment, now), snapshot)
+        # Клиент, отключенный после снимка, из получателей выпадает.
+        Client.objects.filter(pk=clients[1].pk).update(is_active=False)
+        self.assertEqual(list(iter_snapshot_recipients(snapshot, 1)), [(clients[0].pk, 'c0@test.local')])
+
+
+class BenchmarkIsolationTests(TestCase):
+
+    def setUp(self):
+        self.bench = create_due_mailing(User.objects.create(email='bench-user0@bench.local'), ['c@bench.local'])
+
+    def test_refuses_with_foreign_due_mailing(self):
+        ensure_isolated('bench')
+        foreign = create_due_mailing(User.objects.create(email='real@test.local'), ['real@test.local'])
+        next_run_at = Mailing.objects.get(pk=foreign.pk).next_run_at
+        with self.assertRaisesMessage(ValueError, '1 due mailings and 0 outbox rows'):
+            run_benchmark(['sync'], 1, 'bench')
+        self.assertEqual(Mailing.objects.get(pk=foreign.pk).next_run_at, next_run_at)
+        self.assertFalse(Delivery.objects.exists())
+
+    def test_refuses_with_foreign_outbox_rows(self):
+        foreign = create_due_mailing(User.objects.create(email='real@test.local'), ['real@test.local'])
+        enqueue_runs(list(get_due_mailings(timezone.now()).filter(pk=foreign.pk)), timezone.now())
+        with self.assertRaisesMessage(ValueError, '0 due mailings and 1 outbox rows'):
+            ensure_isolated('bench')
+
+
+class OutboxReleaseTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(email='owner@test.local')
+        message = create_mailing(self.user).message_set.create(subject='Subject', body='Body')
+        self.delivery = Delivery.objects.create(message=message, recipient='client@test.local')
+
+    def test_released_first_attempt_returns_to_pending(self):
+        release(claim_batch())
+        self.delivery.refresh_from_db()
+        self.assertEqual((self.delivery.status, self.delivery.attempts), ('pending', 0))
+
+    def test_released_reclaimed_row_can_be_retried(self):
+        claim_batch()
+        # Аренда истекла, строку захватывает другой узел и откладывает ее из-за ограничения скорости.
+        Delivery.objects.update(lease_until=timezone.now() - timedelta(seconds=1))
+        release(claim_batch())
+        self.delivery.refresh_from_db()
+        self.assertEqual(self.delivery.status, 'retry')
+        self.assertIsNotNone(self.delivery.next_attempt_at)
+        self.assertEqual([delivery.pk for delivery in claim_batch(retry=True)], [self.delivery.pk])
+
+
+class OutboxPurgeTests(TestCase):
+
+    def test_only_old_finished_rows_are_purged(self):
+        message = create_mailing(User.objects.create(email='owner@test.local')).message_set.create(
+            subject='Subject', body='Body'
+        )
+        for status in ('pending', 'sending', 'retry', 'sent', 'failed', 'sent'):
+            Delivery.objects.create(message=message, recipient='%s@test.local' % status, status=status)
+        now = timezone.now()
+        Delivery.objects.update(created_at=now - timedelta(days=8))
+        fresh = Delivery.objects.create(message=message, recipient='fresh@test.local', status='sent')
+
+        self.assertEqual(purge_finished(now - timedelta(days=7), chunk_size=1), 3)
+        self.assertCountEqual(
+            Delivery.objects.values_list('status', flat=True), ['pending', 'sending', 'retry', fresh.status]
+        )
+
+
+class EnqueueRunsTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(email='owner@test.local')
+
+    def test_runs_taken_by_another_node_are_skipped(self):
+        first = create_due_mailing(self.user, ['first@test.local'])
+        second = create_due_mailing(self.user, ['second@test.local'])
+        due = list(Mailing.objects.filter(pk__in=[first.pk, second.pk]).order_by('pk'))
+        # Другой узел успел захватить запуск второй рассылки.
+        Mailing.objects.filter(pk=second.pk).update(next_run_at=timezone.now() + timedelta(days=1))
+
+        queued = enqueue_runs(due, timezone.now())
+
+        self.assertEqual(queued, {first.pk: 1})
+        self.assertEqual(list(Delivery.objects.values_list('recipient', flat=True)), ['first@test.local'])
+
+
+class IterRecipientsTests(TestCase):
+
+    def test_chunks_cover_every_active_recipient_once(self):
+        user = User.objects.create(email='owner@test.local')
+        mailings = [create_due_mailing(user, ['m%s-%s@test.local' % (m, i) for i in range(size)])
+                    for m, size in enumerate((5, 1, 0, 4))]
+        Client.objects.filter(email='m0-2@test.local').update(is_active=False)
+        expected = sorted(Mailing.recipients.through.objects.filter(client__is_active=True)
+                          .values_list('mailing_id', 'client_id', 'client__email'))
+
+        for chunk_size in (1, 2, 3, 100):
+            with self.subTest(chunk_size=chunk_size), CaptureQueriesContext(connection) as queries:
+                self.assertEqual(list(iter_recipients(mailings, chunk_size)), expected)
+            # Каждый запрос - диапазон индекса, без OR по ключу.
+            self.assertFalse([query for query in queries if ' OR ' in query['sql']])
+            self.assertLessEqual(len(queries), 2 * (len(expected) // chunk_size + 1))
+
+
+class FlakyBackend(BaseEmailBackend):
+    """Бэкенд, который рвет соединение на третьем письме и больше не открывается."""
+    sent = []
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.connection = None
+        self.opened = 0
+
+    def open(self):
+        if self.opened:
+            raise ConnectionRefusedError('connection refused')
+        self.opened += 1
+        self.connection = object()
+
+    def close(self):
+        self.connection = None
+
+    def send_messages(self, email_messages):
+        if len(self.sent) == 2:
+            raise smtplib.SMTPServerDisconnected('connection lost')
+        self.sent.extend(email_messages)
+        return len(email_messages)
+
+
+class TimeoutBackend(FlakyBackend):
+    """Бэкенд, который отказывает адресу refused@ и зависает на адресе stuck@."""
+
+    opens = 0
+
+    def open(self):
+        TimeoutBackend.opens += 1
+        self.connection = object()
+
+    def send_messages(self, email_messages):
+        recipient = email_messages[0].to[0]
+        if recipient.startswith('refused@'):
+            raise smtplib.SMTPRecipientsRefused({recipient: (550, b'No such user')})
+        if recipient.startswith('stuck@'):
+            raise TimeoutError('timed out')
+        self.sent.extend(email_messages)
+        return len(email_messages)
+
+
+class ConnectionPoolTests(TestCase):
+
+    def test_failed_reconnect_keeps_sent_results(self):
+        FlakyBackend.sent = []
+        emails = [EmailMessage(to=['client-%s@test.local' % i]) for i in range(4)]
+        with SMTPConnectionPool(size=1, backend='mailing.tests.FlakyBackend') as pool:
+            results = pool.send_batch(emails)
+
+        self.assertEqual([email for email, error in results], emails)
+        self.assertEqual([error for email, error in results[:2]], [None, None])
+        self.assertIsInstance(results[2][1], smtplib.SMTPServerDisconnected)
+        self.assertIsInstance(results[3][1], ConnectionRefusedError)
+
+    def test_connection_reopened_after_unexpected_error(self):
+        TimeoutBackend.sent, TimeoutBackend.opens = [], 0
+        emails = [EmailMessage(to=[address]) for address in (
+            'ok@test.local', 'refused@test.local', 'stuck@test.local', 'after@test.local',
+        )]
+        with SMTPConnectionPool(size=1, backend='mailing.tests.TimeoutBackend') as pool:
+            results = pool.send_batch(emails)
+
+        errors = [error for email, error in results]
+        self.assertIsNone(errors[0])
+        self.assertIsInstance(errors[1], smtplib.SMTPRecipientsRefused)
+        self.assertIsInstance(errors[2], TimeoutError)
+        self.assertIsNone(errors[3])
+        # Отказ получателю соединение не трогает, таймаут - переоткрывает.
+        self.assertEqual(TimeoutBackend.opens, 2)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class ThrottleCacheCheckTests(SimpleTestCase):
+
+    @override_settings(MAILING_ACCOUNT_RATE=0, MAILING_ACCOUNT_DAILY_LIMIT=0, MAILING_DOMAIN_RATE=0)
+    def test_no_warning_without_throttle(self):
+        self.assertEqual(check_throttle_cache(None), [])
+
+    @override_settings(MAILING_ACCOUNT_RATE=5, CACHE_ENABLED=False)
+    def test_warns_without_shared_cache(self):
+        self.assertEqual([warning.id for warning in check_throttle_cache(None)], ['mailing.W001'])
+        with override_settings(CACHE_ENABLED=True, CACHES=LOCMEM_CACHE):
+            self.assertEqual([warning.id for warning in check_throttle_cache(None)], ['mailing.W001'])
+        redis_cache = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://'}}
+        with override_settings(CACHE_ENABLED=True, CACHES=redis_cache):
+            self.assertEqual(check_throttle_cache(None), [])
+
+
+class TokenBucketTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_busy_lock_is_not_taken_or_released(self):
+        bucket = TokenBucket('test', rate=10)
+        cache.add(bucket.lock_key, 'other', timeout=60)
+        self.assertIsNone(bucket.reserve(max_wait=1))
+        self.assertEqual(cache.get(bucket.lock_key), 'other')
+        self.assertIsNone(cache.get(bucket.key))
+
+    def test_reserve_releases_own_lock(self):
+        bucket = TokenBucket('test', rate=10)
+        self.assertEqual(bucket.reserve(max_wait=1), 0.0)
+        self.assertIsNone(cache.get(bucket.lock_key))
+
+
+class AsyncSMTPClientTests(SimpleTestCase):
+
+    def setUp(self):
+        self.sink = SMTPSink(auth_failures=1).start_in_thread()
+        self.addCleanup(self.sink.stop_thread)
+
+    def test_failed_login_closes_session(self):
+        async def scenario():
+            client = AsyncSMTPClient(self.sink.host, self.sink.port, username='user', password='secret', timeout=5)
+            with self.assertRaises(smtplib.SMTPAuthenticationError):
+                await client.connect()
+            self.assertFalse(client.is_connected)
+            await client.connect()
+            await client.sendmail('from@test.local', ['to@test.local'], b'Subject: Test\r\n\r\nBody')
+            await client.quit()
+
+        asyncio.run(scenario())
+        self.assertEqual(self.sink.stats()['messages'], 1)
+
+
+class AsyncEngineTests(TransactionTestCase):
+    # Движок ходит в БД через sync_to_async из другого потока, поэтому данные должны быть закоммичены.
+
+    def setUp(self):
+        self.sink = SMTPSink(reject={'rejected@test.local': 550}).start_in_thread()
+        self.addCleanup(self.sink.stop_thread)
+        self.user = User.objects.create(email='owner@test.local')
+
+    def test_tick_delivers_through_sink(self):
+        emails = ['first@test.local', 'second@test.local', 'rejected@test.local']
+        create_due_mailing(self.user, emails)
+        with override_settings(
+            CACHES=LOCMEM_CACHE, MAILING_DELIVERY_ENGINE='asyncio', MAILING_RETRY_BASE_DELAY=0,
+            **sink_email_settings(self.sink)
+        ):
+            result = send_mailings()
+
+        self.assertEqual((result.sent, result.failed), (2, 1))
+        self.assertEqual(self.sink.stats()['messages'], 2)
+        statuses = dict(Delivery.objects.values_list('recipient', 'status'))
+        self.assertEqual(statuses, {
+            'first@test.local': 'sent', 'second@test.local': 'sent', 'rejected@test.local': 'failed',
+        })
+
+
+@override_settings(CACHES=LOCMEM_CACHE, CELERY_TASK_ALWAYS_EAGER=True, MAILING_DELIVERY_ENGINE='celery')
+class CeleryEngineTests(TestCase):
+
+    def setUp(self):
+        self.sink = SMTPSink().start_in_thread()
+        self.addCleanup(self.sink.stop_thread)
+        self.addCleanup(self.close_worker_pool)
+        self.user = User.objects.create(email='owner@test.local')
+
+    @staticmethod
+    def close_worker_pool():
+        if tasks._pool is not None:
+            tasks._pool.close()
+            tasks._pool = None
+
+    def test_fan_out_sends_each_delivery_once(self):
+        emails = ['client-%s@test.local' % i for i in range(5)]
+        create_due_mailing(self.user, emails)
+        with override_settings(MAILING_SEND_CHUNK_SIZE=2, **sink_email_settings(self.sink)):
+            send_mailings()
+
+        self.assertEqual(self.sink.stats()['messages'], len(emails))
+        self.assertEqual(
+            sorted(Delivery.objects.values_list('recipient', 'status', 'attempts')),
+            [(email, 'sent', 1) for email in emails]
+        )
+        self.assertEqual(sorted(Log.objects.values_list('recipient', flat=True)), emails)
+
+    def test_backlog_is_not_enqueued_again(self):
+        create_due_mailing(self.user, ['client-%s@test.local' % i for i in range(5)])
+        with override_settings(MAILING_SEND_CHUNK_SIZE=2), \
+                mock.patch.object(tasks.deliver_outbox_batch, 'delay') as delay:
+            send_mailings()
+            self.assertEqual(delay.call_count, 3)
+            # Воркеры еще не взяли задачи: следующий тик ничего не добавляет.
+            dispatch_celery()
+            self.assertEqual(delay.call_count, 3)
+            # Задачи потерялись: после истечения отметки строки ставятся снова.
+            Delivery.objects.update(enqueued_until=timezone.now() - timedelta(seconds=1))
+            dispatch_celery()
+            self.assertEqual(delay.call_count, 6)
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=dt_timezone.utc)
+
+
+class RecurrenceTests(TestCase):
+
+    def runs(self, count, **kwargs):
+        kwargs.setdefault('time_zone', 'UTC')
+        mailing = Mailing(**kwargs)
+        return mailing.recurrence.upcoming(mailing.start_time, count)
+
+    def test_monthly_from_31st_clamps_to_month_end(self):
+        runs = self.runs(5, start_time=utc(2024, 1, 31, 9), frequency='monthly')
+        self.assertEqual([run.date() for run in runs], [
+            date(2024, 1, 31), date(2024, 2, 29), date(2024, 3, 31), date(2024, 4, 30), date(2024, 5, 31),
+        ])
+
+    def test_cron_monthday_or_weekday(self):
+        # Как в cron: 13-е число ИЛИ пятница, а не только пятница 13-е.
+        runs = self.runs(8, start_time=utc(2023, 10, 1), frequency='custom', schedule='0 9 13 * fri')
+        self.assertEqual([run.date() for run in runs], [
+            date(2023, 10, 6), date(2023, 10, 13), date(2023, 10, 20), date(2023, 10, 27),
+            date(2023, 11, 3), date(2023, 11, 10), date(2023, 11, 13), date(2023, 11, 17),
+        ])
+        self.assertEqual({run.hour for run in runs}, {9})
+
+    def test_local_time_kept_across_dst(self):
+        spring = self.runs(3, start_time=utc(2023, 3, 25, 8), frequency='daily', time_zone='Europe/Berlin')
+        self.assertEqual(spring, [utc(2023, 3, 25, 8), utc(2023, 3, 26, 7), utc(2023, 3, 27, 7)])
+        autumn = self.runs(
+            3, start_time=utc(2023, 10, 28, 7), frequency='custom', schedule='0 9 * * *', time_zone='Europe/Berlin'
+        )
+        self.assertEqual(autumn, [utc(2023, 10, 28, 7), utc(2023, 10, 29, 8), utc(2023, 10, 30, 8)])
+
+    def test_count_exhaustion_completes_mailing(self):
+        start = (timezone.now() - timedelta(hours=1)).replace(microsecond=0)
+        mailing = create_mailing(None, start_time=start, frequency='custom', schedule='FREQ=DAILY;COUNT=2')
+        self.assertEqual(mailing.next_run_at, start + timedelta(days=1))
+        mailing.advance_schedule(mailing.next_run_at)
+        mailing.save()
+        mailing.refresh_from_db()
+        self.assertEqual(mailing.status, 'completed')
+        self.assertIsNone(mailing.next_run_at)
+
+
+class MetricsViewTests(TestCase):
+
+    def setUp(self):
+        self.url = reverse('metrics')
+
+    def test_anonymous_request_is_forbidden_without_token(self):
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+        self.client.force_login(User.objects.create(email='user@test.local'))
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    def test_staff_gets_prometheus_text(self):
+        metrics.record_delivery(250, None)
+        self.client.force_login(User.objects.create(email='staff@test.local', is_staff=True))
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        self.assertContains(response, 'mailing_deliveries_total{code="250",status="success"}')
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_token_authorizes_scraper(self):
+        self.assertEqual(self.client.get(self.url, HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+        self.assertEqual(self.client.get(self.url, HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+
+
+class PartitionTests(SimpleTestCase):
+
+    def test_missing_months_skip_covered_ones(self):
+        existing = [
+            ('mailing_log', None, utc(2026, 2, 1)),
+            ('mailing_log_y2026m03', utc(2026, 3, 1), utc(2026, 4, 1)),
+        ]
+        self.assertEqual(
+            partitions.missing_months(utc(2026, 1, 20, 15), 3, existing), [utc(2026, 2, 1), utc(2026, 4, 1)]
+        )
+
+    def test_months_cross_year(self):
+        self.assertEqual(partitions.missing_months(utc(2026, 12, 31), 1, []), [utc(2026, 12, 1), utc(2027, 1, 1)])
+        self.assertEqual(partitions.partition_name(utc(2027, 1, 1)), 'mailing_log_y2027m01')
+
+
+class RetentionTests(TestCase):
+
+    def setUp(self):
+        user = User.objects.create(email='owner@test.local')
+        self.message = create_mailing(user).message_set.create(subject='Subject', body='Body')
+        self.ok = SMTPReply.objects.create(code=250, text='OK')
+        self.rejected = SMTPReply.objects.create(code=550, text='Rejected')
+
+    def add_log(self, timestamp, status=Log.SUCCESS, reply=None):
+        log = Log.objects.create(message=self.message, recipient='client@test.local', status=status,
+                                 reply=reply or self.ok)
+        Log.objects.filter(pk=log.pk).update(timestamp=timestamp)
+        return log
+
+    def test_archive_removes_whole_days_before_cutoff(self):
+        self.add_log(utc(2026, 1, 9, 1))
+        self.add_log(utc(2026, 1, 9, 23))
+        self.add_log(utc(2026, 1, 9, 12), Log.ERROR, self.rejected)
+        self.add_log(utc(2026, 1, 10, 8))
+        # Сутки срока хранения еще не прошли целиком - строка остается до следующего запуска.
+        kept = [self.add_log(utc(2026, 1, 12, 3)).pk, self.add_log(utc(2026, 1, 13)).pk]
+
+        with tempfile.TemporaryDirectory() as archive_dir:
+            removed = archive_old_logs(utc(2026, 1, 12, 6), archive_dir)
+            with gzip.open(Path(archive_dir) / 'mailing_log_2026-01-09.csv.gz', 'rt') as archive:
+                rows = list(csv.reader(archive))
+
+        self.assertEqual(removed, 4)
+        self.assertCountEqual(Log.objects.values_list('pk', flat=True), kept)
+        self.assertEqual(rows[0], ['id', 'timestamp', 'message_id', 'client_id', 'recipient', 'status',
+                                   'reply_code', 'reply_text'])
+        self.assertEqual(sorted(row[-2] for row in rows[1:]), ['250', '250', '550'])
+        self.assertCountEqual(
+            LogRollup.objects.values_list('day', 'status', 'reply_id', 'count'),
+            [(date(2026, 1, 9), Log.SUCCESS, self.ok.pk, 2), (date(2026, 1, 9), Log.ERROR, self.rejected.pk, 1),
+             (date(2026, 1, 10), Log.SUCCESS, self.ok.pk, 1)]
+        )
+
+    def test_rollup_rerun_overwrites_counts(self):
+        self.add_log(utc(2026, 1, 9, 1))
+        self.add_log(utc(2026, 1, 9, 2))
+        self.assertEqual(rollup(Log.objects.all()), 1)
+        self.assertEqual(rollup(Log.objects.all()), 1)
+        self.assertEqual(list(LogRollup.objects.values_list('count', flat=True)), [2])
+
+
+def populate(owner, size):
+    """size клиентов, рассылок, записей журнала, сегментов и записей блога владельца owner."""
+    now = timezone.now()
+    tags = Tag.objects.bulk_create([Tag(owner=owner, name='tag-%s' % i) for i in range(2)])
+    clients = Client.objects.bulk_create([
+        Client(email='client-%s@test.local' % i, full_name='Client %s' % i, owner=owner) for i in range(size)
+    ])
+    Client.tags.through.objects.bulk_create([
+        Client.tags.through(client=client, tag=tag) for client in clients for tag in tags
+    ])
+    mailings = [create_mailing(owner) for i in range(size)]
+    Mailing.objects.filter(pk__in=[mailing.pk for mailing in mailings]).update(next_run_at=now)
+    # По одному получателю: outbox тика на 50 рассылок укладывается в одну вставку даже на SQLite,
+    # который делит bulk_create по 999 параметров.
+    Mailing.recipients.through.objects.bulk_create([
+        Mailing.recipients.through(mailing=mailing, client=clients[0]) for mailing in mailings
+    ])
+    # Рассылка с size сообщениями для страниц рассылки; она не запущена и в тик не попадает.
+    shown = create_mailing(owner, status='created')
+    messages = Message.objects.bulk_create(
+        [Message(mailing=mailing, subject='Subject', body='Body', owner=owner) for mailing in mailings]
+        + [Message(mailing=shown, subject='Subject', body='Body', owner=owner) for i in range(size)]
+    )
+    reply = SMTPReply.objects.create(code=250, text='OK')
+    Log.objects.bulk_create([
+        Log(message=messages[i], client=client, recipient=client.email, status=Log.SUCCESS, reply=reply)
+        for i, client in enumerate(clients)
+    ])
+    segments = Segment.objects.bulk_create([Segment(name='Segment %s' % i, owner=owner) for i in range(size)])
+    Segment.tags.through.objects.bulk_create([
+        Segment.tags.through(segment=segment, tag=tag) for segment in segments for tag in tags
+    ])
+    posts = BlogPost.objects.bulk_create([
+        BlogPost(title='Post %s' % i, slug='post-%s' % i, content='Content', preview_image='test.png', owner=owner)
+        for i in range(size)
+    ])
+    return {'mailing': shown, 'post': posts[0]}
+
+
+@override_settings(CACHES=LOCMEM_CACHE, CACHE_ENABLED=False)
+class QueryBudgetTests(TestCase):
+    """
+    Бюджет запросов к БД страниц и тика диспетчера на нескольких размерах данных. Бюджет
+    постоянный: запросов столько же при 1 строке, сколько при 50, иначе это N+1. Новая
+    страница добавляется строкой в view_budgets; повторяющиеся запросы страницы в работе
+    показывает DuplicateQueryMiddleware (QUERY_DEBUG).
+    """
+    sizes = (1, 10, 50)
+    # Чтение сессии, пользователя, его групп и прав входит в бюджет каждой страницы.
+    view_budgets = [
+        ('mailing:home', lambda data: {}, 6),
+        ('mailing:mailing', lambda data: {}, 6),
+        ('mailing:mailing_detail', lambda data: {'pk': data['mailing'].pk}, 7),
+        ('mailing:client_list', lambda data: {}, 6),
+        ('mailing:message_list', lambda data: {'mailing_pk': data['mailing'].pk}, 6),
+        ('mailing:segment_list', lambda data: {}, 7),
+        ('mailing:delivery_report', lambda data: {}, 6),
+        ('blog:list', lambda data: {}, 6),
+        ('blog:detail', lambda data: {'slug': data['post'].slug}, 6),
+    ]
+    tick_budget = 18
+
+    def setUp(self):
+        self.user = User.objects.create(email='manager@test.local', is_superuser=True)
+
+    def sized_data(self):
+        """Для каждого размера - данные в точке сохранения, которая откатывается после проверки."""
+        for size in self.sizes:
+            cache.clear()
+            # Id ответов SMTP кэшируются в процессе, а строки откатываются вместе с данными.
+            logs._reply_ids.clear()
+            with transaction.atomic():
+                yield size, populate(self.user, size)
+                transaction.set_rollback(True)
+
+    def test_views(self):
+        self.client.force_login(self.user)
+        for size, data in self.sized_data():
+            for route, kwargs, budget in self.view_budgets:
+                with self.subTest(route=route, size=size):
+                    url = reverse(route, kwargs=kwargs(data))
+                    # Первый запрос прогревает счетчики и пул записей блога в кэше.
+                    self.assertEqual(self.client.get(url).status_code, 200)
+                    with self.assertNumQueries(budget):
+                        self.client.get(url)
+
+    def test_send_mailings_tick(self):
+        sink = SMTPSink().start_in_thread()
+        self.addCleanup(sink.stop_thread)
+        # Весь outbox тика - одна пачка: число пачек растет с числом писем, а не рассылок.
+        with override_settings(MAILING_SEND_CHUNK_SIZE=100000, **sink_email_settings(sink)):
+            for size, data in self.sized_data():
+                with self.subTest(size=size), self.assertNumQueries(self.tick_budget):
+                    result = send_mailings()
+                self.assertEqual(result.mailings, size)
@@ -0,0 +1,165 @@
+import logging
+import time
+import uuid
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Token bucket, состояние которого лежит в кэше и поэтому общее для всех воркеров и узлов,
+    использующих один кэш-бэкенд. Ведро пополняется на rate токенов в секунду до burst.
+    Запись состояния обновляется под коротким замком через атомарный cache.add; если замок
+    не удалось взять за секунду, токен не выдается и отправка откладывается.
+    """
+
+    def __init__(self, key, rate, burst=None):
+        self.key = 'throttle:bucket:%s' % key
+        self.lock_key = self.key + ':lock'
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        # Запись живет вдвое дольше полного пополнения ведра, после этого ведро и так полное.
+        self.ttl = max(60, int(self.burst / self.rate) * 2)
+
+    def _lock(self):
+        """Берет замок записи ведра. Возвращает токен владельца или None, если замок занят."""
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + 1
+        while not cache.add(self.lock_key, token, timeout=1):
+            if time.monotonic() > deadline:
+                logger.warning("Could not lock throttle bucket %s", self.key)
+                return None
+            time.sleep(0.001)
+        return token
+
+    def _unlock(self, token):
+        # Замок мог истечь и достаться другому процессу: удаляем только свой.
+        if cache.get(self.lock_key) == token:
+            cache.delete(self.lock_key)
+
+    def reserve(self, max_wait):
+        """
+        Резервирует один токен. Возвращает задержку в секундах, после которой токен можно
+        использовать, или None, если ждать пришлось бы дольше max_wait или ведро занято
+        (токен не берется).
+        """
+        token = self._lock()
+        if token is None:
+            return None
+        try:
+            now = time.time()
+            tokens, stamp = cache.get(self.key) or (self.burst, now)
+            tokens = min(self.burst, tokens + (now - stamp) * self.rate)
+            delay = max(0.0, (1 - tokens) / self.rate)
+            if delay > max_wait:
+                return None
+            cache.set(self.key, (tokens - 1, now), timeout=self.ttl)
+            return delay
+        finally:
+            self._unlock(token)
+
+    def refund(self):
+        token = self._lock()
+        if token is None:
+            # Токен пропадает: ведро лишь чуть строже, чем нужно.
+            return
+        try:
+            state = cache.get(self.key)
+            if state is not None:
+                cache.set(self.key, (min(self.burst, state[0] + 1), state[1]), timeout=self.ttl)
+        finally:
+            self._unlock(token)
+
+
+class DailyQuota:
+    """Счетчик писем за сутки (UTC) в кэше; cache.incr атомарен, поэтому общий для всех узлов."""
+
+    def __init__(self, key, limit):
+        self.key = key
+        self.limit = limit
+
+    def _day_key(self):
+        return 'throttle:day:%s:%s' % (self.key, datetime.now(dt_timezone.utc).strftime('%Y%m%d'))
+
+    def take(self):
+        day_key = self._day_key()
+        cache.add(day_key, 0, timeout=2 * 24 * 60 * 60)
+        if cache.incr(day_key) > self.limit:
+            cache.decr(day_key)
+            return False
+        return True
+
+    def give_back(self):
+        try:
+            cache.decr(self._day_key())
+        except ValueError:
+            pass
+
+
+class Throttle:
+    """
+    Ограничитель скорости отправки: общий token bucket на почтовый аккаунт, суточная квота
+    аккаунта и, если включено, отдельный bucket на домен получателя. Настройки задаются
+    параметрами MAILING_ACCOUNT_RATE, MAILING_ACCOUNT_BURST, MAILING_ACCOUNT_DAILY_LIMIT,
+    MAILING_DOMAIN_RATE и MAILING_DOMAIN_BURST; нулевая скорость или квота отключает ограничение.
+    """
+
+    def __init__(self, account=None):
+        self.account = account or settings.EMAIL_HOST_USER
+        self.max_wait = settings.MAILING_THROTTLE_MAX_WAIT
+        self.account_bucket = None
+        if settings.MAILING_ACCOUNT_RATE:
+            self.account_bucket = TokenBucket(
+                'account:%s' % self.account, settings.MAILING_ACCOUNT_RATE, settings.MAILING_ACCOUNT_BURST
+            )
+        self.daily_quota = None
+        if settings.MAILING_ACCOUNT_DAILY_LIMIT:
+            self.daily_quota = DailyQuota('account:%s' % self.account, settings.MAILING_ACCOUNT_DAILY_LIMIT)
+
+    @property
+    def enabled(self):
+        return bool(self.account_bucket or self.daily_quota or settings.MAILING_DOMAIN_RATE)
+
+    def domain_bucket(self, recipient):
+        if not settings.MAILING_DOMAIN_RATE:
+            return None
+        domain = recipient.rpartition('@')[2].lower()
+        return TokenBucket('domain:%s' % domain, settings.MAILING_DOMAIN_RATE, settings.MAILING_DOMAIN_BURST)
+
+    def reserve(self, recipient):
+        """
+        Резервирует право отправить одно письмо recipient. Возвращает задержку перед отправкой
+        в секундах или None, если лимит исчерпан надолго (суточная квота или ожидание дольше
+        MAILING_THROTTLE_MAX_WAIT) и отправку нужно отложить.
+        """
+        if self.daily_quota and not self.daily_quota.take():
+            logger.warning("Daily send quota of %s is exhausted", self.account)
+            return None
+        delay = 0.0
+        reserved = []
+        for bucket in (self.account_bucket, self.domain_bucket(recipient)):
+            if bucket is None:
+                continue
+            bucket_delay = bucket.reserve(self.max_wait)
+            if bucket_delay is None:
+                for taken in reserved:
+                    taken.refund()
+                if self.daily_quota:
+                    self.daily_quota.give_back()
+                return None
+            reserved.append(bucket)
+            delay = max(delay, bucket_delay)
+        return delay
+
+    def wait(self, recipient):
+        """Блокирует поток до момента, когда письмо recipient можно отправить. False - отправку отложить."""
+        delay = self.reserve(recipient)
+        if delay is None:
+            return False
+        if delay:
+            time.sleep(delay)
+        return True
@@ -2,9 +2,10 @@ from django.urls import path
 from .views import (
     MailingCreateView, MailingDetailView, MessageCreateView, ClientListView, MailingListView, HomeView,
     DeliveryReportView, MailingDeleteView, ClientCreateView, MailingUpdateView, MessageUpdateView,
-    MessageDeleteView, ClientUpdateView, ClientDeleteView, MessageListView, MailingToggleStatusView
+    MessageDeleteView, ClientUpdateView, ClientDeleteView, MessageListView, MailingToggleStatusView,
+    DeliveryLogExportView, ClientExportView, ClientImportView, SegmentListView, SegmentCreateView,
+    SegmentUpdateView, SegmentDeleteView
 )
-from django.views.decorators.cache import cache_page
 
 app_name = 'mailing'
 urlpatterns = [
@@ -13,17 +14,22 @@ urlpatterns = [
     path('create_mailing/', MailingCreateView.as_view(), name='create_mailing'),
     path('mailing/delete/<int:pk>/', MailingDeleteView.as_view(), name='delete_mailing'),
     path('mailing/update/<int:pk>/', MailingUpdateView.as_view(), name='update_mailing'),
-    path('mailing/<int:pk>/', cache_page(60)(MailingDetailView.as_view()), name='mailing_detail'),
+    path('mailing/<int:pk>/', MailingDetailView.as_view(), name='mailing_detail'),
     path('clients/', ClientListView.as_view(), name='client_list'),
+    path('clients/export/', ClientExportView.as_view(), name='export_clients'),
+    path('clients/import/', ClientImportView.as_view(), name='import_clients'),
     path('clients/create/', ClientCreateView.as_view(), name='create_client'),
     path('clients/update/<int:pk>/', ClientUpdateView.as_view(), name='update_client'),
     path('clients/delete/<int:pk>/', ClientDeleteView.as_view(), name='delete_client'),
+    path('segments/', SegmentListView.as_view(), name='segment_list'),
+    path('segments/create/', SegmentCreateView.as_view(), name='create_segment'),
+    path('segments/update/<int:pk>/', SegmentUpdateView.as_view(), name='update_segment'),
+    path('segments/delete/<int:pk>/', SegmentDeleteView.as_view(), name='delete_segment'),
     path('mailing/<int:mailing_pk>/message', MessageListView.as_view(), name='message_list'),
     path('mailing/toggle_status/<int:pk>/', MailingToggleStatusView.as_view(), name='mailing_toggle_status'),
     path('mailing/<int:mailing_pk>/create_message/', MessageCreateView.as_view(), name='create_message'),
     path('mailing/<int:mailing_pk>/update_message/<int:pk>/', MessageUpdateView.as_view(), name='update_message'),
     path('mailing/<int:mailing_pk>/delete_message/<int:pk>/', MessageDeleteView.as_view(), name='delete_message'),
-    path('delivery_report/', cache_page(60)(DeliveryReportView.as_view()), name='delivery_report'),
+    path('delivery_report/', DeliveryReportView.as_view(), name='delivery_report'),
+    path('delivery_report/export/', DeliveryLogExportView.as_view(), name='export_delivery_logs'),
 ]
-
-
@@ -0,0 +1,110 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+# Кэш страниц с учетом прав. Кэшируется только основная часть страницы (content_template_name):
+# шапка с адресом пользователя и CSRF-токеном рисуется на каждый запрос. Ключ собирается из
+# имени представления, области видимости (все данные или только свои), аргументов маршрута,
+# параметров запроса и версий данных, от которых страница зависит. Сигналы и массовые записи
+# меняют версию, и прежние записи становятся недостижимы, поэтому TTL может быть большим.
+# Версии должны быть общими для всех процессов, так что без общего кэша (CACHE_ENABLED)
+# страницы не кэшируются.
+VERSION_KEY = 'viewcache:version:%s'
+PENDING_KEY = 'viewcache:pending:%s'
+THROTTLE_KEY = 'viewcache:throttle:%s'
+CONTENT_KEY = 'viewcache:%s:%s:%s'
+
+
+def enabled():
+    return settings.CACHE_ENABLED
+
+
+def get_versions(names):
+    keys = [VERSION_KEY % name for name in names]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # Начальная версия - текущее время в миллисекундах: версия, вытесненная из кэша
+            # и созданная заново, не совпадет ни с одной из прежних.
+            cache.add(key, int(time.time() * 1000), None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def bump(*names):
+    """Делает недостижимыми закэшированные страницы, зависящие от данных names."""
+    if not enabled():
+        return
+    for name in names:
+        try:
+            cache.incr(VERSION_KEY % name)
+        except ValueError:
+            # Версии нет в кэше: ее создаст следующее чтение, уже новой.
+            pass
+
+
+def bump_throttled(name, interval):
+    """
+    bump для частых изменений (запись журнала доставки под нагрузкой): версия меняется не
+    чаще раза в interval секунд, иначе кэш страниц почти не попадал бы. Изменение внутри
+    интервала остается отложенным, его применяет bump_pending.
+    """
+    if not enabled():
+        return
+    cache.set(PENDING_KEY % name, 1, None)
+    if cache.add(THROTTLE_KEY % name, 1, interval):
+        bump_pending(name)
+
+
+def bump_pending(name):
+    """Применяет отложенный bump_throttled, если он есть."""
+    if enabled() and cache.delete(PENDING_KEY % name):
+        bump(name)
+
+
+def scope(roles):
+    return 'all' if roles.can_see_all else 'user:%s' % roles.user.pk
+
+
+class CachedContentMixin:
+    """
+    Кэширует отрисованный content_template_name; шаблон страницы выводит его как {{ content }}.
+    Контекст основной части подкласс дополняет в get_content_context_data, а не в
+    get_context_data. Подкласс перечисляет в get_cache_dependencies имена версий данных
+    страницы и дополняет ключ в get_cache_key_parts. При попадании в кэш контекст представления не строится и
+    запросов за данными страницы нет; проверки доступа в dispatch выполняются как обычно.
+    """
+    content_template_name = None
+    cache_dependencies = ()
+
+    def get_cache_dependencies(self):
+        return self.cache_dependencies
+
+    def get_cache_key_parts(self):
+        # Аргументы маршрута (pk объекта) входят в ключ: версии разных объектов могут совпасть.
+        return [sorted(self.kwargs.items()), sorted(self.request.GET.lists())]
+
+    def get_content_context_data(self, **kwargs):
+        return super().get_context_data(**kwargs)
+
+    def get_content_cache_key(self):
+        parts = [*self.get_cache_key_parts(), get_versions(self.get_cache_dependencies())]
+        digest = hashlib.md5(repr(parts).encode(), usedforsecurity=False).hexdigest()
+        return CONTENT_KEY % (self.request.resolver_match.view_name, scope(self.request.roles), digest)
+
+    def get_context_data(self, **kwargs):
+        key = self.get_content_cache_key() if enabled() else None
+        content = cache.get(key) if key else None
+        if content is not None:
+            context = {'view': self, **(self.extra_context or {})}
+        else:
+            context = self.get_content_context_data(**kwargs)
+            content = render_to_string(self.content_template_name, context, self.request)
+            if key:
+                cache.set(key, content, settings.MAILING_VIEW_CACHE_TTL)
+        context['content'] = mark_safe(content)
+        return context
@@ -1,13 +1,19 @@
-from datetime import timedelta
-from random import sample
+import csv
+from datetime import datetime, time, timedelta
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
-from django.http import Http404, HttpResponseRedirect
+from django.core.exceptions import ImproperlyConfigured
+from django.http import Http404, HttpResponseBadRequest, HttpResponseRedirect, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django.urls import reverse_lazy, reverse
-from django.views.generic import TemplateView, ListView, CreateView, DetailView, DeleteView, UpdateView
-from blog.models import BlogPost
-from .models import Mailing, Client, Message, Log
-from .forms import MailingForm, MessageForm, ClientForm
+from django.utils import timezone
+from django.views.generic import View, FormView, TemplateView, ListView, CreateView, DetailView, DeleteView, UpdateView
+from .models import Mailing, Client, Message, Log, Segment
+from .forms import MailingForm, MessageForm, ClientForm, ClientImportForm, DeliveryReportFilterForm, SegmentForm
+from .exports import FORMATS, client_export_queryset, export_rows, log_export_queryset
+from .imports import import_clients, read_uploaded_csv
+from .pagination import KeysetPaginator
+from .viewcache import CachedContentMixin
+from . import stats
 
 
 class HomeView(TemplateView):
@@ -18,17 +24,8 @@ class HomeView(TemplateView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['count_mailing'] = Mailing.objects.count()
-        active_mailings_count = Mailing.objects.filter(status__in=['created', 'started']).count()
-        context['active_mailings_count'] = active_mailings_count
-        unique_clients_count = Client.objects.filter(is_active=True).distinct().count()
-        context['unique_clients_count'] = unique_clients_count
-        all_posts = list(BlogPost.objects.all())
-        context['random_blog_posts'] = sample(all_posts, min(3, len(all_posts)))
-        context['object_list'] = Mailing.objects.all()
-        user = self.request.user
-        user_group_names = [group.name for group in user.groups.all()]
-        context['user_group_names'] = user_group_names
+        context.update(stats.get_counters())
+        context['random_blog_posts'] = stats.random_blog_posts(3)
         return context
 
 
@@ -38,18 +35,13 @@ class MailingListView(LoginRequiredMixin, PermissionRequiredMixin, ListView):
     context_object_name = 'mailings'
     permission_required = 'mailing.view_mailing'
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        user = self.request.user
-        user_group_names = [group.name for group in user.groups.all()]
-        context['user_group_names'] = user_group_names
-        return context
-
     def get_queryset(self):
-        if self.request.user.is_superuser or self.request.user.groups.filter(name='Managers').exists():
-            return super().get_queryset()
+        # Шаблон сравнивает владельца каждой рассылки с пользователем.
+        queryset = super().get_queryset().select_related('owner')
+        if self.request.roles.can_see_all:
+            return queryset
         else:
-            return super().get_queryset().filter(owner=self.request.user)
+            return queryset.filter(owner=self.request.user)
 
 
 class MailingCreateView(LoginRequiredMixin, PermissionRequiredMixin, CreateView):
@@ -63,14 +55,7 @@ class MailingCreateView(LoginRequiredMixin, PermissionRequiredMixin, CreateView)
         new_mailing.owner = self.request.user
 
         # Set end_time based on frequency
-        if new_mailing.frequency == 'daily':
-            new_mailing.end_time = new_mailing.start_time + timedelta(days=1)
-        elif new_mailing.frequency == 'weekly':
-            new_mailing.end_time = new_mailing.start_time + timedelta(days=7)
-        elif new_mailing.frequency == 'monthly':
-            new_mailing.end_time = new_mailing.start_time + timedelta(days=30)
-        else:
-            new_mailing.end_time = None
+        new_mailing.end_time = new_mailing.default_end_time()
 
         new_mailing.save()
         self.mailing_pk = new_mailing.pk
@@ -87,7 +72,7 @@ class MailingCreateView(LoginRequiredMixin, PermissionRequiredMixin, CreateView)
 
 class MailingUpdateView(LoginRequiredMixin, UpdateView):
     model = Mailing
-    fields = ('start_time', 'frequency', 'recipients', 'status')
+    form_class = MailingForm
     template_name = 'mailing/mailing_form.html'
     success_url = reverse_lazy('mailing:mailing')
     permission_required = 'mailing.change_mailing'
@@ -97,20 +82,18 @@ class MailingUpdateView(LoginRequiredMixin, UpdateView):
         updated_mailing.owner = self.request.user
 
         # Set end_time based on frequency
-        if updated_mailing.frequency == 'daily':
-            updated_mailing.end_time = updated_mailing.start_time + timedelta(days=1)
-        elif updated_mailing.frequency == 'weekly':
-            updated_mailing.end_time = updated_mailing.start_time + timedelta(days=7)
-        elif updated_mailing.frequency == 'monthly':
-            updated_mailing.end_time = updated_mailing.start_time + timedelta(days=30)
-        else:
-            updated_mailing.end_time = None
+        updated_mailing.end_time = updated_mailing.default_end_time()
 
         is_active = self.request.POST.get('is_active')
         updated_mailing.is_active = is_active == 'on'
         updated_mailing.save()
         return super().form_valid(form)
 
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        kwargs['user'] = self.request.user
+        return kwargs
+
     def get_object(self, queryset=None):
         mailing = super().get_object(queryset)
         if not self.request.user.is_superuser and self.request.user != mailing.owner:
@@ -118,14 +101,18 @@ class MailingUpdateView(LoginRequiredMixin, UpdateView):
         return mailing
 
 
-class MailingDetailView(LoginRequiredMixin, PermissionRequiredMixin, DetailView):
+class MailingDetailView(LoginRequiredMixin, PermissionRequiredMixin, CachedContentMixin, DetailView):
     model = Mailing
     template_name = 'mailing/mailing_detail.html'
+    content_template_name = 'mailing/mailing_detail_content.html'
     context_object_name = 'mailing'
     permission_required = 'mailing.view_mailing'
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
+    def get_cache_dependencies(self):
+        return ['mailing:%s' % self.kwargs['pk']]
+
+    def get_content_context_data(self, **kwargs):
+        context = super().get_content_context_data(**kwargs)
         context['messages'] = Message.objects.filter(mailing=self.object)
         return context
 
@@ -141,8 +128,7 @@ class MailingDeleteView(LoginRequiredMixin, PermissionRequiredMixin, DeleteView)
     def get_object(self, queryset=None):
         mailing = super().get_object(queryset)
         mailing = get_object_or_404(Mailing, id=mailing.pk)
-        user_groups = [group.name for group in self.request.user.groups.all()]
-        if mailing.owner != self.request.user and 'Managers' not in user_groups:
+        if mailing.owner != self.request.user and not self.request.roles.is_manager:
             raise Http404
         return mailing
 
@@ -168,15 +154,8 @@ class ClientListView(LoginRequiredMixin, ListView):
             return HttpResponseRedirect(reverse('mailing:client_list'))
         return super().post(request, *args, **kwargs)
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        user = self.request.user
-        context['is_admin'] = user.is_superuser
-        context['is_manager'] = user.groups.filter(name='Manager').exists() or user.groups.filter(name='Managers').exists()
-        return context
-
     def get_queryset(self):
-        if self.request.user.is_superuser or self.request.user.groups.filter(name='Managers').exists():
+        if self.request.roles.can_see_all:
             return super().get_queryset()
         else:
             return super().get_queryset().filter(owner=self.request.user)
@@ -189,6 +168,11 @@ class ClientCreateView(LoginRequiredMixin, PermissionRequiredMixin, CreateView):
     template_name = 'mailing/create_client.html'
     permission_required = 'mailing.add_client'
 
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        kwargs['user'] = self.request.user
+        return kwargs
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['title'] = "Создание нового клиента."
@@ -201,6 +185,20 @@ class ClientCreateView(LoginRequiredMixin, PermissionRequiredMixin, CreateView):
         return super().form_valid(form)
 
 
+class ClientImportView(LoginRequiredMixin, PermissionRequiredMixin, FormView):
+    form_class = ClientImportForm
+    template_name = 'mailing/client_import.html'
+    permission_required = 'mailing.add_client'
+
+    def form_valid(self, form):
+        try:
+            result = import_clients(read_uploaded_csv(form.cleaned_data['file']), owner=self.request.user)
+        except (ValueError, UnicodeDecodeError, csv.Error) as error:
+            form.add_error('file', str(error))
+            return self.form_invalid(form)
+        return self.render_to_response(self.get_context_data(form=ClientImportForm(), result=result))
+
+
 class ClientUpdateView(LoginRequiredMixin, PermissionRequiredMixin, UpdateView):
     model = Client
     form_class = ClientForm
@@ -208,10 +206,14 @@ class ClientUpdateView(LoginRequiredMixin, PermissionRequiredMixin, UpdateView):
     template_name = 'mailing/client_form.html'
     permission_required = 'mailing.change_client'
 
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        kwargs['user'] = self.request.user
+        return kwargs
+
     def get_object(self, queryset=None):
         client = super().get_object(queryset)
-        user = self.request.user
-        if user != client.owner and not user.is_superuser and not user.groups.filter(name='Managers').exists():
+        if not self.request.roles.can_manage(client.owner):
             raise Http404("You do not have permission to access this client")
         return client
 
@@ -229,6 +231,56 @@ class ClientDeleteView(LoginRequiredMixin, PermissionRequiredMixin, DeleteView):
         return client
 
 
+class SegmentListView(LoginRequiredMixin, ListView):
+    model = Segment
+    template_name = 'mailing/segment_list.html'
+    context_object_name = 'segments'
+
+    def get_queryset(self):
+        return super().get_queryset().filter(owner=self.request.user).prefetch_related('tags')
+
+
+class SegmentFormMixin:
+    model = Segment
+    form_class = SegmentForm
+    template_name = 'mailing/segment_form.html'
+    success_url = reverse_lazy('mailing:segment_list')
+
+    def get_queryset(self):
+        return Segment.objects.filter(owner=self.request.user)
+
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        kwargs['user'] = self.request.user
+        return kwargs
+
+
+class SegmentCreateView(LoginRequiredMixin, SegmentFormMixin, CreateView):
+
+    def form_valid(self, form):
+        form.instance.owner = self.request.user
+        return super().form_valid(form)
+
+
+class SegmentUpdateView(LoginRequiredMixin, SegmentFormMixin, UpdateView):
+    pass
+
+
+class SegmentDeleteView(LoginRequiredMixin, DeleteView):
+    model = Segment
+    template_name = 'mailing/segment_confirm_delete.html'
+    success_url = reverse_lazy('mailing:segment_list')
+
+    def get_queryset(self):
+        return Segment.objects.filter(owner=self.request.user)
+
+    def form_valid(self, form):
+        if self.object.mailing_set.exists():
+            form.add_error(None, 'Сегмент используется в рассылках')
+            return self.render_to_response(self.get_context_data(form=form))
+        return super().form_valid(form)
+
+
 class MessageListView(LoginRequiredMixin, PermissionRequiredMixin, ListView):
     model = Message
     template_name = 'mailing/message_list.html'
@@ -237,13 +289,10 @@ class MessageListView(LoginRequiredMixin, PermissionRequiredMixin, ListView):
 
     def get_queryset(self):
         mailing_pk = self.kwargs['mailing_pk']
-        return Message.objects.filter(mailing__pk=mailing_pk)
+        return Message.objects.filter(mailing__pk=mailing_pk).select_related('mailing')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        user = self.request.user
-        user_group_names = [group.name for group in user.groups.all()]
-        context['user_group_names'] = user_group_names
         context['mailing_pk'] = self.kwargs['mailing_pk']
         return context
 
@@ -292,8 +341,7 @@ class MailingToggleStatusView(LoginRequiredMixin, PermissionRequiredMixin, Updat
 
     def post(self, request, *args, **kwargs):
         mailing = self.get_object()
-        user = request.user
-        if user.is_superuser or user.groups.filter(name='Managers').exists() or mailing.owner == user:
+        if request.roles.can_manage(mailing.owner):
             action = request.POST.get('action')
             if action == 'deactivate':
                 mailing.status = 'stopped'
@@ -304,14 +352,8 @@ class MailingToggleStatusView(LoginRequiredMixin, PermissionRequiredMixin, Updat
         else:
             raise Http404("You do not have permission to change the mailing status")
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        context['is_admin'] = self.request.user.is_superuser
-        context['is_manager'] = self.request.user.groups.filter(name='Manager').exists()
-        return context
-
     def get_queryset(self):
-        if self.request.user.is_superuser or self.request.user.groups.filter(name='Managers').exists():
+        if self.request.roles.can_see_all:
             return super().get_queryset()
         else:
             return super().get_queryset().filter(owner=self.request.user)
@@ -330,11 +372,120 @@ class MessageDeleteView(LoginRequiredMixin, PermissionRequiredMixin, DeleteView)
         return client
 
 
-class DeliveryReportView(LoginRequiredMixin, PermissionRequiredMixin, ListView):
+def start_of_day(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+class DeliveryLogFilterMixin:
+    """Фильтры отчета о доставке из GET-параметров; без роли Managers видны только свои рассылки."""
+
+    def get_filter_form(self):
+        return DeliveryReportFilterForm(
+            self.request.GET or None, user=self.request.user, see_all=self.request.roles.can_see_all
+        )
+
+    def get_queryset(self):
+        self.filter_form = self.get_filter_form()
+        queryset = Log.objects.select_related('reply', 'message')
+        if 'owner' not in self.filter_form.fields:
+            queryset = queryset.filter(message__mailing__owner=self.request.user)
+        if not self.filter_form.is_bound:
+            return queryset
+        if not self.filter_form.is_valid():
+            return queryset.none()
+        filters = self.filter_form.cleaned_data
+        if filters['mailing']:
+            queryset = queryset.filter(message__mailing=filters['mailing'])
+        if filters.get('owner'):
+            queryset = queryset.filter(message__mailing__owner=filters['owner'])
+        if filters['status']:
+            queryset = queryset.filter(status=filters['status'])
+        if filters['date_from']:
+            queryset = queryset.filter(timestamp__gte=start_of_day(filters['date_from']))
+        if filters['date_to']:
+            queryset = queryset.filter(timestamp__lt=start_of_day(filters['date_to'] + timedelta(days=1)))
+        return queryset
+
+
+class DeliveryReportView(
+    LoginRequiredMixin, PermissionRequiredMixin, DeliveryLogFilterMixin, CachedContentMixin, ListView
+):
     model = Log
     template_name = 'mailing/delivery_report.html'
+    content_template_name = 'mailing/delivery_report_content.html'
+    cache_dependencies = ('log', 'mailing', 'client')
     context_object_name = 'delivery_logs'
     permission_required = 'mailing.view_log'
 
-    def get_queryset(self):
-        return Log.objects.filter(status='success')
+    paginate_by = 50
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator = KeysetPaginator(queryset, page_size)
+        page = paginator.page(after=self.request.GET.get('after'), before=self.request.GET.get('before'))
+        return paginator, page, page.object_list, page.has_other_pages()
+
+    def get_content_cache_key(self):
+        # Ошибка фильтра («нет такого пользователя») зависит от данных вне версий страницы.
+        if self.filter_form.is_bound and not self.filter_form.is_valid():
+            return None
+        return super().get_content_cache_key()
+
+    def get_content_context_data(self, **kwargs):
+        context = super().get_content_context_data(**kwargs)
+        context['filter_form'] = self.filter_form
+        page = context['page_obj']
+        params = self.request.GET.copy()
+        for name in ('after', 'before'):
+            params.pop(name, None)
+        if page.has_next():
+            params['after'] = page.next_cursor
+            context['next_page_query'] = params.urlencode()
+            del params['after']
+        if page.has_previous():
+            params['before'] = page.previous_cursor
+            context['previous_page_query'] = params.urlencode()
+            del params['before']
+        context['export_query'] = params.urlencode()
+        return context
+
+
+class ExportView(LoginRequiredMixin, PermissionRequiredMixin, View):
+    """
+    Потоковая выгрузка в CSV или NDJSON (параметр format). Подкласс задает filename и
+    get_export, возвращающий (queryset, поля) - как функции выгрузки из mailing.exports.
+    """
+    filename = None
+
+    def get_export(self):
+        raise ImproperlyConfigured(
+            '%s must define get_export() returning (queryset, fields) for the export.' % type(self).__name__
+        )
+
+    def get(self, request, *args, **kwargs):
+        fmt = request.GET.get('format', 'csv')
+        if fmt not in FORMATS:
+            return HttpResponseBadRequest('Неизвестный формат выгрузки')
+        queryset, fields = self.get_export()
+        response = StreamingHttpResponse(export_rows(queryset, fields, fmt), content_type=FORMATS[fmt])
+        response['Content-Disposition'] = 'attachment; filename="%s.%s"' % (self.filename, fmt)
+        return response
+
+
+class DeliveryLogExportView(DeliveryLogFilterMixin, ExportView):
+    permission_required = 'mailing.view_log'
+    filename = 'delivery_logs'
+
+    def get_export(self):
+        # select_related не нужен: values_list сам делает join к нужным колонкам.
+        return log_export_queryset(self.get_queryset().select_related(None))
+
+
+class ClientExportView(ExportView):
+    permission_required = 'mailing.view_client'
+    filename = 'clients'
+
+    def get_export(self):
+        queryset = Client.objects.all()
+        if not self.request.roles.can_see_all:
+            queryset = queryset.filter(owner=self.request.user)
+        return client_export_queryset(queryset)
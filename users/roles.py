@@ -0,0 +1,113 @@
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+
+MANAGERS_GROUP = 'Managers'
+# Прежние представления проверяли то 'Managers', то 'Manager': в базах есть обе группы.
+MANAGER_GROUPS = frozenset({MANAGERS_GROUP, 'Manager'})
+
+# Роли кэшируются под ключом с двумя версиями: версией пользователя (меняется, когда меняются
+# его группы или личные права) и общей версией (меняется, когда меняются права групп или
+# удаляется группа). Смена версии делает прежнюю запись недостижимой, удалять ее не нужно.
+GLOBAL_VERSION_KEY = 'roles:version'
+USER_VERSION_KEY = 'roles:version:%s'
+ROLES_KEY = 'roles:%s:%s:%s'
+
+
+class Roles:
+    """Группы и права пользователя, загруженные один раз на запрос."""
+
+    def __init__(self, user, groups=(), permissions=()):
+        self.user = user
+        self.groups = frozenset(groups)
+        self.permissions = frozenset(permissions)
+
+    @property
+    def is_superuser(self):
+        return self.user.is_active and self.user.is_superuser
+
+    @property
+    def is_manager(self):
+        return not self.groups.isdisjoint(MANAGER_GROUPS)
+
+    @property
+    def can_see_all(self):
+        """Видит и правит чужие рассылки, клиентов и записи блога: суперпользователь или менеджер."""
+        return self.is_superuser or self.is_manager
+
+    def has_perm(self, perm):
+        return self.is_superuser or self.user.is_active and perm in self.permissions
+
+    def can_manage(self, owner):
+        """Может ли пользователь управлять объектом владельца owner."""
+        return self.can_see_all or owner is not None and owner == self.user
+
+
+def get_version(key):
+    version = cache.get(key)
+    if version is None:
+        version = 1
+        cache.add(key, version, None)
+    return version
+
+
+def bump_version(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 2, None)
+
+
+def invalidate_user(user_id):
+    bump_version(USER_VERSION_KEY % user_id)
+
+
+def invalidate_all():
+    bump_version(GLOBAL_VERSION_KEY)
+
+
+def load_roles(user):
+    groups = list(user.groups.values_list('name', flat=True))
+    permissions = ModelBackend().get_all_permissions(user)
+    return {'groups': groups, 'permissions': sorted(permissions)}
+
+
+def get_roles(user):
+    """
+    Роли пользователя из общего кэша или из БД. Заодно заполняет кэш прав ModelBackend у объекта
+    пользователя, чтобы has_perm и PermissionRequiredMixin в этом запросе не ходили в БД.
+    """
+    if not user.is_authenticated:
+        return Roles(user)
+    if not settings.CACHE_ENABLED:
+        # Без общего кэша сброс версии дошел бы только до процесса, где изменились права;
+        # остальные держали бы прежние роли до ROLES_CACHE_TTL. Читаем из БД на каждый запрос.
+        data = load_roles(user)
+    else:
+        key = ROLES_KEY % (user.pk, get_version(GLOBAL_VERSION_KEY), get_version(USER_VERSION_KEY % user.pk))
+        data = cache.get(key)
+        if data is None:
+            data = load_roles(user)
+            cache.set(key, data, settings.ROLES_CACHE_TTL)
+    if user.is_active and not user.is_superuser:
+        user._perm_cache = set(data['permissions'])
+    return Roles(user, data['groups'], data['permissions'])
+
+
+class RolesMiddleware:
+    """
+    Кладет в request.roles роли пользователя до вызова представления, чтобы проверки
+    прав в миксинах уже шли по заполненному кэшу прав. Ставится после AuthenticationMiddleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.roles = get_roles(request.user)
+        return self.get_response(request)
+
+
+def roles(request):
+    """Контекстный процессор: roles в шаблонах."""
+    return {'roles': getattr(request, 'roles', None)}
@@ -0,0 +1,40 @@
+from django.contrib.auth.models import Group
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from users import roles
+from users.models import User
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=User.user_permissions.through)
+def user_roles_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        roles.invalidate_user(instance.pk)
+    elif pk_set:
+        for user_id in pk_set:
+            roles.invalidate_user(user_id)
+    else:
+        # group.user_set.clear(): затронутых пользователей уже не узнать.
+        roles.invalidate_all()
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, **kwargs):
+    # Права суперпользователя и неактивного пользователя зависят от флагов на самой модели.
+    if not created:
+        roles.invalidate_user(instance.pk)
+
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+def group_permissions_changed(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        roles.invalidate_all()
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def group_changed(sender, **kwargs):
+    roles.invalidate_all()
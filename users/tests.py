@@ -1,3 +1,40 @@
-from django.test import TestCase
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.test import TestCase, override_settings
 
-# Create your tests here.
+from users.models import User
+from users.roles import MANAGERS_GROUP, get_roles
+
+LOCMEM_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests'}}
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class RolesTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(email='manager@test.local')
+        self.user.groups.add(Group.objects.create(name=MANAGERS_GROUP))
+
+    def revoke_elsewhere(self):
+        # Удаление строки M2M в обход m2m_changed - как изменение, сделанное в другом процессе.
+        User.groups.through.objects.filter(user=self.user).delete()
+
+    @override_settings(CACHE_ENABLED=False)
+    def test_roles_are_not_cached_without_shared_cache(self):
+        self.assertTrue(get_roles(self.user).is_manager)
+        self.revoke_elsewhere()
+        self.assertFalse(get_roles(User.objects.get(pk=self.user.pk)).is_manager)
+
+    @override_settings(CACHE_ENABLED=True)
+    def test_shared_cache_is_reset_by_group_change(self):
+        self.assertTrue(get_roles(self.user).is_manager)
+        self.user.groups.clear()
+        self.assertFalse(get_roles(User.objects.get(pk=self.user.pk)).is_manager)
+
+    @override_settings(CACHE_ENABLED=False)
+    def test_legacy_manager_group_name(self):
+        self.user.groups.set([Group.objects.create(name='Manager')])
+        roles = get_roles(User.objects.get(pk=self.user.pk))
+        self.assertTrue(roles.is_manager)
+        self.assertTrue(roles.can_see_all)